@@ -0,0 +1,305 @@
+"""
+ANN Index Module
+Approximate nearest-neighbor search with an in-process IVF-flat index: spherical k-means
+centroids partition the normalized vectors into lists, and a query only scores the nprobe
+lists closest to it
+
+The centroids are saved next to the index segments, so other sessions and replicas don't
+retrain them. Measure recall and latency against exact search on the saved index with:
+
+    python ann_index.py --benchmark
+"""
+
+import os
+import time
+import argparse
+
+import numpy as np
+
+import index_store
+
+# Inverted lists (0 picks about 4 * sqrt(number of chunks))
+ANN_NLIST = int(os.getenv("ANN_NLIST", "0"))
+
+# Lists scored per query; higher finds more of the exact neighbors but is slower
+ANN_NPROBE = int(os.getenv("ANN_NPROBE", "16"))
+
+# Smaller indexes are searched exactly
+ANN_MIN_ROWS = int(os.getenv("ANN_MIN_ROWS", "20000"))
+
+# k-means iterations and sampled rows when training the centroids
+ANN_TRAIN_ITERATIONS = int(os.getenv("ANN_TRAIN_ITERATIONS", "10"))
+ANN_TRAIN_SAMPLE = int(os.getenv("ANN_TRAIN_SAMPLE", "65536"))
+
+# Retrain once the index has grown this many times past the rows the centroids were trained on
+ANN_RETRAIN_GROWTH = 2.0
+
+# Bump when the layout of the saved centroids changes; older ones are then retrained
+ANN_FORMAT_VERSION = 1
+
+# Rows assigned to lists per matrix product, bounding the score matrix
+ASSIGN_BLOCK_ROWS = 65536
+
+# Training needs this many sampled rows per list to give stable centroids
+MIN_ROWS_PER_LIST = 39
+
+
+def default_nlist(rows, sample=None):
+    sample = min(rows, ANN_TRAIN_SAMPLE if sample is None else sample)
+    return max(1, min(int(4 * np.sqrt(rows)), sample // MIN_ROWS_PER_LIST))
+
+
+def assign_rows(vectors, centroids):
+    """Index of the closest centroid of every row (all unit-normalized)."""
+    assignments = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), ASSIGN_BLOCK_ROWS):
+        scores = vectors[start:start + ASSIGN_BLOCK_ROWS] @ centroids.T
+        assignments[start:start + len(scores)] = np.argmax(scores, axis=1)
+    return assignments
+
+
+def train_centroids(matrix, nlist=None, iterations=None, sample=None, seed=0):
+    """
+    Spherical k-means on a sample of a unit-normalized matrix.
+
+    Returns:
+        np.ndarray: nlist x dim float32 unit-normalized centroids
+    """
+    iterations = ANN_TRAIN_ITERATIONS if iterations is None else iterations
+    sample = ANN_TRAIN_SAMPLE if sample is None else sample
+    nlist = nlist or default_nlist(len(matrix), sample)
+    rng = np.random.default_rng(seed)
+
+    if len(matrix) > sample:
+        training = matrix[np.sort(rng.choice(len(matrix), size=sample, replace=False))]
+    else:
+        training = matrix
+    nlist = min(nlist, len(training))
+    centroids = training[rng.choice(len(training), size=nlist, replace=False)].copy()
+
+    for _ in range(iterations):
+        assignments = assign_rows(training, centroids)
+        counts = np.bincount(assignments, minlength=nlist)
+        order = np.argsort(assignments, kind="stable")
+        filled = np.flatnonzero(counts)
+        starts = np.concatenate(([0], np.cumsum(counts[filled])[:-1]))
+        sums = np.add.reduceat(training[order], starts, axis=0)
+
+        # Empty lists restart from random rows instead of staying empty
+        empty = np.flatnonzero(counts == 0)
+        centroids[filled] = sums
+        centroids[empty] = training[rng.choice(len(training), size=len(empty), replace=False)]
+        norms = np.sqrt(np.einsum("ij,ij->i", centroids, centroids))[:, None]
+        centroids /= np.where(norms > 0, norms, 1.0)
+    return centroids
+
+
+class IVFIndex:
+    """
+    Inverted lists over the rows of a unit-normalized matrix, which the
+    caller owns and passes to each call. Rows appended to the matrix are
+    added with assign(); the lists are regrouped on the next search.
+    """
+
+    def __init__(self, centroids, trained_rows=0, manifest=None):
+        self.centroids = np.asarray(centroids, dtype=np.float32)
+        self.trained_rows = trained_rows
+        # Saved copy of these centroids, set once they are in GridFS
+        self.manifest = manifest
+        self.assignments = np.empty(0, dtype=np.int32)
+        self._order = None
+        self._offsets = None
+
+    @classmethod
+    def train(cls, matrix, nlist=None, seed=0):
+        ann = cls(train_centroids(matrix, nlist=nlist or ANN_NLIST or None, seed=seed), trained_rows=len(matrix))
+        ann.assign(matrix)
+        return ann
+
+    @property
+    def nlist(self):
+        return len(self.centroids)
+
+    def needs_retraining(self, rows):
+        return rows > self.trained_rows * ANN_RETRAIN_GROWTH
+
+    def assign(self, matrix, start=0):
+        """Put rows start.. of the matrix into their lists (rows before start keep theirs)."""
+        self.assignments = np.concatenate([self.assignments[:start], assign_rows(matrix[start:], self.centroids)])
+        self._order = None
+
+    def _lists(self):
+        if self._order is None:
+            self._order = np.argsort(self.assignments, kind="stable")
+            self._offsets = np.searchsorted(self.assignments[self._order], np.arange(self.nlist + 1))
+        return self._order, self._offsets
+
+    def candidates(self, centroid_scores, nprobe):
+        """Rows of the nprobe lists with the highest centroid scores."""
+        order, offsets = self._lists()
+        nprobe = min(nprobe, self.nlist)
+        probed = np.argpartition(-centroid_scores, nprobe - 1)[:nprobe] if nprobe < self.nlist else range(self.nlist)
+        return np.concatenate([order[offsets[list_id]:offsets[list_id + 1]] for list_id in probed])
+
+    def search(self, matrix, queries, top_k, nprobe=None):
+        """
+        Approximate cosine top-k for unit-normalized queries.
+
+        Returns:
+            tuple: (scores, rows), both of shape queries x top_k, best first, or
+            None when the probed lists hold fewer than top_k rows for a query
+        """
+        nprobe = nprobe or ANN_NPROBE
+        top_scores = np.empty((len(queries), top_k), dtype=np.float32)
+        top_rows = np.empty((len(queries), top_k), dtype=np.int64)
+        centroid_scores = queries @ self.centroids.T
+        for position, query in enumerate(queries):
+            rows = self.candidates(centroid_scores[position], nprobe)
+            if len(rows) < top_k:
+                return None
+            scores = matrix[rows] @ query
+            best = np.argpartition(-scores, top_k - 1)[:top_k] if top_k < len(rows) else np.arange(len(rows))
+            best = best[np.argsort(-scores[best])]
+            top_scores[position] = scores[best]
+            top_rows[position] = rows[best]
+        return top_scores, top_rows
+
+
+def write_centroids(fs, ann):
+    """Store the centroids of an IVFIndex in GridFS and return their manifest."""
+    writer = index_store.PartWriter(fs, "vector_index.ann_centroids", "application/octet-stream")
+    try:
+        writer.write(np.ascontiguousarray(ann.centroids, dtype=np.float32).tobytes())
+    except Exception:
+        writer.abort()
+        raise
+    part = writer.close()
+    return {
+        "format_version": ANN_FORMAT_VERSION,
+        "kind": "ivf_flat",
+        "nlist": ann.nlist,
+        "dim": int(ann.centroids.shape[1]),
+        "trained_rows": ann.trained_rows,
+        "parts": {"centroids": part},
+        "size": part["size"],
+        "compressed_size": part["compressed_size"]
+    }
+
+
+def read_centroids(fs, manifest):
+    """
+    IVFIndex with the saved centroids (no rows assigned yet), or None if they
+    were saved in another format.
+    """
+    if manifest.get("format_version") != ANN_FORMAT_VERSION or manifest.get("kind") != "ivf_flat":
+        return None
+    data = b"".join(index_store.iter_part_blocks(fs, manifest["parts"]["centroids"]))
+    centroids = np.frombuffer(data, dtype=np.float32).reshape(manifest["nlist"], manifest["dim"])
+    return IVFIndex(centroids, trained_rows=manifest["trained_rows"], manifest=manifest)
+
+
+def save_centroids(index_collection, fs, snapshot_id, ann):
+    """
+    Attach the centroids of an IVFIndex to a snapshot document, retiring the
+    centroids it had.
+
+    Returns:
+        bool: True if the snapshot still existed and now references them
+    """
+    manifest = write_centroids(fs, ann)
+    if not index_store.attach_snapshot_part(index_collection, fs, snapshot_id, "ann", manifest):
+        return False
+    ann.manifest = manifest
+    return True
+
+
+def benchmark(vectors, top_k=6, queries=200, nlist=None, nprobes=(4, 8, 16, 32, 64), seed=0):
+    """
+    Recall@top_k and p50/p95 query latency of IVF search at several nprobe
+    values against exact search. The query vectors are stored vectors held
+    out of the searched set, so no query finds itself.
+
+    Returns:
+        list: one dict per search setting, exact search first
+    """
+    rng = np.random.default_rng(seed)
+    vectors = np.array(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    vectors /= np.where(norms > 0, norms, 1.0)
+    held_out = np.zeros(len(vectors), dtype=bool)
+    held_out[rng.choice(len(vectors), size=min(queries, len(vectors) // 10 or 1), replace=False)] = True
+    query_vectors, matrix = vectors[held_out], vectors[~held_out]
+    top_k = min(top_k, len(matrix))
+
+    def timed(search):
+        latencies, results = [], []
+        for query in query_vectors:
+            started_at = time.perf_counter()
+            results.append(set(search(query).tolist()))
+            latencies.append((time.perf_counter() - started_at) * 1000)
+        return results, np.percentile(latencies, 50), np.percentile(latencies, 95)
+
+    exact, p50, p95 = timed(lambda query: np.argpartition(-(matrix @ query), top_k - 1)[:top_k])
+    report = [{"search": "exact", "queries": len(query_vectors), "recall": 1.0, "p50_ms": p50, "p95_ms": p95, "build_s": 0.0}]
+
+    started_at = time.perf_counter()
+    ann = IVFIndex.train(matrix, nlist=nlist, seed=seed)
+    build_seconds = time.perf_counter() - started_at
+    for nprobe in nprobes:
+        def search(query):
+            found = ann.search(matrix, query[None, :], top_k, nprobe=nprobe)
+            return found[1][0] if found else np.empty(0, dtype=np.int64)
+
+        results, p50, p95 = timed(search)
+        hits = sum(len(found & expected) for found, expected in zip(results, exact))
+        report.append({
+            "search": f"ivf nlist={ann.nlist} nprobe={nprobe}",
+            "recall": hits / (len(exact) * top_k),
+            "p50_ms": p50,
+            "p95_ms": p95,
+            "build_s": build_seconds
+        })
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare IVF search with exact search on the saved index")
+    parser.add_argument("--benchmark", action="store_true", help="print recall and latency per nprobe")
+    parser.add_argument("--top-k", type=int, default=6, help="results per query (the app retrieves 6)")
+    parser.add_argument("--queries", type=int, default=200, help="stored vectors held out as queries")
+    parser.add_argument("--nlist", type=int, default=ANN_NLIST or None, help="inverted lists (default about 4 * sqrt(chunks))")
+    parser.add_argument("--nprobe", default="4,8,16,32,64", help="comma-separated nprobe values to try")
+    parser.add_argument("--synthetic", type=int, default=0, help="benchmark this many random clustered vectors instead of the saved index")
+    args = parser.parse_args()
+    if not args.benchmark:
+        parser.print_help()
+        return
+
+    if args.synthetic:
+        # Clustered like real embeddings; uniformly random vectors have no neighbors worth finding
+        rng = np.random.default_rng(0)
+        topics = rng.standard_normal((max(1, args.synthetic // 1000), 768), dtype=np.float32)
+        vectors = topics[rng.integers(len(topics), size=args.synthetic)]
+        vectors += 1.5 * rng.standard_normal(vectors.shape, dtype=np.float32)
+    else:
+        import gridfs
+        import pymongo
+        from dotenv import load_dotenv
+
+        load_dotenv()
+        db = pymongo.MongoClient(os.getenv("MONGO_URI"))["rag_system"]
+        index_doc = index_store.get_current_snapshot(db["index"], {"segments": 1})
+        if not index_doc or "segments" not in index_doc:
+            raise SystemExit("No saved index found")
+        vectors = np.stack([row for _, row in index_store.iter_segments(gridfs.GridFS(db), index_doc["segments"])])
+
+    nprobes = [int(nprobe) for nprobe in args.nprobe.split(",")]
+    report = benchmark(vectors, top_k=args.top_k, queries=args.queries, nlist=args.nlist, nprobes=nprobes)
+    print(f"{len(vectors)} vectors of dimension {vectors.shape[1]}, top {args.top_k}, {report[0]['queries']} held-out queries")
+    print(f"{'search':<28} {'recall':>7} {'p50 ms':>8} {'p95 ms':>8} {'build s':>8}")
+    for entry in report:
+        print(f"{entry['search']:<28} {entry['recall']:>7.3f} {entry['p50_ms']:>8.2f} {entry['p95_ms']:>8.2f} {entry['build_s']:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
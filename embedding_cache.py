@@ -0,0 +1,143 @@
+"""
+Embedding Cache Module
+Persistent chunk-level embedding cache in MongoDB so unchanged text is never embedded twice
+"""
+
+import os
+import hashlib
+from datetime import datetime
+
+import numpy as np
+from bson.binary import Binary
+from pymongo import ReplaceOne
+from llama_index.core.schema import MetadataMode
+
+import embedding_executor
+
+# Storage precision of cached vectors ("float32" or "float16")
+EMBEDDING_CACHE_DTYPE = os.getenv("EMBEDDING_CACHE_DTYPE", "float32")
+
+# Least recently used vectors are evicted beyond this many entries
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "200000"))
+
+# Keep $in queries and bulk writes well below MongoDB's 16MB limit
+LOOKUP_BATCH_SIZE = 1000
+
+
+def get_embed_model_key(embed_model):
+    """Identify an embedding model and its output dimensions, e.g. 'text-embedding-ada-002:default'."""
+    model_name = getattr(embed_model, "model_name", None) or type(embed_model).__name__
+    dimensions = getattr(embed_model, "dimensions", None) or getattr(embed_model, "embed_dim", None) or "default"
+    return f"{model_name}:{dimensions}"
+
+
+def get_cache_key(text, model_key):
+    """Cache key for one chunk: embedding model plus a hash of the exact embedded text."""
+    return f"{model_key}:{hashlib.sha256(text.encode('utf-8')).hexdigest()}"
+
+
+def lookup_embeddings(collection, cache_keys):
+    """
+    Fetch cached vectors in bulk and mark them as recently used.
+
+    Returns:
+        dict: cache key -> embedding as a list of floats
+    """
+    found = {}
+    now = datetime.now()
+    for batch_start in range(0, len(cache_keys), LOOKUP_BATCH_SIZE):
+        batch = cache_keys[batch_start:batch_start + LOOKUP_BATCH_SIZE]
+        for doc in collection.find({"_id": {"$in": batch}}, {"vector": 1, "dtype": 1}):
+            vector = np.frombuffer(doc["vector"], dtype=doc.get("dtype", "float32"))
+            found[doc["_id"]] = vector.astype(np.float32).tolist()
+        if found:
+            collection.update_many({"_id": {"$in": [key for key in batch if key in found]}}, {"$set": {"last_used": now}})
+    return found
+
+
+def store_embeddings(collection, embeddings, dtype=None):
+    """
+    Store vectors as compact binary blobs.
+
+    Args:
+        collection: MongoDB collection backing the cache
+        embeddings (dict): cache key -> embedding
+        dtype (str): storage precision, defaults to EMBEDDING_CACHE_DTYPE
+    """
+    dtype = dtype or EMBEDDING_CACHE_DTYPE
+    now = datetime.now()
+    items = list(embeddings.items())
+    for batch_start in range(0, len(items), LOOKUP_BATCH_SIZE):
+        requests = []
+        for cache_key, embedding in items[batch_start:batch_start + LOOKUP_BATCH_SIZE]:
+            vector = np.asarray(embedding, dtype=dtype)
+            requests.append({
+                "_id": cache_key,
+                "vector": Binary(vector.tobytes()),
+                "dtype": dtype,
+                "dim": int(vector.shape[0]),
+                "last_used": now
+            })
+        if requests:
+            collection.bulk_write(
+                [ReplaceOne({"_id": request["_id"]}, request, upsert=True) for request in requests],
+                ordered=False
+            )
+
+
+def evict_embeddings(collection, max_entries=None):
+    """Delete the least recently used vectors beyond max_entries. Returns the number evicted."""
+    max_entries = max_entries or EMBEDDING_CACHE_MAX_ENTRIES
+    excess = collection.estimated_document_count() - max_entries
+    if excess <= 0:
+        return 0
+
+    stale_ids = [doc["_id"] for doc in collection.find({}, {"_id": 1}).sort("last_used", 1).limit(excess)]
+    for batch_start in range(0, len(stale_ids), LOOKUP_BATCH_SIZE):
+        collection.delete_many({"_id": {"$in": stale_ids[batch_start:batch_start + LOOKUP_BATCH_SIZE]}})
+    return len(stale_ids)
+
+
+def embed_nodes_with_cache(nodes, embed_model, collection, progress_callback=None):
+    """
+    Set node.embedding on every node, reusing cached vectors and sending only
+    the misses to the embedding model.
+
+    Args:
+        nodes: llama_index nodes to embed
+        embed_model: llama_index embedding model used for misses
+        collection: MongoDB collection backing the cache
+        progress_callback: called with (misses_embedded, total_misses) while misses are embedded
+
+    Returns:
+        tuple: (hits, misses, stats of the embedding requests or None if all hit)
+    """
+    model_key = get_embed_model_key(embed_model)
+    texts = [node.get_content(metadata_mode=MetadataMode.EMBED) for node in nodes]
+    cache_keys = [get_cache_key(text, model_key) for text in texts]
+
+    cached = lookup_embeddings(collection, list(set(cache_keys)))
+
+    # Identical chunks inside one rebuild are only embedded once
+    missing = {}
+    for cache_key, text in zip(cache_keys, texts):
+        if cache_key not in cached:
+            missing.setdefault(cache_key, text)
+
+    new_embeddings = {}
+    embed_stats = None
+    if missing:
+        vectors, embed_stats = embedding_executor.embed_texts_with_model(
+            list(missing.values()),
+            embed_model,
+            progress_callback=progress_callback
+        )
+        new_embeddings = dict(zip(missing.keys(), vectors))
+        store_embeddings(collection, new_embeddings)
+        evict_embeddings(collection)
+
+    for node, cache_key in zip(nodes, cache_keys):
+        node.embedding = cached[cache_key] if cache_key in cached else new_embeddings[cache_key]
+
+    misses = sum(1 for cache_key in cache_keys if cache_key not in cached)
+    return len(nodes) - misses, misses, embed_stats
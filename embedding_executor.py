@@ -0,0 +1,328 @@
+"""
+Embedding Executor Module
+Concurrent, rate-limit-aware batched embedding requests for index builds
+
+OpenAI models are called with their own retries turned off, so rate limits surface here.
+
+Run `python embedding_executor.py --stub` to exercise the executor against a local
+stub of the OpenAI embeddings endpoint that randomly answers 429 or stalls.
+"""
+
+import os
+import time
+import random
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import requests
+
+# Largest number of texts sent in one request (OpenAI accepts up to 2048 inputs)
+EMBED_MAX_BATCH_SIZE = int(os.getenv("EMBED_MAX_BATCH_SIZE", "2048"))
+
+# Rough token budget of one request (OpenAI allows 300k tokens per request)
+EMBED_MAX_BATCH_TOKENS = int(os.getenv("EMBED_MAX_BATCH_TOKENS", "250000"))
+
+# Upper bound on concurrent embedding requests
+EMBED_MAX_IN_FLIGHT = int(os.getenv("EMBED_MAX_IN_FLIGHT", "4"))
+
+# Attempts per batch before a rate limit or timeout is treated as fatal
+EMBED_MAX_RETRIES = int(os.getenv("EMBED_MAX_RETRIES", "8"))
+
+# Backoff after a rate limit or timeout (seconds), doubled on every retry of a batch
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+
+# Consecutive successful requests before one more request may be in flight
+INCREASE_AFTER_SUCCESSES = 4
+
+
+def estimate_tokens(text):
+    """Cheap token estimate (about 4 characters per token for English text)."""
+    return len(text) // 4 + 1
+
+
+def pack_batches(texts, max_batch_size=None, max_batch_tokens=None):
+    """
+    Pack texts into as few requests as the size and token limits allow.
+
+    Returns:
+        list: lists of indices into texts, in order
+    """
+    max_batch_size = max_batch_size or EMBED_MAX_BATCH_SIZE
+    max_batch_tokens = max_batch_tokens or EMBED_MAX_BATCH_TOKENS
+
+    batches = []
+    current, current_tokens = [], 0
+    for text_index, text in enumerate(texts):
+        tokens = estimate_tokens(text)
+        if current and (len(current) >= max_batch_size or current_tokens + tokens > max_batch_tokens):
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append(text_index)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+
+def is_retryable_error(error):
+    """True for rate limits (HTTP 429), overloaded servers and timeouts."""
+    status_code = getattr(error, "status_code", None)
+    response = getattr(error, "response", None)
+    if status_code is None and response is not None:
+        status_code = getattr(response, "status_code", None)
+    if status_code in (429, 500, 502, 503, 504):
+        return True
+
+    if isinstance(error, (TimeoutError, requests.Timeout, requests.ConnectionError)):
+        return True
+
+    # openai.RateLimitError / APITimeoutError / APIConnectionError without importing openai
+    error_name = type(error).__name__
+    message = str(error).lower()
+    return error_name in ("RateLimitError", "APITimeoutError", "APIConnectionError") or "rate limit" in message
+
+
+def get_retry_after(error):
+    """Seconds the server asked us to wait, if it sent a Retry-After header."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def without_client_retries(embed_model):
+    """
+    Copy of an OpenAI embedding model that sends each request once. Its client and
+    llama_index's retry decorator both retry 429s up to max_retries times, which
+    would keep rate limits from reaching the executor's backoff and concurrency limit.
+    """
+    if not getattr(embed_model, "max_retries", 0):
+        return embed_model
+    model = embed_model.model_copy(update={"max_retries": 0})
+    # The copy shares the original's client, which was created with retries
+    for client_attribute in ("_client", "_aclient"):
+        if hasattr(model, client_attribute):
+            setattr(model, client_attribute, None)
+    return model
+
+
+def get_model_batch_function(embed_model):
+    """One embedding request per call for a llama_index embedding model."""
+    embed_model = without_client_retries(embed_model)
+    # _get_text_embeddings is the model's single-request primitive; the public
+    # get_text_embedding_batch would split our batches up again
+    if hasattr(embed_model, "_get_text_embeddings"):
+        return embed_model._get_text_embeddings
+    return embed_model.get_text_embedding_batch
+
+
+def make_http_batch_function(api_base, model, api_key=None, timeout=60):
+    """
+    One embedding request per call against an OpenAI-compatible /embeddings
+    endpoint, over a pooled HTTP session.
+    """
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=EMBED_MAX_IN_FLIGHT * 2)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    headers = {"Authorization": f"Bearer {api_key}"} if api_key else {}
+
+    def embed_batch(texts):
+        response = session.post(
+            f"{api_base.rstrip('/')}/embeddings",
+            json={"model": model, "input": texts},
+            headers=headers,
+            timeout=timeout
+        )
+        response.raise_for_status()
+        data = sorted(response.json()["data"], key=lambda item: item["index"])
+        return [item["embedding"] for item in data]
+
+    return embed_batch
+
+
+def embed_texts_concurrently(texts, embed_batch, max_batch_size=None, max_batch_tokens=None,
+                             max_in_flight=None, max_retries=None, progress_callback=None):
+    """
+    Embed texts with maximal batches and a bounded, adaptive number of requests in flight.
+
+    Concurrency is halved on every rate limit or timeout (the batch is retried
+    after an exponential, jittered backoff or the server's Retry-After) and
+    grows by one again after a run of successful requests.
+
+    Args:
+        texts (list): texts to embed
+        embed_batch: function sending one request, list of texts -> list of embeddings
+        max_batch_size (int): texts per request (defaults to EMBED_MAX_BATCH_SIZE)
+        max_batch_tokens (int): estimated tokens per request (defaults to EMBED_MAX_BATCH_TOKENS)
+        max_in_flight (int): concurrent requests (defaults to EMBED_MAX_IN_FLIGHT)
+        max_retries (int): attempts per batch (defaults to EMBED_MAX_RETRIES)
+        progress_callback: called with (chunks_done, total_chunks) after every batch
+
+    Returns:
+        tuple: (embeddings in the order of texts, stats dict with chunks,
+        requests, retries, seconds and chunks_per_second)
+    """
+    max_in_flight = max_in_flight or EMBED_MAX_IN_FLIGHT
+    max_retries = max_retries or EMBED_MAX_RETRIES
+
+    started_at = time.monotonic()
+    batches = pack_batches(texts, max_batch_size, max_batch_tokens)
+    embeddings = [None] * len(texts)
+
+    # Batches waiting to be sent: (not_before, batch_number, attempt)
+    queue = [(0.0, batch_number, 0) for batch_number in range(len(batches))]
+    in_flight = {}
+    concurrency = max_in_flight
+    successes_in_a_row = 0
+    requests_sent = 0
+    retries = 0
+    chunks_done = 0
+
+    with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+        while queue or in_flight:
+            # Send every batch that is due while there is room
+            now = time.monotonic()
+            queue.sort()
+            while queue and len(in_flight) < concurrency and queue[0][0] <= now:
+                _, batch_number, attempt = queue.pop(0)
+                batch_texts = [texts[text_index] for text_index in batches[batch_number]]
+                in_flight[executor.submit(embed_batch, batch_texts)] = (batch_number, attempt)
+                requests_sent += 1
+
+            if not in_flight:
+                # Everything left is backing off
+                time.sleep(max(0.0, queue[0][0] - time.monotonic()))
+                continue
+
+            wait_timeout = max(0.0, queue[0][0] - time.monotonic()) if queue and len(in_flight) < concurrency else None
+            done, _ = wait(list(in_flight), timeout=wait_timeout, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                batch_number, attempt = in_flight.pop(future)
+                try:
+                    vectors = future.result()
+                except Exception as e:
+                    if not is_retryable_error(e) or attempt + 1 >= max_retries:
+                        raise
+                    retries += 1
+                    successes_in_a_row = 0
+                    concurrency = max(1, concurrency // 2)
+                    delay = get_retry_after(e)
+                    if delay is None:
+                        delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt) * random.uniform(0.5, 1.5)
+                    queue.append((time.monotonic() + delay, batch_number, attempt + 1))
+                    continue
+
+                if len(vectors) != len(batches[batch_number]):
+                    raise ValueError(f"Embedding backend returned {len(vectors)} vectors for {len(batches[batch_number])} texts")
+                for text_index, vector in zip(batches[batch_number], vectors):
+                    embeddings[text_index] = vector
+
+                chunks_done += len(vectors)
+                successes_in_a_row += 1
+                if successes_in_a_row >= INCREASE_AFTER_SUCCESSES and concurrency < max_in_flight:
+                    concurrency += 1
+                    successes_in_a_row = 0
+                if progress_callback:
+                    progress_callback(chunks_done, len(texts))
+
+    seconds = time.monotonic() - started_at
+    stats = {
+        "chunks": len(texts),
+        "requests": requests_sent,
+        "retries": retries,
+        "seconds": seconds,
+        "chunks_per_second": len(texts) / seconds if seconds > 0 else 0.0
+    }
+    return embeddings, stats
+
+
+def embed_texts_with_model(texts, embed_model, progress_callback=None):
+    """Embed texts through a llama_index embedding model with the concurrent executor."""
+    # Stay within what the model's own batching was configured for, if it is smaller
+    model_batch_size = getattr(embed_model, "embed_batch_size", None)
+    max_batch_size = min(EMBED_MAX_BATCH_SIZE, model_batch_size) if model_batch_size else EMBED_MAX_BATCH_SIZE
+    # Local models use every CPU core per batch already; concurrent batches would only contend
+    max_in_flight = 1 if getattr(embed_model, "runs_locally", False) else None
+    return embed_texts_concurrently(
+        texts,
+        get_model_batch_function(embed_model),
+        max_batch_size=max_batch_size,
+        max_in_flight=max_in_flight,
+        progress_callback=progress_callback
+    )
+
+
+def run_stub_embedding_server(port=0, dimensions=8, rate_limit_probability=0.2, latency=0.05):
+    """
+    Start a local stand-in for the OpenAI embeddings endpoint in a background thread.
+
+    It sleeps `latency` seconds per request and answers 429 with a short
+    Retry-After for a fraction of requests. Returns (server, api_base).
+    """
+    import json
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class StubHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            time.sleep(latency)
+            if random.random() < rate_limit_probability:
+                self.send_response(429)
+                self.send_header("Retry-After", "0.1")
+                self.end_headers()
+                return
+
+            data = [
+                {"object": "embedding", "index": i, "embedding": [float(len(text) % 7)] * dimensions}
+                for i, text in enumerate(payload["input"])
+            ]
+            body = json.dumps({"object": "list", "data": data, "model": payload.get("model")}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Embed synthetic chunks through the concurrent embedding executor")
+    parser.add_argument("--stub", action="store_true", help="run against a local stub embeddings server")
+    parser.add_argument("--api-base", default="https://api.openai.com/v1")
+    parser.add_argument("--model", default="text-embedding-ada-002")
+    parser.add_argument("--chunks", type=int, default=5000)
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--in-flight", type=int, default=EMBED_MAX_IN_FLIGHT)
+    args = parser.parse_args()
+
+    api_base = args.api_base
+    if args.stub:
+        stub_server, api_base = run_stub_embedding_server()
+
+    sample_texts = [f"Chunk {i}: compartmental model with K1, k2 and Vt estimates. " * 20 for i in range(args.chunks)]
+    batch_function = make_http_batch_function(api_base, args.model, os.getenv("OPENAI_API_KEY"))
+    vectors, run_stats = embed_texts_concurrently(
+        sample_texts,
+        batch_function,
+        max_batch_size=args.batch_size,
+        max_in_flight=args.in_flight
+    )
+
+    assert all(vector is not None for vector in vectors)
+    print(
+        f"Embedded {run_stats['chunks']} chunks in {run_stats['seconds']:.2f}s "
+        f"({run_stats['chunks_per_second']:.0f} chunks/s) using {run_stats['requests']} requests, "
+        f"{run_stats['retries']} retried"
+    )
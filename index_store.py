@@ -0,0 +1,721 @@
+"""
+Index Store Module
+Columnar persistence of the vector index in GridFS as immutable segments, each a float32
+embedding matrix, a node store and tombstones of deleted nodes
+
+Every full save is a new snapshot document, published by flipping a pointer
+document. Superseded snapshots and merged-away segments are only deleted after
+a grace period, so sessions still reading them are never cut off.
+"""
+
+import os
+import json
+import time
+import uuid
+import zlib
+import shutil
+import hashlib
+
+import numpy as np
+from llama_index.core import VectorStoreIndex, StorageContext
+from llama_index.core.schema import TextNode, NodeRelationship, RelatedNodeInfo
+
+import quantized_store
+
+try:
+    import zstandard
+except ImportError:  # Optional: parts are compressed with zlib without it
+    zstandard = None
+
+# Bump when the layout of the parts changes; older saves are then rebuilt instead of loaded
+INDEX_FORMAT_VERSION = 2
+
+# Compression of new parts; "zstd" needs the zstandard package
+INDEX_CODEC = os.getenv("INDEX_CODEC", "zstd" if zstandard else "zlib")
+
+# GridFS chunk size of the parts
+GRIDFS_CHUNK_SIZE = 1048576  # 1MB
+
+# Embedding rows buffered before they are written to GridFS
+WRITE_BATCH_ROWS = 4096
+
+# Local copies of saved indexes, one directory per saved version ("" disables the cache)
+INDEX_CACHE_DIR = os.getenv("INDEX_CACHE_DIR", "index_cache")
+
+# Bytes read from GridFS at a time while filling the local cache
+DOWNLOAD_BLOCK_SIZE = 8 * 1048576
+
+# Stored nodes inserted into a loaded index at a time, bounding their temporary float lists
+LOAD_BATCH_SIZE = 2048
+
+# Rows normalized at a time while writing the search matrix to the local cache
+SEARCH_MATRIX_BLOCK_ROWS = 65536
+
+# Segments are compacted into one once there are more than this many...
+INDEX_MAX_SEGMENTS = int(os.getenv("INDEX_MAX_SEGMENTS", "8"))
+
+# ...or once this fraction of the stored nodes has been deleted
+INDEX_MAX_DELETED_RATIO = 0.2
+
+# Seconds superseded snapshots and merged segments stay readable before they are deleted
+INDEX_SNAPSHOT_GRACE = float(os.getenv("INDEX_SNAPSHOT_GRACE", "900"))
+
+# _id of the document pointing at the published snapshot in the index collection
+SNAPSHOT_POINTER_ID = "current"
+
+# Snapshot fields holding search structures saved next to the segments (ANN centroids,
+# BM25 postings); their manifests have parts like a segment
+SNAPSHOT_ATTACHMENTS = ("ann", "lexical")
+
+
+def iter_index_nodes(index):
+    """Yield (node, embedding) for every node of a VectorStoreIndex, in index order."""
+    for node_id in index.index_struct.nodes_dict.values():
+        yield index.docstore.get_node(node_id), index.vector_store.get(node_id)
+
+
+def node_to_record(node):
+    """Compact JSON-serializable form of a text node, without its embedding."""
+    return {
+        "id": node.node_id,
+        "text": node.text,
+        "metadata": node.metadata,
+        "excluded_embed_metadata_keys": node.excluded_embed_metadata_keys,
+        "excluded_llm_metadata_keys": node.excluded_llm_metadata_keys,
+        "start_char_idx": node.start_char_idx,
+        "end_char_idx": node.end_char_idx,
+        # Only the ids of related nodes; ref_doc_id comes from the SOURCE relationship
+        "relationships": {
+            relationship.value: related.node_id
+            for relationship, related in node.relationships.items()
+            if isinstance(related, RelatedNodeInfo)
+        }
+    }
+
+
+def node_from_record(record, embedding=None):
+    """Rebuild a text node from node_to_record output."""
+    return TextNode(
+        id_=record["id"],
+        text=record["text"],
+        metadata=record["metadata"],
+        excluded_embed_metadata_keys=record["excluded_embed_metadata_keys"],
+        excluded_llm_metadata_keys=record["excluded_llm_metadata_keys"],
+        start_char_idx=record["start_char_idx"],
+        end_char_idx=record["end_char_idx"],
+        relationships={
+            NodeRelationship(relationship): RelatedNodeInfo(node_id=node_id)
+            for relationship, node_id in record["relationships"].items()
+        },
+        embedding=embedding
+    )
+
+
+def make_compressor(codec):
+    """Streaming compressor with compress() and flush() for a codec name."""
+    if codec == "zstd":
+        if zstandard is None:
+            raise ValueError("The zstd codec needs the zstandard package")
+        return zstandard.ZstdCompressor(level=3).compressobj()
+    if codec == "zlib":
+        return zlib.compressobj(6)
+    if codec == "none":
+        return None
+    raise ValueError(f"Unknown index codec {codec}")
+
+
+def make_decompressor(codec):
+    """Streaming decompressor with decompress() and flush() for a codec name."""
+    if codec == "zstd":
+        if zstandard is None:
+            raise ValueError("This index was saved with zstd compression; install the zstandard package")
+        return zstandard.ZstdDecompressor().decompressobj()
+    if codec == "zlib":
+        return zlib.decompressobj()
+    if codec == "none":
+        return None
+    raise ValueError(f"Unknown index codec {codec}")
+
+
+class PartWriter:
+    """
+    Compresses data straight into a GridFS file while it is written, keeping a
+    checksum and the sizes before and after compression.
+    """
+
+    def __init__(self, fs, filename, content_type, codec=None):
+        self.codec = codec or INDEX_CODEC
+        self.compressor = make_compressor(self.codec)
+        self.grid_in = fs.new_file(filename=filename, content_type=content_type, chunkSize=GRIDFS_CHUNK_SIZE)
+        self.checksum = hashlib.sha256()
+        self.size = 0
+        self.compressed_size = 0
+
+    def _write_compressed(self, data):
+        if data:
+            self.grid_in.write(data)
+            self.compressed_size += len(data)
+
+    def write(self, data):
+        self.checksum.update(data)
+        self.size += len(data)
+        self._write_compressed(self.compressor.compress(data) if self.compressor else data)
+
+    def close(self):
+        """Finish the file and return its manifest: GridFS id, codec, sizes and sha256."""
+        if self.compressor:
+            self._write_compressed(self.compressor.flush())
+        self.grid_in.close()
+        return {
+            "id": self.grid_in._id,
+            "codec": self.codec,
+            "size": self.size,
+            "compressed_size": self.compressed_size,
+            "sha256": self.checksum.hexdigest()
+        }
+
+    def abort(self):
+        self.grid_in.abort()
+
+
+def iter_part_blocks(fs, part):
+    """
+    Stream the decompressed content of a part from GridFS block by block.
+
+    Raises:
+        ValueError: after the last block, if the size or checksum don't match the
+            manifest. Callers must consume every block before trusting the data
+    """
+    decompressor = make_decompressor(part["codec"])
+    checksum = hashlib.sha256()
+    size = 0
+    grid_out = fs.get(part["id"])
+    for block in iter(lambda: grid_out.read(DOWNLOAD_BLOCK_SIZE), b""):
+        data = decompressor.decompress(block) if decompressor else block
+        if data:
+            checksum.update(data)
+            size += len(data)
+            yield data
+
+    tail = decompressor.flush() if decompressor else b""
+    if tail:
+        checksum.update(tail)
+        size += len(tail)
+        yield tail
+
+    if size != part["size"] or checksum.hexdigest() != part["sha256"]:
+        raise ValueError(f"Index part {part['id']} is corrupt (size or checksum mismatch)")
+
+
+def write_index_parts(fs, records):
+    """
+    Stream nodes and their embeddings, compressed, into two GridFS files.
+
+    Args:
+        fs: GridFS instance to write to
+        records: iterable of (node_to_record output, embedding) pairs
+
+    Returns:
+        dict: manifest of the segment: node count, embedding shape, total sizes
+        and the manifest of each part (None when there were no records)
+    """
+    embeddings_file = PartWriter(fs, "vector_index.embeddings", "application/octet-stream")
+    nodes_file = PartWriter(fs, "vector_index.nodes", "application/x-ndjson")
+
+    node_count = 0
+    dim = None
+    try:
+        rows = []
+        for record, embedding in records:
+            if dim is None:
+                dim = len(embedding)
+            elif len(embedding) != dim:
+                raise ValueError(f"Node {record['id']} has a {len(embedding)}-dimensional embedding, expected {dim}")
+            rows.append(embedding)
+
+            # One JSON object per line; json escapes newlines inside the text
+            nodes_file.write(json.dumps(record, ensure_ascii=False).encode("utf-8") + b"\n")
+            node_count += 1
+
+            if len(rows) >= WRITE_BATCH_ROWS:
+                embeddings_file.write(np.asarray(rows, dtype=np.float32).tobytes())
+                rows = []
+
+        if rows:
+            embeddings_file.write(np.asarray(rows, dtype=np.float32).tobytes())
+    except Exception:
+        embeddings_file.abort()
+        nodes_file.abort()
+        raise
+
+    if not node_count:
+        embeddings_file.abort()
+        nodes_file.abort()
+        return {
+            "format_version": INDEX_FORMAT_VERSION,
+            "parts": None,
+            "node_count": 0,
+            "dim": 0,
+            "dtype": "float32",
+            "size": 0,
+            "compressed_size": 0
+        }
+
+    parts = {"embeddings": embeddings_file.close(), "nodes": nodes_file.close()}
+    return {
+        "format_version": INDEX_FORMAT_VERSION,
+        "parts": parts,
+        "node_count": node_count,
+        "dim": dim,
+        "dtype": "float32",
+        "size": sum(part["size"] for part in parts.values()),
+        "compressed_size": sum(part["compressed_size"] for part in parts.values())
+    }
+
+
+def write_segment(fs, index, node_ids=None, tombstones=()):
+    """
+    Write an immutable segment with the given nodes of an index (all if None)
+    and the ids of nodes deleted since the previous segment.
+
+    Returns:
+        dict: segment manifest, to be appended to the index document's segments
+    """
+    records = (
+        (node_to_record(node), embedding)
+        for node, embedding in iter_index_nodes(index)
+        if node_ids is None or node.node_id in node_ids
+    )
+    segment = write_index_parts(fs, records)
+    segment["tombstones"] = sorted(tombstones)
+    return segment
+
+
+def get_cache_path(segment):
+    """Local cache directory of a segment (GridFS ids are unique per save)."""
+    return os.path.join(INDEX_CACHE_DIR, str(segment["parts"]["embeddings"]["id"]))
+
+
+def cache_index_parts(fs, segment):
+    """
+    Download the parts of a segment into the local cache, unless they are
+    already there. Parts are decompressed and verified on the way; the
+    embedding matrix is written as an .npy file.
+
+    Returns:
+        str: cache directory of this segment
+    """
+    cache_path = get_cache_path(segment)
+    if os.path.isdir(cache_path):
+        return cache_path
+
+    # Fill a private directory and rename it into place, so readers never see a
+    # partial or unverified copy
+    os.makedirs(INDEX_CACHE_DIR, exist_ok=True)
+    temp_path = f"{cache_path}.{os.getpid()}.{uuid.uuid4().hex}.tmp"
+    os.makedirs(temp_path)
+    try:
+        embeddings = np.lib.format.open_memmap(
+            os.path.join(temp_path, "embeddings.npy"),
+            mode="w+",
+            dtype=segment["dtype"],
+            shape=(segment["node_count"], segment["dim"])
+        )
+        embedding_bytes = embeddings.reshape(-1).view(np.uint8)
+        offset = 0
+        for block in iter_part_blocks(fs, segment["parts"]["embeddings"]):
+            if offset + len(block) > embedding_bytes.size:
+                raise ValueError(f"Embedding matrix is larger than {segment['node_count']} x {segment['dim']}")
+            embedding_bytes[offset:offset + len(block)] = np.frombuffer(block, dtype=np.uint8)
+            offset += len(block)
+        if offset != embedding_bytes.size:
+            raise ValueError(f"Embedding matrix has {offset} bytes, expected {embedding_bytes.size}")
+        embeddings.flush()
+        del embeddings, embedding_bytes
+
+        with open(os.path.join(temp_path, "nodes.jsonl"), "wb") as nodes_out:
+            for block in iter_part_blocks(fs, segment["parts"]["nodes"]):
+                nodes_out.write(block)
+
+        try:
+            os.rename(temp_path, cache_path)
+        except OSError:
+            # Another process cached the same segment first
+            if not os.path.isdir(cache_path):
+                raise
+    finally:
+        shutil.rmtree(temp_path, ignore_errors=True)
+
+    return cache_path
+
+
+def get_search_matrix_path(segments):
+    """Local cache directory of the search matrix of a set of segments."""
+    key = [
+        [str(segment["parts"]["embeddings"]["id"]) if segment.get("parts") else None, segment.get("tombstones", [])]
+        for segment in segments
+    ]
+    digest = hashlib.sha256(json.dumps(key).encode("utf-8")).hexdigest()[:32]
+    return os.path.join(INDEX_CACHE_DIR, f"search-{digest}")
+
+
+def cache_search_matrix(segments, rows):
+    """
+    Unit-normalized float32 matrix of the live rows of a set of segments, in
+    read order, memory-mapped from the local cache and written there on first
+    use, so every process on this machine searches the same pages.
+
+    Returns:
+        np.memmap of shape len(rows) x dim, or None without a usable cache
+    """
+    if not INDEX_CACHE_DIR or not rows:
+        return None
+
+    cache_path = get_search_matrix_path(segments)
+    shape = (len(rows), len(rows[0]))
+    try:
+        if not os.path.isdir(cache_path):
+            os.makedirs(INDEX_CACHE_DIR, exist_ok=True)
+            temp_path = f"{cache_path}.{os.getpid()}.{uuid.uuid4().hex}.tmp"
+            os.makedirs(temp_path)
+            try:
+                matrix = np.lib.format.open_memmap(
+                    os.path.join(temp_path, "matrix.npy"), mode="w+", dtype=np.float32, shape=shape
+                )
+                for start in range(0, len(rows), SEARCH_MATRIX_BLOCK_ROWS):
+                    block = np.array(rows[start:start + SEARCH_MATRIX_BLOCK_ROWS], dtype=np.float32)
+                    norms = np.sqrt(np.einsum("ij,ij->i", block, block))[:, None]
+                    matrix[start:start + len(block)] = block / np.where(norms > 0, norms, 1.0)
+                matrix.flush()
+                del matrix
+                try:
+                    os.rename(temp_path, cache_path)
+                except OSError:
+                    # Another process wrote the same matrix first
+                    if not os.path.isdir(cache_path):
+                        raise
+            finally:
+                shutil.rmtree(temp_path, ignore_errors=True)
+
+        matrix = np.load(os.path.join(cache_path, "matrix.npy"), mmap_mode="r")
+        if matrix.shape != shape:
+            raise ValueError(f"Cached search matrix has shape {matrix.shape}, expected {shape}")
+        return matrix
+    except (OSError, ValueError) as e:
+        print(f"Local search matrix unavailable, searching a private copy: {e}")
+        return None
+
+
+def prune_index_cache(segments):
+    """Delete the cached copies of all segments that are not in `segments`, and their search matrices."""
+    keep = {os.path.basename(get_cache_path(segment)) for segment in segments if segment.get("parts")}
+    keep.add(os.path.basename(get_search_matrix_path(segments)))
+    try:
+        cached = [entry for entry in os.scandir(INDEX_CACHE_DIR) if entry.is_dir()]
+    except FileNotFoundError:
+        return
+    for entry in cached:
+        # Temporary directories belong to downloads in progress
+        if entry.name not in keep and not entry.name.endswith(".tmp"):
+            # Processes that still map the old files keep them until they close them
+            shutil.rmtree(entry.path, ignore_errors=True)
+
+
+def open_index_parts(fs, segment):
+    """
+    The embedding matrix and node store lines of a segment. The matrix is
+    memory-mapped from the local cache, which is filled on first use, so every
+    process on this machine shares its pages; without a usable cache both are
+    read, decompressed and verified straight from GridFS.
+
+    Returns:
+        tuple: (embedding matrix of shape node_count x dim, iterable of node lines)
+    """
+    if INDEX_CACHE_DIR:
+        try:
+            cache_path = cache_index_parts(fs, segment)
+            embeddings = np.load(os.path.join(cache_path, "embeddings.npy"), mmap_mode="r")
+            nodes_file = open(os.path.join(cache_path, "nodes.jsonl"), "rb")
+            return embeddings, nodes_file
+        except OSError as e:
+            print(f"Local index cache unavailable, reading from GridFS: {e}")
+
+    embeddings = np.frombuffer(b"".join(iter_part_blocks(fs, segment["parts"]["embeddings"])), dtype=segment["dtype"])
+    if embeddings.size != segment["node_count"] * segment["dim"]:
+        raise ValueError(f"Embedding matrix has {embeddings.size} values, expected {segment['node_count']} x {segment['dim']}")
+    node_lines = b"".join(iter_part_blocks(fs, segment["parts"]["nodes"])).splitlines()
+    return embeddings.reshape(segment["node_count"], segment["dim"]), node_lines
+
+
+def iter_segment_records(fs, segment):
+    """Yield (node record, embedding row) for every node stored in one segment."""
+    if segment.get("format_version") != INDEX_FORMAT_VERSION:
+        raise ValueError(f"Unsupported index format version {segment.get('format_version')}")
+    if not segment["node_count"]:
+        return
+
+    embeddings, node_lines = open_index_parts(fs, segment)
+    if embeddings.shape != (segment["node_count"], segment["dim"]):
+        raise ValueError(f"Embedding matrix has shape {embeddings.shape}, expected {segment['node_count']} x {segment['dim']}")
+
+    node_count = 0
+    try:
+        for row, line in zip(embeddings, node_lines):
+            node_count += 1
+            yield json.loads(line), row
+    finally:
+        if hasattr(node_lines, "close"):
+            node_lines.close()
+    if node_count != segment["node_count"]:
+        raise ValueError(f"Node store has {node_count} nodes, expected {segment['node_count']}")
+
+
+def iter_segments(fs, segments):
+    """Merge segments at read time: every stored node that no segment has tombstoned."""
+    # Node ids are never reused, so a tombstone can't hide a node written after it
+    deleted = set()
+    for segment in segments:
+        deleted.update(segment.get("tombstones", []))
+
+    for segment in segments:
+        for record, row in iter_segment_records(fs, segment):
+            if record["id"] not in deleted:
+                yield record, row
+
+
+def read_index_segments(fs, segments, embed_model=None):
+    """
+    Rebuild a VectorStoreIndex from its segments. Only JSON and raw float32
+    data are read, nothing is unpickled. The vector store references the
+    memory-mapped rows of the local cache instead of copying them, and gets
+    the shared search matrix of the segments.
+
+    Returns:
+        tuple: (index, set of the ids of its nodes)
+
+    Raises:
+        ValueError: if a segment is from an unknown format version or inconsistent
+    """
+    index = build_vector_index([], embed_model=embed_model)
+    node_ids = []
+    rows = []
+    records = []
+    for record, row in iter_segments(fs, segments):
+        node_ids.append(record["id"])
+        rows.append(row)
+        records.append(record)
+        if len(records) == LOAD_BATCH_SIZE:
+            insert_loaded_nodes(index, records, rows[-len(records):])
+            records = []
+    if records:
+        insert_loaded_nodes(index, records, rows[-len(records):])
+
+    search_matrix = cache_search_matrix(segments, rows)
+    if search_matrix is not None:
+        index.vector_store.attach_search_matrix(node_ids, search_matrix)
+    if INDEX_CACHE_DIR:
+        prune_index_cache(segments)
+    return index, set(node_ids)
+
+
+def insert_loaded_nodes(index, records, rows):
+    """Insert stored nodes whose vector store entries reference their stored rows."""
+    index.vector_store.attach_full_vectors({record["id"]: row for record, row in zip(records, rows)})
+    # Nodes carry their embeddings only through the insert, so nothing is sent to the
+    # embedding model; the store keeps the referenced rows, not these lists
+    index.insert_nodes([node_from_record(record, embedding=row.tolist()) for record, row in zip(records, rows)])
+
+
+def build_vector_index(nodes, embed_model=None, full_vectors=None):
+    """
+    VectorStoreIndex over embedded nodes, on a quantized vector store if
+    VECTOR_QUANTIZATION is set and a mapped one otherwise. full_vectors maps
+    node ids to existing full-precision rows the store can reference instead
+    of copying.
+    """
+    vector_store = quantized_store.make_vector_store()
+    if full_vectors:
+        vector_store.attach_full_vectors(full_vectors)
+    storage_context = StorageContext.from_defaults(vector_store=vector_store)
+    return VectorStoreIndex(nodes, storage_context=storage_context, embed_model=embed_model)
+
+
+def get_index_generation(index):
+    """
+    Version of the chunks of a VectorStoreIndex for indexes derived from it: the
+    add/delete counter of its vector store, plus the chunk count for stores without one.
+    """
+    return getattr(index.vector_store, "generation", None), len(index.index_struct.nodes_dict)
+
+
+def clone_index(index):
+    """Independent copy of a VectorStoreIndex, reusing its embeddings instead of recomputing them."""
+    nodes = [
+        node_from_record(node_to_record(node), embedding=list(embedding))
+        for node, embedding in iter_index_nodes(index)
+    ]
+    return build_vector_index(nodes, embed_model=index._embed_model)
+
+
+def needs_compaction(segments):
+    """True once there are too many segments or too many deleted nodes in them."""
+    if len(segments) > INDEX_MAX_SEGMENTS:
+        return True
+    stored = sum(segment["node_count"] for segment in segments)
+    deleted = sum(len(segment.get("tombstones", [])) for segment in segments)
+    return stored > 0 and deleted / stored > INDEX_MAX_DELETED_RATIO
+
+
+def get_current_snapshot(index_collection, projection=None):
+    """
+    The published snapshot document, or None. Saves from before snapshots
+    existed have no pointer; their single document is used instead.
+    """
+    pointer = index_collection.find_one({"_id": SNAPSHOT_POINTER_ID})
+    if pointer:
+        return index_collection.find_one({"_id": pointer["snapshot_id"]}, projection)
+    return index_collection.find_one({"_id": {"$ne": SNAPSHOT_POINTER_ID}}, projection)
+
+
+def publish_snapshot(index_collection, snapshot):
+    """
+    Store a new snapshot document and make it the published one by flipping
+    the pointer. Older snapshots are marked superseded for collect_garbage.
+
+    Returns:
+        the _id of the new snapshot
+    """
+    now = time.time()
+    snapshot_id = index_collection.insert_one({**snapshot, "created_at": now}).inserted_id
+    index_collection.update_one(
+        {"_id": SNAPSHOT_POINTER_ID},
+        {"$set": {"snapshot_id": snapshot_id, "published_at": now}},
+        upsert=True
+    )
+    index_collection.update_many(
+        {"_id": {"$nin": [SNAPSHOT_POINTER_ID, snapshot_id]}, "superseded_at": {"$exists": False}},
+        {"$set": {"superseded_at": now}}
+    )
+    # A concurrent publish may have marked this snapshot before its own pointer flip
+    index_collection.update_one({"_id": snapshot_id}, {"$unset": {"superseded_at": ""}})
+    return snapshot_id
+
+
+def attach_snapshot_part(index_collection, fs, snapshot_id, field, manifest):
+    """
+    Reference a search structure written with PartWriter from a snapshot
+    document. The one it replaces is retired like a merged segment, so
+    sessions still reading it have the grace period to finish.
+
+    Returns:
+        bool: False (and the parts are deleted) if the snapshot is gone
+    """
+    previous = index_collection.find_one_and_update(
+        {"_id": snapshot_id},
+        {"$set": {field: manifest}},
+        projection={field: 1}
+    )
+    if previous is None:
+        delete_index_parts(fs, manifest)
+        return False
+    if previous.get(field):
+        index_collection.update_one(
+            {"_id": snapshot_id},
+            {"$push": {"retired_segments": {"segment": previous[field], "retired_at": time.time()}}}
+        )
+    return True
+
+
+def delete_snapshot_parts(fs, snapshot):
+    """Remove the GridFS files of every segment a snapshot document references."""
+    for segment in snapshot.get("segments", []):
+        delete_index_parts(fs, segment)
+    for retired in snapshot.get("retired_segments", []):
+        delete_index_parts(fs, retired["segment"])
+    for field in SNAPSHOT_ATTACHMENTS:
+        if snapshot.get(field):
+            delete_index_parts(fs, snapshot[field])
+    if "gridfs_id" in snapshot:
+        # Pickled index of older versions
+        fs.delete(snapshot["gridfs_id"])
+
+
+def collect_garbage(index_collection, fs, grace=None):
+    """
+    Delete snapshots superseded (or left unpublished) longer than `grace`
+    seconds ago, and segments the published snapshot retired as long ago.
+
+    Returns:
+        int: number of snapshots and segments deleted
+    """
+    grace = INDEX_SNAPSHOT_GRACE if grace is None else grace
+    pointer = index_collection.find_one({"_id": SNAPSHOT_POINTER_ID})
+    if not pointer:
+        return 0
+    cutoff = time.time() - grace
+    deleted = 0
+
+    stale_snapshots = index_collection.find({
+        "_id": {"$nin": [SNAPSHOT_POINTER_ID, pointer["snapshot_id"]]},
+        "$or": [
+            {"superseded_at": {"$lt": cutoff}},
+            {"superseded_at": {"$exists": False}, "created_at": {"$lt": cutoff}}
+        ]
+    })
+    for snapshot in stale_snapshots:
+        delete_snapshot_parts(fs, snapshot)
+        index_collection.delete_one({"_id": snapshot["_id"]})
+        deleted += 1
+
+    current = index_collection.find_one({"_id": pointer["snapshot_id"]}, {"retired_segments": 1})
+    expired = [retired for retired in (current or {}).get("retired_segments", []) if retired["retired_at"] < cutoff]
+    for retired in expired:
+        delete_index_parts(fs, retired["segment"])
+        deleted += 1
+    if expired:
+        index_collection.update_one(
+            {"_id": pointer["snapshot_id"]},
+            {"$pull": {"retired_segments": {"retired_at": {"$lt": cutoff}}}}
+        )
+    return deleted
+
+
+def compact_segments(index_collection, fs):
+    """
+    Merge the segments of the published snapshot into one without deleted
+    nodes, if needs_compaction says so. Saves that land meanwhile win: the
+    merged segment is then discarded and compaction is left to a later run.
+    The replaced segments are retired, not deleted, for collect_garbage.
+
+    Returns:
+        bool: True if the segments were compacted
+    """
+    index_doc = get_current_snapshot(index_collection, {"segments": 1, "generation": 1})
+    if not index_doc or not needs_compaction(index_doc.get("segments", [])):
+        return False
+
+    segments = index_doc["segments"]
+    merged = write_index_parts(fs, iter_segments(fs, segments))
+    merged["tombstones"] = []
+
+    # A save in between bumps the generation, and its segment must not be dropped
+    retired_at = time.time()
+    result = index_collection.update_one(
+        {"_id": index_doc["_id"], "generation": index_doc.get("generation")},
+        {
+            "$set": {"segments": [merged], "size": merged["size"], "compressed_size": merged["compressed_size"]},
+            "$push": {"retired_segments": {
+                "$each": [{"segment": segment, "retired_at": retired_at} for segment in segments]
+            }}
+        }
+    )
+    if not result.matched_count:
+        delete_index_parts(fs, merged)
+        return False
+    return True
+
+
+def delete_index_parts(fs, segment):
+    """Remove the GridFS files of a segment."""
+    for part in (segment.get("parts") or {}).values():
+        fs.delete(part["id"])
@@ -0,0 +1,193 @@
+"""
+Index Watcher Module
+Notices sources and index versions published by other app replicas, through MongoDB change
+streams or, without a replica set, by polling
+
+Check which mode a deployment gets and watch the events arrive with:
+
+    python index_watcher.py
+"""
+
+import os
+import time
+import threading
+
+from pymongo.errors import OperationFailure, PyMongoError
+
+import index_store
+import source_catalog
+
+# "auto" uses change streams when the server supports them and polls otherwise,
+# "poll" always polls, "off" disables the watcher
+INDEX_WATCH_MODE = os.getenv("INDEX_WATCH_MODE", "auto").lower()
+
+# Seconds between checks when polling
+INDEX_POLL_INTERVAL = float(os.getenv("INDEX_POLL_INTERVAL", "10"))
+
+# Seconds a replica keeps serving its index after another one changed the sources, waiting
+# for that one to publish the new index before building it itself
+INDEX_PUBLISH_WAIT = float(os.getenv("INDEX_PUBLISH_WAIT", "120"))
+
+# Events arriving within this many seconds of each other are handled once
+EVENT_DEBOUNCE = 1.0
+
+SOURCE_COLLECTIONS = ["files", "urls", "source_catalog"]
+INDEX_COLLECTIONS = ["index"]
+
+CHANGE_STREAMS = "change_streams"
+POLLING = "polling"
+
+
+class IndexWatcher:
+    """
+    Background thread calling on_index_change() when a new index version is
+    published and on_sources_change() when PDFs or URLs change, from any replica.
+
+    sources_version counts source changes seen so far; while healthy is True
+    an unchanged count means nothing changed since it was last read.
+    """
+
+    def __init__(self, db, on_index_change, on_sources_change=None, mode=None, poll_interval=None):
+        self.db = db
+        self.on_index_change = on_index_change
+        self.on_sources_change = on_sources_change
+        self.requested_mode = mode or INDEX_WATCH_MODE
+        self.poll_interval = poll_interval or INDEX_POLL_INTERVAL
+        self.mode = None
+        self.healthy = False
+        self.sources_version = 0
+        self.index_events = 0
+        self.last_event_at = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self.requested_mode == "off" or self._thread:
+            return self
+        self._thread = threading.Thread(target=self._run, name="index-watcher", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def stats(self):
+        return {
+            "mode": self.mode or "off",
+            "healthy": self.healthy,
+            "index_events": self.index_events,
+            "source_events": self.sources_version,
+            "last_event_at": self.last_event_at
+        }
+
+    def _run(self):
+        while not self._stop.is_set():
+            if self.requested_mode == "auto" and self.mode != POLLING:
+                try:
+                    self._watch_change_streams()
+                except OperationFailure as e:
+                    # Standalone servers reject change streams; poll from now on
+                    print(f"Change streams unavailable ({e}), polling every {self.poll_interval:g}s instead")
+                    self.mode = POLLING
+                except PyMongoError as e:
+                    print(f"Change stream interrupted: {e}")
+                    self.healthy = False
+                    self._stop.wait(self.poll_interval)
+            else:
+                self.mode = POLLING
+                self._poll()
+
+    def _watch_change_streams(self):
+        """Follow inserts, updates and deletes on the source and index collections."""
+        pipeline = [{"$match": {"ns.coll": {"$in": SOURCE_COLLECTIONS + INDEX_COLLECTIONS}}}]
+        with self.db.watch(pipeline, max_await_time_ms=1000) as stream:
+            self.mode = CHANGE_STREAMS
+            self.healthy = True
+            # Anything published before the stream (re)opened would otherwise be missed
+            self._notify(index_changed=True, sources_changed=True)
+
+            index_changed = sources_changed = False
+            pending_since = None
+            while not self._stop.is_set() and stream.alive:
+                change = stream.try_next()
+                if change is not None:
+                    if change["ns"]["coll"] in INDEX_COLLECTIONS:
+                        index_changed = True
+                    else:
+                        sources_changed = True
+                    pending_since = pending_since or time.monotonic()
+                    continue
+
+                # Quiet for a moment: handle everything collected so far at once
+                if pending_since and time.monotonic() - pending_since >= EVENT_DEBOUNCE:
+                    self._notify(index_changed, sources_changed)
+                    index_changed = sources_changed = False
+                    pending_since = None
+        self.healthy = False
+
+    def _poll(self):
+        """Compare the index pointer and the source catalog with their last seen state."""
+        index_collection = self.db["index"]
+        catalog_collection = self.db["source_catalog"]
+        last_index_state = last_catalog_version = None
+        first = True
+        while not self._stop.is_set():
+            try:
+                snapshot = index_store.get_current_snapshot(index_collection, {"generation": 1})
+                index_state = (snapshot["_id"], snapshot.get("generation")) if snapshot else None
+                catalog = source_catalog.get_catalog(catalog_collection)
+                catalog_version = catalog.get("version") if catalog else None
+                self.healthy = True
+            except PyMongoError as e:
+                print(f"Polling for index changes failed: {e}")
+                self.healthy = False
+            else:
+                self._notify(
+                    index_changed=first or index_state != last_index_state,
+                    sources_changed=first or catalog_version != last_catalog_version
+                )
+                last_index_state, last_catalog_version = index_state, catalog_version
+                first = False
+            self._stop.wait(self.poll_interval)
+
+    def _notify(self, index_changed, sources_changed):
+        if sources_changed:
+            self.sources_version += 1
+            self.last_event_at = time.time()
+            if self.on_sources_change:
+                self._call(self.on_sources_change)
+        if index_changed:
+            self.index_events += 1
+            self.last_event_at = time.time()
+            self._call(self.on_index_change)
+
+    @staticmethod
+    def _call(callback):
+        try:
+            callback()
+        except Exception as e:
+            print(f"Index watcher callback failed: {e}")
+
+
+def main():
+    import pymongo
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    db = pymongo.MongoClient(os.getenv("MONGO_URI"))["rag_system"]
+
+    def report(kind):
+        return lambda: print(f"[{time.strftime('%H:%M:%S')}] {kind} changed ({watcher.mode})", flush=True)
+
+    watcher = IndexWatcher(db, on_index_change=report("index"), on_sources_change=report("sources"))
+    watcher.start()
+    print("Watching for index and source changes, Ctrl+C to stop")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        watcher.stop()
+
+
+if __name__ == "__main__":
+    main()
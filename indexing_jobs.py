@@ -0,0 +1,180 @@
+"""
+Indexing Jobs Module
+MongoDB queue of index rebuild jobs shared by the Streamlit app and indexing_worker.py
+"""
+
+import os
+import time
+from datetime import datetime, timedelta
+
+import pymongo
+from pymongo.errors import DuplicateKeyError
+
+# "inline" rebuilds inside the Streamlit session, "worker" only enqueues jobs for indexing_worker.py
+INDEXING_MODE = os.getenv("INDEXING_MODE", "inline").lower()
+
+# A running job whose worker hasn't reported for this many seconds is handed to another worker
+JOB_STALE_AFTER = float(os.getenv("INDEXING_JOB_STALE_AFTER", "600"))
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+def ensure_indexes(collection):
+    """At most one queued job exists at a time, so every enqueue coalesces into it."""
+    collection.create_index(
+        "status",
+        unique=True,
+        partialFilterExpression={"status": QUEUED},
+        name="one_queued_job"
+    )
+    collection.create_index([("created_at", pymongo.DESCENDING)])
+
+
+def enqueue_rebuild(collection, full=False, requested_by=None):
+    """
+    Request an index rebuild. Requests made while a job is still queued are
+    merged into it; a full rebuild request upgrades the queued job.
+
+    Returns:
+        the id of the queued job
+    """
+    now = datetime.now()
+    update = {
+        "$max": {"full": bool(full)},
+        "$inc": {"requests": 1},
+        "$set": {"requested_at": now},
+        "$setOnInsert": {"status": QUEUED, "created_at": now, "progress": {}}
+    }
+    if requested_by:
+        update["$addToSet"] = {"requested_by": requested_by}
+
+    # Two concurrent upserts can both miss the queued job; the loser retries and merges
+    for _ in range(2):
+        try:
+            job = collection.find_one_and_update(
+                {"status": QUEUED},
+                update,
+                upsert=True,
+                return_document=pymongo.ReturnDocument.AFTER
+            )
+            return job["_id"]
+        except DuplicateKeyError:
+            continue
+    raise RuntimeError("Could not enqueue the index rebuild")
+
+
+def claim_job(collection, worker_id):
+    """Take the queued job, if any, and mark it as running on this worker."""
+    now = datetime.now()
+    return collection.find_one_and_update(
+        {"status": QUEUED},
+        {"$set": {"status": RUNNING, "worker": worker_id, "started_at": now, "heartbeat_at": now}},
+        sort=[("created_at", pymongo.ASCENDING)],
+        return_document=pymongo.ReturnDocument.AFTER
+    )
+
+
+def update_progress(collection, job_id, progress):
+    """Publish the progress of a running job (also serves as its heartbeat)."""
+    collection.update_one(
+        {"_id": job_id, "status": RUNNING},
+        {"$set": {"progress": progress, "heartbeat_at": datetime.now()}}
+    )
+
+
+def heartbeat(collection, job_id):
+    """Show that the worker of a running job is still alive."""
+    collection.update_one({"_id": job_id, "status": RUNNING}, {"$set": {"heartbeat_at": datetime.now()}})
+
+
+def finish_job(collection, job_id, error=None, index_hash=None):
+    """Mark a job as done, or as failed with an error message."""
+    collection.update_one(
+        {"_id": job_id},
+        {"$set": {
+            "status": FAILED if error else DONE,
+            "error": error,
+            "index_hash": index_hash,
+            "finished_at": datetime.now()
+        }}
+    )
+
+
+def record_skipped_sources(collection, job_id, source_errors):
+    """Keep the sources a job could not load, as (source key, error) pairs, on its document."""
+    collection.update_one(
+        {"_id": job_id},
+        {"$set": {"skipped_sources": [{"source": source_key, "error": error} for source_key, error in source_errors]}}
+    )
+
+
+def requeue_stale_jobs(collection, stale_after=None):
+    """
+    Hand running jobs of workers that stopped reporting back to the queue. If a
+    newer job is already queued it covers the same sources, so the stale job is
+    failed instead. Returns the number of stale jobs.
+    """
+    stale_after = stale_after or JOB_STALE_AFTER
+    cutoff = datetime.now() - timedelta(seconds=stale_after)
+    stale_jobs = list(collection.find({"status": RUNNING, "heartbeat_at": {"$lt": cutoff}}, {"full": 1}))
+    for job in stale_jobs:
+        try:
+            collection.update_one(
+                {"_id": job["_id"], "status": RUNNING},
+                {"$set": {"status": QUEUED, "progress": {}}, "$unset": {"worker": "", "started_at": ""}}
+            )
+        except DuplicateKeyError:
+            enqueue_rebuild(collection, full=job.get("full", False))
+            finish_job(collection, job["_id"], error="Worker stopped responding")
+    return len(stale_jobs)
+
+
+def get_active_job(collection):
+    """The running job, else the queued one, else the most recently finished one (or None)."""
+    for status in (RUNNING, QUEUED):
+        job = collection.find_one({"status": status}, sort=[("created_at", pymongo.DESCENDING)])
+        if job:
+            return job
+    return collection.find_one({"status": {"$in": [DONE, FAILED]}}, sort=[("finished_at", pymongo.DESCENDING)])
+
+
+class ProgressReporter:
+    """
+    Collects the progress of a build and publishes it to the job document at
+    most every `interval` seconds, with an ETA for the current phase.
+    """
+
+    def __init__(self, collection, job_id, interval=1.0):
+        self.collection = collection
+        self.job_id = job_id
+        self.interval = interval
+        self.progress = {}
+        self.phase_started_at = time.monotonic()
+        self.last_published_at = 0.0
+
+    def __call__(self, **progress):
+        if progress.get("phase") and progress["phase"] != self.progress.get("phase"):
+            self.phase_started_at = time.monotonic()
+        self.progress.update(progress)
+
+        now = time.monotonic()
+        if now - self.last_published_at >= self.interval or progress.get("phase"):
+            self.progress["eta_seconds"] = self.estimate_eta(now)
+            update_progress(self.collection, self.job_id, dict(self.progress))
+            self.last_published_at = now
+
+    def estimate_eta(self, now):
+        """Remaining seconds of the current phase at its rate so far, or None if unknown."""
+        phase = self.progress.get("phase")
+        done, total = {
+            "parsing": ("documents_parsed", "documents_total"),
+            "embedding": ("chunks_embedded", "chunks_total"),
+        }.get(phase, (None, None))
+        done = self.progress.get(done) if done else None
+        total = self.progress.get(total) if total else None
+        if not done or not total:
+            return None
+        return (now - self.phase_started_at) / done * max(0, total - done)
@@ -0,0 +1,164 @@
+"""
+Indexing Worker
+Standalone process that claims index rebuild jobs from MongoDB and publishes the finished indexes
+
+Run it next to the Streamlit app with INDEXING_MODE=worker set for both:
+
+    python indexing_worker.py            # keep polling for jobs
+    python indexing_worker.py --once     # run at most one job and exit
+"""
+
+import os
+import sys
+import time
+import socket
+import argparse
+import threading
+import traceback
+
+import streamlit as st
+
+import index_store
+import indexing_jobs
+import source_catalog
+import streamlit_app
+
+# Seconds between heartbeats of a running job
+HEARTBEAT_INTERVAL = 30
+
+
+def log(message):
+    print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] {message}", flush=True)
+
+
+def run_job(job, reporter):
+    """
+    Build the index for the current sources and publish it.
+
+    Returns:
+        str: hash of the sources the published index was built from
+
+    Raises:
+        RuntimeError: if no index could be built or published
+    """
+    # Reloads the file and URL lists whenever the source catalog changed
+    current_hash = streamlit_app.get_sources_hash()
+
+    # A job queued while the previous build was running may already be covered by it
+    published = index_store.get_current_snapshot(st.session_state.index_collection, {"hash": 1})
+    if not job.get("full") and published and published.get("hash") == current_hash:
+        log("Published index is already up to date")
+        return current_hash
+
+    st.session_state.index_manifest = None
+    index = None
+    if not job.get("full"):
+        index, _ = streamlit_app.load_index_from_mongodb()
+
+    if index is not None and st.session_state.index_manifest is not None:
+        log("Updating the published index incrementally")
+        index = streamlit_app.sync_index_with_sources(streamlit_app.make_index_writable(index))
+    else:
+        log("Rebuilding the index from scratch")
+        index = streamlit_app.load_and_index_documents()
+
+    if index is None:
+        raise RuntimeError("No documents could be indexed")
+
+    reporter(phase="saving")
+    st.session_state.skip_mongodb_save = False
+    st.session_state.index_version_in_db = None
+    streamlit_app.save_index_to_mongodb(index, current_hash)
+    if st.session_state.index_version_in_db != current_hash:
+        raise RuntimeError("The index was built but could not be saved to MongoDB")
+    return current_hash
+
+
+def process_job(job):
+    """Run a claimed job with progress reporting and a heartbeat, and record its outcome."""
+    collection = st.session_state.indexing_jobs_collection
+    reporter = indexing_jobs.ProgressReporter(collection, job["_id"])
+    st.session_state.indexing_progress_callback = reporter
+
+    def report_skipped_sources(source_errors):
+        for source_key, error in source_errors:
+            log(f"Skipped {source_key}: {error}")
+        indexing_jobs.record_skipped_sources(collection, job["_id"], source_errors)
+
+    st.session_state.source_errors_callback = report_skipped_sources
+
+    stop_heartbeat = threading.Event()
+
+    def beat():
+        while not stop_heartbeat.wait(HEARTBEAT_INTERVAL):
+            indexing_jobs.heartbeat(collection, job["_id"])
+
+    threading.Thread(target=beat, daemon=True).start()
+
+    started_at = time.monotonic()
+    log(f"Claimed job {job['_id']} ({'full' if job.get('full') else 'incremental'}, {job.get('requests', 1)} request(s))")
+    try:
+        index_hash = run_job(job, reporter)
+    except Exception as e:
+        log(f"Job {job['_id']} failed: {e}")
+        traceback.print_exc()
+        indexing_jobs.finish_job(collection, job["_id"], error=str(e))
+    else:
+        log(f"Job {job['_id']} published in {time.monotonic() - started_at:.1f}s")
+        indexing_jobs.finish_job(collection, job["_id"], index_hash=index_hash)
+    finally:
+        stop_heartbeat.set()
+        st.session_state.indexing_progress_callback = None
+        st.session_state.source_errors_callback = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Claim and run index rebuild jobs queued by the Streamlit app")
+    parser.add_argument("--once", action="store_true", help="run at most one job and exit")
+    parser.add_argument("--poll-interval", type=float, default=5.0, help="seconds between checks for new jobs")
+    args = parser.parse_args()
+
+    # Reuses the app's MongoDB setup and indexing functions outside of a Streamlit session
+    if not streamlit_app.initialize_session_state():
+        sys.exit("Could not connect to MongoDB or OpenAI, check the .env file")
+    streamlit_app.configure_embed_model()
+
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    collection = st.session_state.indexing_jobs_collection
+    log(f"Indexing worker {worker_id} waiting for jobs")
+
+    while True:
+        stale_jobs = indexing_jobs.requeue_stale_jobs(collection)
+        if stale_jobs:
+            log(f"Requeued {stale_jobs} job(s) of unresponsive workers")
+
+        job = indexing_jobs.claim_job(collection, worker_id)
+        if job:
+            process_job(job)
+        if args.once:
+            return
+        if not job:
+            # Idle time is used to merge the segments of the saved index, delete old snapshots
+            try:
+                if index_store.compact_segments(st.session_state.index_collection, st.session_state.fs):
+                    log("Compacted the saved index segments")
+                deleted = index_store.collect_garbage(st.session_state.index_collection, st.session_state.fs)
+                if deleted:
+                    log(f"Deleted {deleted} old index snapshot(s) and segment(s)")
+            except Exception as e:
+                log(f"Index maintenance failed: {e}")
+            # and to check the source catalog against a full scan
+            try:
+                if source_catalog.verify_catalog(
+                    st.session_state.catalog_collection,
+                    st.session_state.files_collection,
+                    st.session_state.urls_collection
+                ):
+                    log("Corrected the source catalog")
+            except Exception as e:
+                log(f"Source catalog verification failed: {e}")
+            time.sleep(args.poll_interval)
+
+
+if __name__ == "__main__":
+    main()
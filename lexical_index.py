@@ -0,0 +1,443 @@
+"""
+Lexical Index Module
+BM25 inverted index over the same chunks as the vector index, fused with vector search
+through reciprocal rank fusion
+
+The tokenizer keeps tracer and parameter notation such as "[18F]FDG", "K1", "2TCM" or "V_T"
+intact, which embeddings tend to blur. Postings are flat NumPy arrays (CSR layout) plus a
+small buffer of recent additions, merged once it grows.
+"""
+
+import io
+import os
+import re
+import math
+import threading
+import weakref
+from collections import Counter
+
+import numpy as np
+from llama_index.core.retrievers import BaseRetriever
+from llama_index.core.schema import MetadataMode, NodeWithScore
+
+import index_store
+
+# "hybrid" fuses BM25 and vector results, "vector" only uses vector search
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid").lower()
+
+# Candidates each retriever contributes before fusion
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "20"))
+
+# Reciprocal rank fusion constant: a result at rank r adds 1 / (RRF_K + r)
+RRF_K = int(os.getenv("RRF_K", "60"))
+
+# BM25 term frequency saturation and length normalization
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Recent postings are merged into the arrays once they reach this share of them
+MERGE_RATIO = 0.1
+MERGE_MIN_POSTINGS = 50000
+
+# Deleted chunks are dropped from the arrays once they reach this share of all chunks
+MAX_DELETED_RATIO = 0.25
+
+# Bump when the layout of the saved postings changes; older ones are then rebuilt
+LEXICAL_FORMAT_VERSION = 1
+
+# Isotope-labelled tracers ("[18f]fdg", "[11c]raclopride") and words joined by - _ . / ' ("v_t",
+# "k3/k4", "2-tissue", "0.05"), matched on lowercased text
+TOKEN_PATTERN = re.compile(
+    r"\[\d+[a-z]{1,2}\][a-z0-9α-ω]+(?:[-_.'/][a-z0-9α-ω]+)*"
+    r"|[a-z0-9α-ω]+(?:[-_.'/][a-z0-9α-ω]+)*"
+)
+SPLIT_PATTERN = re.compile(r"[\[\]\-_.'/]+")
+
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its of on or that the this to was were "
+    "which with we our these those than then there their can also been not but".split()
+)
+
+
+def tokenize(text):
+    """
+    Lowercased terms of a text. Compound tokens are kept whole and also
+    split, so "[18F]FDG" yields "[18f]fdg", "18f" and "fdg".
+    """
+    terms = []
+    for match in TOKEN_PATTERN.finditer(text.lower()):
+        token = match.group()
+        if token.endswith("'s"):
+            token = token[:-2]
+        if token in STOPWORDS:
+            continue
+        terms.append(token)
+        if not token.isalnum():
+            terms.extend(part for part in SPLIT_PATTERN.split(token) if part and part not in STOPWORDS)
+    return terms
+
+
+def _join(strings):
+    return np.frombuffer("\n".join(strings).encode("utf-8"), dtype=np.uint8)
+
+
+def _split(array):
+    data = array.tobytes().decode("utf-8")
+    return data.split("\n") if data else []
+
+
+class LexicalIndex:
+    """
+    BM25 index of chunks. For term id t, its postings are the chunk rows
+    posting_rows[offsets[t]:offsets[t + 1]] with term frequencies in
+    posting_tfs; chunks added since the last merge are in the pending arrays.
+    """
+
+    def __init__(self):
+        self.vocabulary = {}
+        self.node_ids = []
+        self.rows = {}
+        self.doc_lengths = np.empty(0, dtype=np.int32)
+        self.alive = np.empty(0, dtype=bool)
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.posting_rows = np.empty(0, dtype=np.int32)
+        self.posting_tfs = np.empty(0, dtype=np.uint16)
+        self._pending = []
+        self._pending_postings = 0
+        self._pending_arrays = None
+        # Saved copy of this index, set while it matches what is in GridFS
+        self.manifest = None
+        # index_store.get_index_generation() of the vector index this one matches
+        self.index_generation = None
+
+    def __len__(self):
+        return len(self.rows)
+
+    def add(self, node_ids, texts):
+        """Index chunks; a chunk already in the index is replaced."""
+        self.remove([node_id for node_id in node_ids if node_id in self.rows])
+        lengths = []
+        for node_id, text in zip(node_ids, texts):
+            counts = Counter(tokenize(text))
+            row = len(self.node_ids)
+            self.node_ids.append(node_id)
+            self.rows[node_id] = row
+            lengths.append(sum(counts.values()))
+            if counts:
+                term_ids = np.fromiter(
+                    (self.vocabulary.setdefault(term, len(self.vocabulary)) for term in counts),
+                    dtype=np.int32, count=len(counts)
+                )
+                tfs = np.minimum(np.fromiter(counts.values(), dtype=np.int64, count=len(counts)), 65535)
+                self._pending.append((term_ids, np.full(len(counts), row, dtype=np.int32), tfs.astype(np.uint16)))
+                self._pending_postings += len(counts)
+
+        self.doc_lengths = np.concatenate([self.doc_lengths, np.asarray(lengths, dtype=np.int32)])
+        self.alive = np.concatenate([self.alive, np.ones(len(lengths), dtype=bool)])
+        self._pending_arrays = None
+        self.manifest = None
+        if self._pending_postings > max(MERGE_MIN_POSTINGS, MERGE_RATIO * len(self.posting_rows)):
+            self.merge()
+
+    def remove(self, node_ids):
+        """Drop chunks from the index; unknown ids are ignored."""
+        for node_id in node_ids:
+            row = self.rows.pop(node_id, None)
+            if row is not None:
+                self.alive[row] = False
+                self.manifest = None
+        if len(self.node_ids) and 1 - len(self.rows) / len(self.node_ids) > MAX_DELETED_RATIO:
+            self.merge()
+
+    def merge(self):
+        """Fold pending postings into the arrays and drop deleted chunks, renumbering rows."""
+        term_ids = [np.repeat(np.arange(len(self.offsets) - 1, dtype=np.int32), np.diff(self.offsets))]
+        rows = [self.posting_rows]
+        tfs = [self.posting_tfs]
+        for pending_terms, pending_rows, pending_tfs in self._pending:
+            term_ids.append(pending_terms)
+            rows.append(pending_rows)
+            tfs.append(pending_tfs)
+        term_ids, rows, tfs = np.concatenate(term_ids), np.concatenate(rows), np.concatenate(tfs)
+
+        keep = self.alive[rows]
+        new_rows = np.cumsum(self.alive, dtype=np.int64) - 1
+        term_ids, rows, tfs = term_ids[keep], new_rows[rows[keep]].astype(np.int32), tfs[keep]
+        order = np.lexsort((rows, term_ids))
+
+        self.posting_rows = rows[order]
+        self.posting_tfs = tfs[order]
+        self.offsets = np.concatenate([[0], np.cumsum(np.bincount(term_ids, minlength=len(self.vocabulary)))])
+        self.node_ids = [node_id for node_id, alive in zip(self.node_ids, self.alive) if alive]
+        self.rows = {node_id: row for row, node_id in enumerate(self.node_ids)}
+        self.doc_lengths = self.doc_lengths[self.alive]
+        self.alive = np.ones(len(self.node_ids), dtype=bool)
+        self._pending = []
+        self._pending_postings = 0
+        self._pending_arrays = None
+
+    def _postings(self, term_id):
+        """(rows, tfs) of a term, from the merged arrays and the pending ones."""
+        start, end = (self.offsets[term_id], self.offsets[term_id + 1]) if term_id + 1 < len(self.offsets) else (0, 0)
+        rows, tfs = self.posting_rows[start:end], self.posting_tfs[start:end]
+        if self._pending:
+            if self._pending_arrays is None:
+                pending_terms = np.concatenate([pending[0] for pending in self._pending])
+                order = np.argsort(pending_terms, kind="stable")
+                self._pending_arrays = (
+                    pending_terms[order],
+                    np.concatenate([pending[1] for pending in self._pending])[order],
+                    np.concatenate([pending[2] for pending in self._pending])[order]
+                )
+            pending_terms, pending_rows, pending_tfs = self._pending_arrays
+            first, last = np.searchsorted(pending_terms, [term_id, term_id + 1])
+            if last > first:
+                rows = np.concatenate([rows, pending_rows[first:last]])
+                tfs = np.concatenate([tfs, pending_tfs[first:last]])
+        return rows, tfs
+
+    def search(self, query, top_k, allowed=None):
+        """
+        BM25 top-k for a query string, among the node ids in `allowed` if given.
+
+        Returns:
+            list: (node_id, score) pairs, best first, only chunks matching a query term
+        """
+        term_ids = {self.vocabulary[term] for term in tokenize(query) if term in self.vocabulary}
+        chunk_count = len(self.rows)
+        if not term_ids or not chunk_count:
+            return []
+
+        average_length = max(float(self.doc_lengths[self.alive].mean()), 1.0)
+        scores = np.zeros(len(self.node_ids), dtype=np.float32)
+        for term_id in term_ids:
+            rows, tfs = self._postings(term_id)
+            live = self.alive[rows]
+            rows, tfs = rows[live], tfs[live].astype(np.float32)
+            if not len(rows):
+                continue
+            idf = math.log(1 + (chunk_count - len(rows) + 0.5) / (len(rows) + 0.5))
+            length_norm = BM25_K1 * (1 - BM25_B + BM25_B * self.doc_lengths[rows] / average_length)
+            scores[rows] += idf * tfs * (BM25_K1 + 1) / (tfs + length_norm)
+
+        matched = np.flatnonzero(scores)
+        if allowed is not None:
+            matched = matched[np.fromiter((self.node_ids[row] in allowed for row in matched), dtype=bool, count=len(matched))]
+        if len(matched) > top_k:
+            matched = matched[np.argpartition(-scores[matched], top_k - 1)[:top_k]]
+        matched = matched[np.argsort(-scores[matched])]
+        return [(self.node_ids[row], float(scores[row])) for row in matched]
+
+    def copy(self):
+        """Independent copy, e.g. for a private copy of a shared vector index."""
+        duplicate = LexicalIndex()
+        duplicate.vocabulary = dict(self.vocabulary)
+        duplicate.node_ids = list(self.node_ids)
+        duplicate.rows = dict(self.rows)
+        duplicate.doc_lengths = self.doc_lengths.copy()
+        duplicate.alive = self.alive.copy()
+        duplicate.offsets = self.offsets
+        duplicate.posting_rows = self.posting_rows
+        duplicate.posting_tfs = self.posting_tfs
+        # Merged and pending arrays are never modified in place, so they can be shared
+        duplicate._pending = list(self._pending)
+        duplicate._pending_postings = self._pending_postings
+        duplicate.manifest = self.manifest
+        return duplicate
+
+    def to_bytes(self):
+        """The merged index as an .npz file (no pickled objects); this index is left as is."""
+        merged = self.copy()
+        merged.merge()
+        buffer = io.BytesIO()
+        np.savez(
+            buffer,
+            vocabulary=_join(merged.vocabulary),
+            node_ids=_join(merged.node_ids),
+            doc_lengths=merged.doc_lengths,
+            offsets=merged.offsets,
+            posting_rows=merged.posting_rows,
+            posting_tfs=merged.posting_tfs
+        )
+        return buffer.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data):
+        arrays = np.load(io.BytesIO(data), allow_pickle=False)
+        lexical = cls()
+        lexical.vocabulary = {term: term_id for term_id, term in enumerate(_split(arrays["vocabulary"]))}
+        lexical.node_ids = _split(arrays["node_ids"])
+        lexical.rows = {node_id: row for row, node_id in enumerate(lexical.node_ids)}
+        lexical.doc_lengths = arrays["doc_lengths"]
+        lexical.alive = np.ones(len(lexical.node_ids), dtype=bool)
+        lexical.offsets = arrays["offsets"]
+        lexical.posting_rows = arrays["posting_rows"]
+        lexical.posting_tfs = arrays["posting_tfs"]
+        return lexical
+
+
+def node_text(node):
+    return node.get_content(metadata_mode=MetadataMode.NONE)
+
+
+def build_lexical_index(index):
+    """LexicalIndex over every chunk of a VectorStoreIndex."""
+    lexical = LexicalIndex()
+    node_ids = list(index.index_struct.nodes_dict.values())
+    nodes = index.docstore.get_nodes(node_ids)
+    lexical.add(node_ids, [node_text(node) for node in nodes])
+    lexical.merge()
+    return lexical
+
+
+# One lexical index per vector index object, like the matrices in vector_search
+_indexes = weakref.WeakKeyDictionary()
+_indexes_lock = threading.Lock()
+
+
+def get_lexical_index(index):
+    """The LexicalIndex of a vector index, built on first use or if it missed changes."""
+    with _indexes_lock:
+        lexical = _indexes.get(index)
+        generation = index_store.get_index_generation(index)
+        if lexical is None or lexical.index_generation != generation:
+            lexical = build_lexical_index(index)
+            lexical.index_generation = generation
+            _indexes[index] = lexical
+        return lexical
+
+
+def attach(index, lexical):
+    """Use a LexicalIndex (e.g. one read from MongoDB) for a vector index with the same chunks."""
+    if len(lexical) == len(index.index_struct.nodes_dict):
+        lexical.index_generation = index_store.get_index_generation(index)
+        with _indexes_lock:
+            _indexes[index] = lexical
+
+
+def _caught_up(index, lexical):
+    """Mark a LexicalIndex current after applying a change, unless it has missed others."""
+    if len(lexical) == len(index.index_struct.nodes_dict):
+        lexical.index_generation = index_store.get_index_generation(index)
+    else:
+        lexical.index_generation = None
+
+
+def copy_to(source_index, target_index):
+    """Give a copy of a vector index a copy of the original's lexical index."""
+    with _indexes_lock:
+        lexical = _indexes.get(source_index)
+    if lexical is not None:
+        attach(target_index, lexical.copy())
+
+
+def add_nodes(index, nodes):
+    """Index chunks just inserted into a vector index."""
+    with _indexes_lock:
+        lexical = _indexes.get(index)
+        if lexical is not None:
+            lexical.add([node.node_id for node in nodes], [node_text(node) for node in nodes])
+            _caught_up(index, lexical)
+
+
+def remove_nodes(index, node_ids):
+    """Drop chunks just deleted from a vector index."""
+    with _indexes_lock:
+        lexical = _indexes.get(index)
+        if lexical is not None:
+            lexical.remove(node_ids)
+            _caught_up(index, lexical)
+
+
+def write_postings(fs, lexical):
+    """Store a LexicalIndex in GridFS and return its manifest."""
+    writer = index_store.PartWriter(fs, "vector_index.lexical", "application/octet-stream")
+    try:
+        writer.write(lexical.to_bytes())
+    except Exception:
+        writer.abort()
+        raise
+    part = writer.close()
+    return {
+        "format_version": LEXICAL_FORMAT_VERSION,
+        "kind": "bm25",
+        "node_count": len(lexical),
+        "parts": {"postings": part},
+        "size": part["size"],
+        "compressed_size": part["compressed_size"]
+    }
+
+
+def read_postings(fs, manifest):
+    """The saved LexicalIndex, or None if it was saved in another format."""
+    if manifest.get("format_version") != LEXICAL_FORMAT_VERSION or manifest.get("kind") != "bm25":
+        return None
+    lexical = LexicalIndex.from_bytes(b"".join(index_store.iter_part_blocks(fs, manifest["parts"]["postings"])))
+    lexical.manifest = manifest
+    return lexical
+
+
+def save_postings(index_collection, fs, snapshot_id, lexical):
+    """Attach a LexicalIndex to a snapshot document, retiring the one it had."""
+    manifest = write_postings(fs, lexical)
+    if not index_store.attach_snapshot_part(index_collection, fs, snapshot_id, "lexical", manifest):
+        return False
+    lexical.manifest = manifest
+    return True
+
+
+def reciprocal_rank_fusion(rankings, k=None):
+    """
+    Fuse ranked lists of ids: each id scores the sum of 1 / (k + rank) over
+    the lists it appears in (ranks start at 1).
+
+    Returns:
+        list: (id, score) pairs, best first
+    """
+    k = RRF_K if k is None else k
+    scores = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, start=1):
+            scores[item] = scores.get(item, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda entry: entry[1], reverse=True)
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    Fuses a vector retriever with BM25 over the same index. Vector results
+    below similarity_cutoff are dropped before fusion, so exact-term matches
+    can still come in through BM25. Scores of the results are RRF scores.
+    """
+
+    def __init__(self, index, vector_retriever, similarity_top_k=6, similarity_cutoff=None, node_ids=None, **kwargs):
+        self._index = index
+        self._vector_retriever = vector_retriever
+        self._similarity_top_k = similarity_top_k
+        self._similarity_cutoff = similarity_cutoff
+        # BM25 results are limited to these nodes, if given, like the vector retriever's
+        self._allowed = set(node_ids) if node_ids is not None else None
+        super().__init__(**kwargs)
+
+    def _retrieve(self, query_bundle):
+        vector_results = [
+            result for result in self._vector_retriever.retrieve(query_bundle)
+            if self._similarity_cutoff is None or (result.score or 0.0) >= self._similarity_cutoff
+        ]
+        # Keywords come from the retrieval text, not from an LLM prompt wrapping it
+        lexical_results = get_lexical_index(self._index).search(
+            " ".join(query_bundle.embedding_strs), HYBRID_CANDIDATES, allowed=self._allowed
+        )
+
+        fused = reciprocal_rank_fusion([
+            [result.node.node_id for result in vector_results],
+            [node_id for node_id, _ in lexical_results]
+        ])[:self._similarity_top_k]
+
+        nodes = {result.node.node_id: result.node for result in vector_results}
+        missing = [node_id for node_id, _ in fused if node_id not in nodes]
+        if missing:
+            # Chunks deleted since the BM25 index was built are skipped, not fatal
+            nodes.update(
+                (node.node_id, node) for node in self._index.docstore.get_nodes(missing, raise_error=False)
+            )
+        return [NodeWithScore(node=nodes[node_id], score=score) for node_id, score in fused if node_id in nodes]
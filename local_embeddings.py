@@ -0,0 +1,91 @@
+"""
+Local Embeddings Module
+Offline sentence-transformers embedding backend (PubMedBERT by default) for the RAG index
+"""
+
+import os
+import threading
+from typing import ClassVar, List
+
+from llama_index.core.embeddings import BaseEmbedding
+
+# "openai" uses the remote OpenAI embeddings, "local" runs LOCAL_EMBEDDING_MODEL on this machine
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "openai").lower()
+
+# Same model pubmed_to_embeddings uses for article abstracts
+LOCAL_EMBEDDING_MODEL = os.getenv("LOCAL_EMBEDDING_MODEL", "microsoft/BiomedNLP-PubMedBERT-base-uncased-abstract")
+
+# Chunks per forward pass
+LOCAL_EMBEDDING_BATCH_SIZE = int(os.getenv("LOCAL_EMBEDDING_BATCH_SIZE", "32"))
+
+# Torch CPU threads used for inference (0 keeps torch's default)
+LOCAL_EMBEDDING_THREADS = int(os.getenv("LOCAL_EMBEDDING_THREADS", "0"))
+
+# Loaded models shared by every session of this process, by model name
+_models = {}
+_models_lock = threading.Lock()
+
+
+def get_sentence_transformer(model_name):
+    """Load a sentence-transformers model on the CPU the first time it is needed in this process."""
+    with _models_lock:
+        if model_name not in _models:
+            import torch
+            from sentence_transformers import SentenceTransformer
+
+            if LOCAL_EMBEDDING_THREADS > 0:
+                torch.set_num_threads(LOCAL_EMBEDDING_THREADS)
+            _models[model_name] = SentenceTransformer(model_name, device="cpu")
+        return _models[model_name]
+
+
+class LocalSentenceEmbedding(BaseEmbedding):
+    """
+    llama_index embedding model backed by a local sentence-transformers model.
+
+    Only the model name is stored on the instance, so indexes pickled with it
+    don't carry the model weights; the model itself is loaded once per process.
+    """
+
+    # Inference is already parallel inside torch, so the index build sends one batch at a time
+    runs_locally: ClassVar[bool] = True
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "LocalSentenceEmbedding"
+
+    def _encode(self, texts: List[str]) -> List[List[float]]:
+        model = get_sentence_transformer(self.model_name)
+        embeddings = model.encode(
+            texts,
+            batch_size=self.embed_batch_size,
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+            show_progress_bar=False
+        )
+        return embeddings.tolist()
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        return self._encode([query])[0]
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        return self._get_query_embedding(query)
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self._encode([text])[0]
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        return self._encode(texts)
+
+
+def get_embed_model():
+    """
+    The embedding model selected by EMBEDDING_BACKEND, or None to keep
+    llama_index's default (OpenAI) embeddings.
+    """
+    if EMBEDDING_BACKEND == "local":
+        return LocalSentenceEmbedding(
+            model_name=LOCAL_EMBEDDING_MODEL,
+            embed_batch_size=LOCAL_EMBEDDING_BATCH_SIZE
+        )
+    return None
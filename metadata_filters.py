@@ -0,0 +1,215 @@
+"""
+Metadata Filters Module
+Retrieval filters on the fields of standardized PDF filenames
+("<year>_<first author>_<title>_<category>.pdf"), answered from per-field arrays
+aligned with the chunks of an index
+
+Filters are written like "category=Brain, year>=2020" or "author=Logan|Patlak".
+"""
+
+import os
+import re
+import threading
+import weakref
+
+import numpy as np
+
+import index_store
+
+CATEGORIES = ("Brain", "Lung", "Liver", "Heart", "Kidney", "Advanced")
+
+# Filterable fields; "author" is accepted for first_author
+FILTER_FIELDS = ("year", "first_author", "title", "category")
+FIELD_ALIASES = {"author": "first_author"}
+TEXT_FIELDS = ("first_author", "title", "category")
+
+# Clauses are separated by commas; | separates alternative values
+CLAUSE_PATTERN = re.compile(r"^\s*([A-Za-z_]+)\s*(>=|<=|!=|=|>|<)\s*(.+?)\s*$")
+
+YEAR_PATTERN = re.compile(r"(19|20)\d{2}")
+
+
+def parse_standardized_filename(filename):
+    """
+    Fields of a filename made by get_standardized_filename, e.g.
+    "2021_Smith_Patlak-Analysis-Of-FDG_Brain.pdf". Unknown parts are left
+    out; filenames that don't follow the scheme give an empty dict.
+    """
+    parts = os.path.splitext(os.path.basename(filename or ""))[0].split("_")
+    if len(parts) < 4:
+        return {}
+    category = next((name for name in CATEGORIES if name.lower() == parts[-1].lower()), None)
+    if category is None:
+        return {}
+
+    fields = {"category": category}
+    if YEAR_PATTERN.fullmatch(parts[0]):
+        fields["year"] = int(parts[0])
+    if parts[1] and parts[1] != "Unknown":
+        fields["first_author"] = parts[1]
+    title = "_".join(parts[2:-1])
+    if title:
+        fields["title"] = title
+    return fields
+
+
+def get_node_fields(metadata):
+    """Filter fields of a chunk: those attached at index time, else parsed from its file name."""
+    fields = parse_standardized_filename(metadata.get("file_name"))
+    fields.update((field, metadata[field]) for field in FILTER_FIELDS if metadata.get(field) is not None)
+    return fields
+
+
+def parse_filters(text):
+    """
+    Parse a filter string into (field, operator, values) clauses. Text fields
+    support = and != (title matches substrings); year also supports < <= > >=.
+
+    Raises:
+        ValueError: with a readable message if a clause can't be understood
+    """
+    filters = []
+    for clause in text.split(","):
+        if not clause.strip():
+            continue
+        match = CLAUSE_PATTERN.match(clause)
+        if not match:
+            raise ValueError(f"Can't read the filter \"{clause.strip()}\"")
+        field, operator, value = match.groups()
+        field = FIELD_ALIASES.get(field.lower(), field.lower())
+        if field not in FILTER_FIELDS:
+            raise ValueError(f"Unknown filter field \"{field}\" (use {', '.join(['author'] + list(FILTER_FIELDS))})")
+
+        values = [part.strip() for part in value.split("|") if part.strip()]
+        if field == "year":
+            if not all(part.isdigit() for part in values):
+                raise ValueError(f"Years must be numbers: \"{clause.strip()}\"")
+            values = [int(part) for part in values]
+            if operator not in ("=", "!=") and len(values) != 1:
+                raise ValueError(f"\"{operator}\" takes one year: \"{clause.strip()}\"")
+        elif operator not in ("=", "!="):
+            raise ValueError(f"{field} only supports = and !=: \"{clause.strip()}\"")
+        filters.append((field, operator, values))
+    return filters
+
+
+class FieldIndex:
+    """
+    Filter fields of the chunks of an index as arrays: years as integers,
+    text fields as codes into per-field value lists. Masks of text values
+    are cached as bitmaps, so repeated filters only combine arrays.
+    """
+
+    def __init__(self):
+        self.node_ids = []
+        self.years = np.empty(0, dtype=np.int32)
+        self.codes = {field: np.empty(0, dtype=np.int32) for field in TEXT_FIELDS}
+        self.values = {field: {} for field in TEXT_FIELDS}
+        self._bitmaps = {}
+        # index_store.get_index_generation() of the vector index this one matches
+        self.index_generation = None
+
+    def __len__(self):
+        return len(self.node_ids)
+
+    def add(self, node_ids, metadatas):
+        """Append chunks with their metadata dicts."""
+        years, codes = [], {field: [] for field in TEXT_FIELDS}
+        for metadata in metadatas:
+            fields = get_node_fields(metadata)
+            years.append(int(fields.get("year", -1)))
+            for field in TEXT_FIELDS:
+                value = fields.get(field)
+                values = self.values[field]
+                codes[field].append(-1 if value is None else values.setdefault(str(value).lower(), len(values)))
+
+        self.node_ids.extend(node_ids)
+        self.years = np.concatenate([self.years, np.asarray(years, dtype=np.int32)])
+        for field in TEXT_FIELDS:
+            self.codes[field] = np.concatenate([self.codes[field], np.asarray(codes[field], dtype=np.int32)])
+        self._bitmaps.clear()
+
+    def _bitmap(self, field, code):
+        bitmap = self._bitmaps.get((field, code))
+        if bitmap is None:
+            bitmap = self._bitmaps[(field, code)] = self.codes[field] == code
+        return bitmap
+
+    def mask(self, filters):
+        """Boolean array over the chunks, True where every clause holds."""
+        mask = np.ones(len(self), dtype=bool)
+        for field, operator, values in filters:
+            if field == "year":
+                known = self.years >= 0
+                if operator in ("=", "!="):
+                    matches = np.isin(self.years, values)
+                    matches = matches if operator == "=" else known & ~matches
+                else:
+                    compare = {">": np.greater, ">=": np.greater_equal, "<": np.less, "<=": np.less_equal}[operator]
+                    matches = known & compare(self.years, values[0])
+            else:
+                wanted = [value.lower() for value in values]
+                if field == "title":
+                    # Titles are hyphenated; match the words given anywhere in them
+                    wanted = [value.replace(" ", "-") for value in wanted]
+                    codes = [code for title, code in self.values[field].items() if any(value in title for value in wanted)]
+                else:
+                    codes = [self.values[field][value] for value in wanted if value in self.values[field]]
+                matches = np.zeros(len(self), dtype=bool)
+                for code in codes:
+                    matches |= self._bitmap(field, code)
+                if operator == "!=":
+                    matches = (self.codes[field] >= 0) & ~matches
+            mask &= matches
+        return mask
+
+    def matching_node_ids(self, filters):
+        return [self.node_ids[row] for row in np.flatnonzero(self.mask(filters))]
+
+
+def build_field_index(index):
+    field_index = FieldIndex()
+    node_ids = list(index.index_struct.nodes_dict.values())
+    field_index.add(node_ids, [node.metadata for node in index.docstore.get_nodes(node_ids)])
+    return field_index
+
+
+# One FieldIndex per vector index object, like the matrices in vector_search
+_field_indexes = weakref.WeakKeyDictionary()
+_field_indexes_lock = threading.Lock()
+
+
+def get_field_index(index):
+    """The FieldIndex of a vector index, built on first use or if it missed changes."""
+    with _field_indexes_lock:
+        field_index = _field_indexes.get(index)
+        generation = index_store.get_index_generation(index)
+        if field_index is None or field_index.index_generation != generation:
+            field_index = build_field_index(index)
+            field_index.index_generation = generation
+            _field_indexes[index] = field_index
+        return field_index
+
+
+def add_nodes(index, nodes):
+    """Add chunks just inserted into a vector index."""
+    with _field_indexes_lock:
+        field_index = _field_indexes.get(index)
+        if field_index is not None:
+            field_index.add([node.node_id for node in nodes], [node.metadata for node in nodes])
+            # Current again, unless it had already missed a change
+            if len(field_index) == len(index.index_struct.nodes_dict):
+                field_index.index_generation = index_store.get_index_generation(index)
+            else:
+                field_index.index_generation = None
+
+
+def invalidate(index):
+    """Rebuild the FieldIndex of a vector index on next use, e.g. after chunks were deleted."""
+    with _field_indexes_lock:
+        _field_indexes.pop(index, None)
+
+
+def filter_node_ids(index, filters):
+    """Ids of the chunks of an index matching parsed filters."""
+    return get_field_index(index).matching_node_ids(filters)
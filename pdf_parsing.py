@@ -0,0 +1,180 @@
+"""
+PDF Parsing Module
+Parallel PyMuPDF text extraction used when (re)indexing the PDFs stored in GridFS
+"""
+
+import os
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, TimeoutError, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import fitz  # PyMuPDF
+
+# Number of worker processes used to parse PDFs (1 parses in-process)
+PDF_PARSE_WORKERS = int(os.getenv("PDF_PARSE_WORKERS", max(1, (os.cpu_count() or 2) - 1)))
+
+# Seconds a single PDF may take before its worker is abandoned
+PDF_PARSE_TIMEOUT = float(os.getenv("PDF_PARSE_TIMEOUT", "120"))
+
+# Bump whenever extract_pdf_pages changes its output so cached text is re-parsed
+PDF_PARSER_VERSION = "pymupdf-text-1"
+
+
+def extract_pdf_pages(pdf_content):
+    """
+    Extract the text of every page of a PDF, entirely in memory.
+
+    Args:
+        pdf_content: PDF file content as bytes, or a readable stream such as a
+            GridFS GridOut
+
+    Returns:
+        list: (page_label, text) tuples, one per page
+    """
+    if hasattr(pdf_content, "read"):
+        pdf_content = pdf_content.read()
+
+    pages = []
+    with fitz.open(stream=pdf_content, filetype="pdf") as doc:
+        for page_num, page in enumerate(doc):
+            # Use the PDF's own page labels when it defines them, like pypdf does
+            page_label = page.get_label() or str(page_num + 1)
+            pages.append((page_label, page.get_text("text")))
+    return pages
+
+
+def _terminate_pool(executor):
+    """Shut down a process pool without waiting for stuck workers."""
+    # Python 3.14+ can kill the workers directly
+    if hasattr(executor, "terminate_workers"):
+        executor.terminate_workers()
+        return
+
+    processes = list((getattr(executor, "_processes", None) or {}).values())
+    executor.shutdown(wait=False, cancel_futures=True)
+    for process in processes:
+        if process.is_alive():
+            process.terminate()
+
+
+def _parse_in_own_process(pdf_content, context, timeout):
+    """
+    Parse one PDF in a fresh single-worker pool, so a crash can be pinned on it.
+
+    Returns:
+        (pages, error) with one of them None
+    """
+    executor = ProcessPoolExecutor(max_workers=1, mp_context=context)
+    try:
+        return executor.submit(extract_pdf_pages, pdf_content).result(timeout=timeout), None
+    except BrokenProcessPool:
+        return None, "PDF parser worker crashed"
+    except TimeoutError:
+        return None, f"Parsing timed out after {timeout:g} seconds"
+    except Exception as e:
+        return None, str(e)
+    finally:
+        _terminate_pool(executor)
+
+
+def parse_pdfs_in_parallel(pdf_sources, max_workers=None, timeout=None):
+    """
+    Parse PDFs in a pool of PyMuPDF worker processes.
+
+    Args:
+        pdf_sources: iterable of (key, pdf_content) pairs. It is consumed lazily,
+            so only about max_workers PDFs are held in memory at a time
+        max_workers (int): number of worker processes (defaults to PDF_PARSE_WORKERS)
+        timeout (float): seconds a single PDF may take (defaults to PDF_PARSE_TIMEOUT)
+
+    Yields:
+        (key, pages, error) tuples in completion order. pages is the output of
+        extract_pdf_pages, or None together with an error message
+    """
+    max_workers = max_workers or PDF_PARSE_WORKERS
+    timeout = timeout or PDF_PARSE_TIMEOUT
+    sources = iter(pdf_sources)
+
+    # Not worth a pool: parse in-process (without a timeout)
+    if max_workers <= 1:
+        for key, pdf_content in sources:
+            try:
+                yield key, extract_pdf_pages(pdf_content), None
+            except Exception as e:
+                yield key, None, str(e)
+        return
+
+    # Spawned workers only import this module, and forking the threaded
+    # Streamlit server is unsafe
+    context = multiprocessing.get_context("spawn")
+    executor = ProcessPoolExecutor(max_workers=max_workers, mp_context=context)
+
+    # future -> (key, pdf_content, submitted_at)
+    in_flight = {}
+
+    def fill_pool():
+        # Submit only as many PDFs as there are workers so a PDF's timeout
+        # starts when it actually starts parsing
+        while len(in_flight) < max_workers:
+            next_source = next(sources, None)
+            if next_source is None:
+                return
+            key, pdf_content = next_source
+            future = executor.submit(extract_pdf_pages, pdf_content)
+            in_flight[future] = (key, pdf_content, time.monotonic())
+
+    try:
+        fill_pool()
+
+        while in_flight:
+            next_deadline = min(submitted_at for _, _, submitted_at in in_flight.values()) + timeout
+            done, _ = wait(
+                list(in_flight),
+                timeout=max(0.0, next_deadline - time.monotonic()),
+                return_when=FIRST_COMPLETED
+            )
+
+            crashed = []
+            for future in done:
+                key, pdf_content, _ = in_flight.pop(future)
+                try:
+                    yield key, future.result(), None
+                except BrokenProcessPool:
+                    crashed.append((key, pdf_content))
+                except Exception as e:
+                    yield key, None, str(e)
+
+            if crashed:
+                # A dead worker fails every PDF in flight, and any of them may have
+                # caused it: parse each one alone so only the culprit is reported
+                crashed.extend((key, pdf_content) for key, pdf_content, _ in in_flight.values())
+                in_flight.clear()
+                _terminate_pool(executor)
+                for key, pdf_content in crashed:
+                    pages, error = _parse_in_own_process(pdf_content, context, timeout)
+                    yield key, pages, error
+                executor = ProcessPoolExecutor(max_workers=max_workers, mp_context=context)
+
+            if not done:
+                # A worker stuck in PyMuPDF can't be interrupted, so give up on
+                # the expired PDFs and replace the whole pool
+                now = time.monotonic()
+                for future, (key, _, submitted_at) in list(in_flight.items()):
+                    if now - submitted_at >= timeout:
+                        del in_flight[future]
+                        yield key, None, f"Parsing timed out after {timeout:g} seconds"
+
+                _terminate_pool(executor)
+                executor = ProcessPoolExecutor(max_workers=max_workers, mp_context=context)
+
+                # Resubmit the PDFs that were still in flight on the old pool
+                pending = list(in_flight.values())
+                in_flight.clear()
+                for key, pdf_content, _ in pending:
+                    future = executor.submit(extract_pdf_pages, pdf_content)
+                    in_flight[future] = (key, pdf_content, time.monotonic())
+
+            fill_pool()
+    finally:
+        _terminate_pool(executor)
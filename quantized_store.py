@@ -0,0 +1,465 @@
+"""
+Quantized Vector Store Module
+Vector stores over float32 arrays instead of lists of floats, optionally searching an int8 or
+float16 copy of the embeddings and rescoring the best candidates at full precision
+
+The full-precision vectors of a loaded index stay memory-mapped in the local
+index cache, so processes on one machine share them and, with quantization,
+only the rows of rescored candidates are paged in. Compare the modes on the
+saved index with:
+
+    python quantized_store.py --report
+"""
+
+import os
+import time
+import argparse
+
+import numpy as np
+from pydantic import PrivateAttr
+from llama_index.core.vector_stores import SimpleVectorStore
+from llama_index.core.vector_stores.types import VectorStoreQuery, VectorStoreQueryResult, VectorStoreQueryMode
+from llama_index.core.vector_stores.utils import build_metadata_filter_fn, node_to_metadata_dict
+from llama_index.core.indices.query.embedding_utils import get_top_k_mmr_embeddings
+
+# "none" searches the full-precision vectors, "float16" or "int8" a quantized copy of them
+VECTOR_QUANTIZATION = os.getenv("VECTOR_QUANTIZATION", "none").lower()
+
+# Candidates taken from the quantized search per requested result, then rescored exactly
+RESCORE_FACTOR = int(os.getenv("VECTOR_RESCORE_FACTOR", "4"))
+
+# Rows scored per block, so the quantized matrix is never converted to floats as a whole
+SCORE_BLOCK_ROWS = 65536
+
+QUANTIZATION_DTYPES = {"float16": np.float16, "int8": np.int8}
+
+
+def quantize(vectors, mode):
+    """
+    Quantize unit-normalized vectors.
+
+    Args:
+        vectors (np.ndarray): float matrix of shape n x dim
+        mode (str): "float16" or "int8"
+
+    Returns:
+        tuple: (codes, scales) where codes * scales[:, None] approximates the normalized vectors
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    unit = vectors / np.where(norms > 0, norms, 1.0)
+
+    if mode == "float16":
+        return unit.astype(np.float16), np.ones(len(unit), dtype=np.float32)
+    if mode == "int8":
+        # Symmetric per-row scale, so each vector uses the full int8 range
+        scales = np.abs(unit).max(axis=1) / 127.0
+        scales = np.where(scales > 0, scales, 1.0).astype(np.float32)
+        return np.round(unit / scales[:, None]).astype(np.int8), scales
+    raise ValueError(f"Unknown vector quantization {mode}")
+
+
+def approximate_scores(codes, scales, query):
+    """Cosine similarity of a unit query to every quantized row, computed block by block."""
+    scores = np.empty(len(codes), dtype=np.float32)
+    for start in range(0, len(codes), SCORE_BLOCK_ROWS):
+        block = codes[start:start + SCORE_BLOCK_ROWS].astype(np.float32)
+        scores[start:start + len(block)] = block @ query
+    return scores * scales
+
+
+def exact_scores(vectors, query):
+    """Cosine similarity of a unit query to full-precision rows."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1)
+    return (vectors @ query) / np.where(norms > 0, norms, 1.0)
+
+
+class MappedVectorStore(SimpleVectorStore):
+    """
+    SimpleVectorStore that references float32 arrays instead of keeping every
+    embedding as a list of Python floats: memory-mapped rows of the local index
+    cache for loaded nodes, small arrays for nodes added since. Queries score
+    the stored rows exactly.
+    """
+
+    _full_vectors: dict = PrivateAttr()
+    _search_matrix: tuple = PrivateAttr()
+    _generation: int = PrivateAttr()
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._full_vectors = {}
+        self._search_matrix = None
+        self._generation = 0
+
+    @classmethod
+    def class_name(cls):
+        return "MappedVectorStore"
+
+    def attach_full_vectors(self, full_vectors):
+        """
+        Reference existing full-precision rows (e.g. memory-mapped ones) for nodes
+        about to be added, so add() doesn't keep copies of their embeddings.
+        """
+        self._full_vectors.update(full_vectors)
+
+    def attach_search_matrix(self, node_ids, matrix):
+        """
+        Unit-normalized rows of exactly the stored nodes, in node_ids order (e.g.
+        memory-mapped from the local index cache), for vector_search to score
+        without building its own copy. Dropped on the next add or delete.
+        """
+        self._search_matrix = (list(node_ids), matrix)
+
+    @property
+    def search_matrix(self):
+        """(node ids, unit-normalized matrix) of the stored nodes, or None once they changed."""
+        return self._search_matrix
+
+    @property
+    def generation(self):
+        """Counter of adds and deletes, so derived indexes can tell whether they missed one."""
+        return self._generation
+
+    def get(self, text_id):
+        return np.asarray(self._full_vectors[text_id], dtype=np.float32).tolist()
+
+    def get_vectors(self, node_ids):
+        """Full-precision vectors of the given nodes as one float32 matrix."""
+        return np.array([self._full_vectors[node_id] for node_id in node_ids], dtype=np.float32)
+
+    def add(self, nodes, **add_kwargs):
+        if not nodes:
+            return []
+
+        self._search_matrix = None
+        self._generation += 1
+        vectors = []
+        for node in nodes:
+            # Replacing a stored node; vectors attached for nodes about to be added are kept
+            if node.node_id in self.data.text_id_to_ref_doc_id:
+                self._delete_ids([node.node_id])
+            full_vector = self._full_vectors.get(node.node_id)
+            if full_vector is None:
+                full_vector = np.asarray(node.get_embedding(), dtype=np.float32)
+                self._full_vectors[node.node_id] = full_vector
+            vectors.append(full_vector)
+
+            self.data.text_id_to_ref_doc_id[node.node_id] = node.ref_doc_id or "None"
+            metadata = node_to_metadata_dict(node, remove_text=True, flat_metadata=False)
+            metadata.pop("_node_content", None)
+            self.data.metadata_dict[node.node_id] = metadata
+
+        self._added([node.node_id for node in nodes], vectors)
+        return [node.node_id for node in nodes]
+
+    def _added(self, node_ids, vectors):
+        """Hook for subclasses that index the vectors of newly added nodes."""
+
+    def _delete_ids(self, node_ids):
+        self._search_matrix = None
+        if node_ids:
+            self._generation += 1
+        for node_id in node_ids:
+            self._full_vectors.pop(node_id, None)
+            self.data.text_id_to_ref_doc_id.pop(node_id, None)
+            self.data.metadata_dict.pop(node_id, None)
+
+    def delete(self, ref_doc_id, **delete_kwargs):
+        self._delete_ids([
+            node_id for node_id, node_ref_doc_id in self.data.text_id_to_ref_doc_id.items()
+            if node_ref_doc_id == ref_doc_id
+        ])
+
+    def delete_nodes(self, node_ids=None, filters=None, **delete_kwargs):
+        filter_fn = build_metadata_filter_fn(lambda node_id: self.data.metadata_dict[node_id], filters)
+        candidates = self._full_vectors if node_ids is None else set(node_ids) & self._full_vectors.keys()
+        self._delete_ids([node_id for node_id in list(candidates) if filter_fn(node_id)])
+
+    def clear(self):
+        super().clear()
+        self._full_vectors = {}
+        self._search_matrix = None
+        self._generation += 1
+
+    def _filtered_ids(self, query):
+        """Ids of the nodes a query may return, or None for all of them."""
+        if query.filters is None and query.node_ids is None:
+            return None
+        query_filter_fn = build_metadata_filter_fn(lambda node_id: self.data.metadata_dict[node_id], query.filters)
+        allowed_ids = set(query.node_ids) if query.node_ids is not None else None
+        return [
+            node_id for node_id in self._full_vectors
+            if (allowed_ids is None or node_id in allowed_ids) and query_filter_fn(node_id)
+        ]
+
+    def query(self, query: VectorStoreQuery, **kwargs):
+        node_ids = self._filtered_ids(query)
+        if node_ids is None:
+            node_ids = list(self._full_vectors)
+        if not node_ids:
+            return VectorStoreQueryResult(similarities=[], ids=[])
+
+        if query.mode == VectorStoreQueryMode.MMR:
+            similarities, ids = get_top_k_mmr_embeddings(
+                query.query_embedding,
+                [self.get(node_id) for node_id in node_ids],
+                similarity_top_k=query.similarity_top_k,
+                embedding_ids=node_ids,
+                mmr_threshold=kwargs.get("mmr_threshold")
+            )
+            return VectorStoreQueryResult(similarities=similarities, ids=ids)
+        if query.mode != VectorStoreQueryMode.DEFAULT:
+            raise ValueError(f"Query mode {query.mode} is not supported by the mapped store")
+
+        query_vector = np.asarray(query.query_embedding, dtype=np.float32)
+        query_norm = np.linalg.norm(query_vector)
+        query_vector = query_vector / query_norm if query_norm > 0 else query_vector
+        scores = np.empty(len(node_ids), dtype=np.float32)
+        for start in range(0, len(node_ids), SCORE_BLOCK_ROWS):
+            block_ids = node_ids[start:start + SCORE_BLOCK_ROWS]
+            scores[start:start + len(block_ids)] = exact_scores(self.get_vectors(block_ids), query_vector)
+
+        top_k = min(query.similarity_top_k, len(node_ids))
+        candidates = np.argpartition(-scores, top_k - 1)[:top_k]
+        order = candidates[np.argsort(-scores[candidates])]
+        return VectorStoreQueryResult(
+            similarities=[float(scores[position]) for position in order],
+            ids=[node_ids[position] for position in order]
+        )
+
+    def memory_usage(self):
+        """Bytes of full-precision vectors not backed by a memory map."""
+        in_memory = sum(
+            vector.nbytes for vector in self._full_vectors.values()
+            if not isinstance(vector, np.memmap)
+        )
+        return {"full_precision_bytes": in_memory}
+
+
+class QuantizedVectorStore(MappedVectorStore):
+    """
+    MappedVectorStore that searches a quantized matrix and rescores the top
+    RESCORE_FACTOR * top_k candidates against their full-precision vectors.
+    """
+
+    _mode: str = PrivateAttr()
+    _codes: np.ndarray = PrivateAttr()
+    _scales: np.ndarray = PrivateAttr()
+    _row_ids: list = PrivateAttr()
+    _rows: dict = PrivateAttr()
+    _row_count: int = PrivateAttr()
+
+    def __init__(self, mode=None, **kwargs):
+        super().__init__(**kwargs)
+        self._mode = mode or VECTOR_QUANTIZATION
+        if self._mode not in QUANTIZATION_DTYPES:
+            raise ValueError(f"Unknown vector quantization {self._mode}")
+        self._codes = None
+        self._scales = np.empty(0, dtype=np.float32)
+        self._row_ids = []
+        self._rows = {}
+        self._row_count = 0
+
+    @classmethod
+    def class_name(cls):
+        return "QuantizedVectorStore"
+
+    def _added(self, node_ids, vectors):
+        codes, scales = quantize(np.stack(vectors), self._mode)
+        self._append_rows(node_ids, codes, scales)
+
+    def _append_rows(self, node_ids, codes, scales):
+        """Append quantized rows, growing the matrix by doubling its capacity."""
+        needed = self._row_count + len(codes)
+        if self._codes is None or needed > len(self._codes):
+            capacity = max(needed, 2 * (len(self._codes) if self._codes is not None else 0), 1024)
+            grown_codes = np.empty((capacity, codes.shape[1]), dtype=codes.dtype)
+            grown_scales = np.empty(capacity, dtype=np.float32)
+            if self._codes is not None:
+                grown_codes[:self._row_count] = self._codes[:self._row_count]
+                grown_scales[:self._row_count] = self._scales[:self._row_count]
+            self._codes, self._scales = grown_codes, grown_scales
+
+        self._codes[self._row_count:needed] = codes
+        self._scales[self._row_count:needed] = scales
+        for row, node_id in enumerate(node_ids, start=self._row_count):
+            self._rows[node_id] = row
+        self._row_ids.extend(node_ids)
+        self._row_count = needed
+
+    def _delete_ids(self, node_ids):
+        super()._delete_ids(node_ids)
+        for node_id in node_ids:
+            row = self._rows.pop(node_id, None)
+            if row is not None:
+                self._row_ids[row] = None
+
+        # Drop deleted rows once they make up a quarter of the matrix
+        if self._row_count and len(self._rows) < 0.75 * self._row_count:
+            self._compact()
+
+    def _compact(self):
+        live_rows = np.array([row for row, node_id in enumerate(self._row_ids) if node_id is not None], dtype=np.int64)
+        self._codes = self._codes[live_rows].copy()
+        self._scales = self._scales[live_rows].copy()
+        self._row_ids = [self._row_ids[row] for row in live_rows]
+        self._rows = {node_id: row for row, node_id in enumerate(self._row_ids)}
+        self._row_count = len(self._row_ids)
+
+    def clear(self):
+        super().clear()
+        self._codes = None
+        self._scales = np.empty(0, dtype=np.float32)
+        self._row_ids = []
+        self._rows = {}
+        self._row_count = 0
+
+    def query(self, query: VectorStoreQuery, **kwargs):
+        if query.mode == VectorStoreQueryMode.MMR:
+            return super().query(query, **kwargs)
+        if query.mode != VectorStoreQueryMode.DEFAULT:
+            raise ValueError(f"Query mode {query.mode} is not supported by the quantized store")
+
+        node_ids = self._filtered_ids(query)
+        if node_ids is not None:
+            rows = np.array([self._rows[node_id] for node_id in node_ids], dtype=np.int64)
+        else:
+            rows = np.array(sorted(self._rows.values()), dtype=np.int64)
+        if not len(rows):
+            return VectorStoreQueryResult(similarities=[], ids=[])
+
+        similarities, ids = self.search(query.query_embedding, query.similarity_top_k, rows=rows)
+        return VectorStoreQueryResult(similarities=similarities, ids=ids)
+
+    def search(self, query_embedding, top_k, rows=None, rescore=True):
+        """
+        Top-k node ids by cosine similarity: quantized scores select the
+        candidates, which are then ranked by their full-precision vectors.
+
+        Returns:
+            tuple: (similarities, node ids), best first
+        """
+        query = np.asarray(query_embedding, dtype=np.float32)
+        query_norm = np.linalg.norm(query)
+        query = query / query_norm if query_norm > 0 else query
+
+        if rows is None:
+            rows = np.array(sorted(self._rows.values()), dtype=np.int64)
+        # Scoring the used prefix directly avoids gathering the whole matrix
+        if len(rows) == self._row_count:
+            scores = approximate_scores(self._codes[:self._row_count], self._scales[:self._row_count], query)
+            scores = scores[rows]
+        else:
+            scores = approximate_scores(self._codes[rows], self._scales[rows], query)
+
+        candidate_count = min(len(rows), top_k * RESCORE_FACTOR if rescore else top_k)
+        candidates = np.argpartition(-scores, candidate_count - 1)[:candidate_count]
+        candidate_ids = [self._row_ids[rows[position]] for position in candidates]
+
+        if rescore:
+            scores = exact_scores([self._full_vectors[node_id] for node_id in candidate_ids], query)
+        else:
+            scores = scores[candidates]
+        order = np.argsort(-scores)[:top_k]
+        return [float(scores[position]) for position in order], [candidate_ids[position] for position in order]
+
+    def memory_usage(self):
+        """Bytes held by the quantized matrix and by full-precision vectors not backed by a memory map."""
+        quantized = 0 if self._codes is None else self._codes.nbytes + self._scales.nbytes
+        return {"quantized_bytes": quantized, **super().memory_usage()}
+
+
+def make_vector_store(mode=None):
+    """A QuantizedVectorStore if quantization is enabled, else a MappedVectorStore."""
+    mode = (mode or VECTOR_QUANTIZATION).lower()
+    if mode == "none":
+        return MappedVectorStore()
+    return QuantizedVectorStore(mode=mode)
+
+
+def recall_report(vectors, modes=("float16", "int8"), top_k=6, queries=200, seed=0):
+    """
+    Measure recall@top_k of each quantization mode against exact float32
+    search, with and without rescoring, using stored vectors as queries.
+
+    Returns:
+        list: one dict per mode with its recall, memory and query latency
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    rng = np.random.default_rng(seed)
+    query_rows = rng.choice(len(vectors), size=min(queries, len(vectors)), replace=False)
+    node_ids = [str(row) for row in range(len(vectors))]
+
+    norms = np.linalg.norm(vectors, axis=1)
+    unit = vectors / np.where(norms > 0, norms, 1.0)[:, None]
+    exact = {
+        row: {node_ids[position] for position in np.argsort(-(unit @ unit[row]))[:top_k]}
+        for row in query_rows
+    }
+
+    report = [{
+        "mode": "float32",
+        "bytes": int(vectors.nbytes),
+        "recall": 1.0,
+        "recall_rescored": 1.0,
+        "query_ms": None
+    }]
+    for mode in modes:
+        store = QuantizedVectorStore(mode=mode)
+        store.attach_full_vectors(dict(zip(node_ids, vectors)))
+        codes, scales = quantize(vectors, mode)
+        store._append_rows(node_ids, codes, scales)
+
+        hits = hits_rescored = 0
+        started_at = time.perf_counter()
+        for row in query_rows:
+            hits_rescored += len(exact[row] & set(store.search(vectors[row], top_k)[1]))
+        elapsed = time.perf_counter() - started_at
+        for row in query_rows:
+            hits += len(exact[row] & set(store.search(vectors[row], top_k, rescore=False)[1]))
+
+        total = len(query_rows) * top_k
+        report.append({
+            "mode": mode,
+            "bytes": store.memory_usage()["quantized_bytes"],
+            "recall": hits / total,
+            "recall_rescored": hits_rescored / total,
+            "query_ms": elapsed / len(query_rows) * 1000
+        })
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare recall and memory of the quantization modes on the saved index")
+    parser.add_argument("--report", action="store_true", help="print the recall versus memory report")
+    parser.add_argument("--top-k", type=int, default=6, help="results per query (the app retrieves 6)")
+    parser.add_argument("--queries", type=int, default=200, help="stored vectors used as queries")
+    args = parser.parse_args()
+    if not args.report:
+        parser.print_help()
+        return
+
+    import gridfs
+    import pymongo
+    from dotenv import load_dotenv
+
+    import index_store
+
+    load_dotenv()
+    db = pymongo.MongoClient(os.getenv("MONGO_URI"))["rag_system"]
+    index_doc = index_store.get_current_snapshot(db["index"], {"segments": 1})
+    if not index_doc or "segments" not in index_doc:
+        raise SystemExit("No saved index found")
+
+    vectors = np.stack([row for _, row in index_store.iter_segments(gridfs.GridFS(db), index_doc["segments"])])
+    print(f"{len(vectors)} vectors of dimension {vectors.shape[1]}, top {args.top_k}, {min(args.queries, len(vectors))} queries")
+    print(f"{'mode':<8} {'memory':>10} {'recall':>8} {'rescored':>9} {'query ms':>9}")
+    for entry in recall_report(vectors, top_k=args.top_k, queries=args.queries):
+        query_ms = f"{entry['query_ms']:.2f}" if entry["query_ms"] is not None else "-"
+        print(f"{entry['mode']:<8} {entry['bytes'] / 1048576:>8.1f}MB {entry['recall']:>8.3f} {entry['recall_rescored']:>9.3f} {query_ms:>9}")
+
+
+if __name__ == "__main__":
+    main()
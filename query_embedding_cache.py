@@ -0,0 +1,108 @@
+"""
+Query Embedding Cache Module
+Process-wide LRU cache of query embeddings keyed by embedding model and normalized query text,
+backed by an optional MongoDB tier that survives restarts and is shared by replicas
+"""
+
+import os
+import hashlib
+import re
+import unicodedata
+
+from llama_index.core.schema import QueryBundle
+
+import embedding_cache
+from lru_cache import LRUCache
+
+# Query embeddings kept in memory, shared by every session of this process
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "10000"))
+
+# "on" also stores query embeddings in MongoDB, "off" keeps them in memory only
+QUERY_CACHE_PERSIST = os.getenv("QUERY_CACHE_PERSIST", "on").lower()
+
+# Least recently used query embeddings are evicted from MongoDB beyond this many entries
+QUERY_CACHE_MAX_ENTRIES = int(os.getenv("QUERY_CACHE_MAX_ENTRIES", "50000"))
+
+WHITESPACE_PATTERN = re.compile(r"\s+")
+
+memory_cache = LRUCache(QUERY_CACHE_SIZE)
+
+# Lookups answered from MongoDB after missing in memory, queries sent to the embedding model,
+# and the last MongoDB error (queries still work from memory when MongoDB fails)
+stats = {"persistent_hits": 0, "embedded": 0, "last_error": None}
+
+
+def normalize_query(query):
+    """
+    Query text as used for cache keys: Unicode-normalized with whitespace
+    collapsed. Case is kept, since notation like "K1" and "k1" differs.
+    """
+    return WHITESPACE_PATTERN.sub(" ", unicodedata.normalize("NFKC", query)).strip()
+
+
+def get_query_cache_key(query, model_key):
+    """Cache key for one query; prefixed so it never collides with chunk keys in embedding_cache."""
+    return f"query:{model_key}:{hashlib.sha256(normalize_query(query).encode('utf-8')).hexdigest()}"
+
+
+def get_query_embedding(query, embed_model, collection=None):
+    """
+    Embedding of a query, from memory, then MongoDB, then the embedding model.
+
+    Args:
+        query (str): query text
+        embed_model: llama_index embedding model the index was built with
+        collection: MongoDB collection of the persistent tier, or None for memory only
+
+    Returns:
+        list: the query embedding
+    """
+    cache_key = get_query_cache_key(query, embedding_cache.get_embed_model_key(embed_model))
+    embedding = memory_cache.get(cache_key)
+    if embedding is not None:
+        return embedding
+
+    persist = collection is not None and QUERY_CACHE_PERSIST == "on"
+    if persist:
+        try:
+            embedding = embedding_cache.lookup_embeddings(collection, [cache_key]).get(cache_key)
+        except Exception as e:
+            stats["last_error"] = f"Query embedding lookup in MongoDB failed: {e}"
+        if embedding is not None:
+            stats["persistent_hits"] += 1
+            memory_cache.put(cache_key, embedding)
+            return embedding
+
+    embedding = embed_model.get_query_embedding(query)
+    stats["embedded"] += 1
+    memory_cache.put(cache_key, embedding)
+    if persist:
+        try:
+            embedding_cache.store_embeddings(collection, {cache_key: embedding})
+            embedding_cache.evict_embeddings(collection, QUERY_CACHE_MAX_ENTRIES)
+        except Exception as e:
+            stats["last_error"] = f"Storing the query embedding in MongoDB failed: {e}"
+    return embedding
+
+
+def make_query_bundle(query, embed_model, collection=None, retrieval_query=None):
+    """
+    QueryBundle with its embedding already filled in, so retrievers don't embed the query again.
+
+    Args:
+        query (str): prompt passed to the LLM
+        embed_model: llama_index embedding model the index was built with
+        collection: MongoDB collection of the persistent tier, or None for memory only
+        retrieval_query (str): text chunks are retrieved and reranked by, when it differs
+            from the prompt (e.g. the user's question without the chat history)
+
+    Returns:
+        QueryBundle: bundle whose embedding_strs hold the retrieval text
+    """
+    if retrieval_query is None:
+        return QueryBundle(query_str=query, embedding=get_query_embedding(query, embed_model, collection))
+    return QueryBundle(
+        query_str=query,
+        custom_embedding_strs=[retrieval_query],
+        embedding=get_query_embedding(retrieval_query, embed_model, collection)
+    )
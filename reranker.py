@@ -0,0 +1,204 @@
+"""
+Reranker Module
+Cross-encoder reranking of retrieved chunks on the CPU, with a process-wide score cache and a
+latency budget after which the results of the pipeline without reranking are used
+"""
+
+import os
+import time
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from typing import Any, Optional
+
+from llama_index.core.bridge.pydantic import Field
+from llama_index.core.postprocessor.types import BaseNodePostprocessor
+from llama_index.core.schema import MetadataMode, NodeWithScore
+
+from lru_cache import LRUCache
+
+# "on" reranks a wider candidate pool with the cross-encoder, "off" keeps the similarity cutoff
+RERANKING = os.getenv("RERANKING", "on").lower()
+
+# Small sentence-transformers cross-encoder; runs on the CPU
+RERANK_MODEL = os.getenv("RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+
+# Chunks retrieved for reranking, of which the best RERANK_TOP_N are kept
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "20"))
+RERANK_TOP_N = int(os.getenv("RERANK_TOP_N", "6"))
+
+# Milliseconds a query may spend reranking, waiting for a scoring thread included, before the
+# results without reranking are used instead
+RERANK_BUDGET_MS = float(os.getenv("RERANK_BUDGET_MS", "1500"))
+
+# Scoring threads shared by all sessions; queries beyond this many wait for a free one
+RERANK_WORKERS = int(os.getenv("RERANK_WORKERS", str(max(1, min(4, (os.cpu_count() or 2) // 2)))))
+
+# (query, chunk, index version) scores kept in memory
+RERANK_CACHE_SIZE = int(os.getenv("RERANK_CACHE_SIZE", "20000"))
+
+# Loaded models shared by every session of this process, by model name, and models that failed to load
+_models = {}
+_models_lock = threading.Lock()
+_loading = {}
+
+# A query over budget keeps scoring on its thread and fills the cache for next time, unless it
+# was still waiting for a thread, in which case it is cancelled
+_executor = ThreadPoolExecutor(max_workers=RERANK_WORKERS, thread_name_prefix="reranker")
+
+score_cache = LRUCache(RERANK_CACHE_SIZE)
+
+# Reranked queries; queries that fell back while scoring, while waiting for a scoring thread,
+# or on an error; and the timings and error of the last ones
+stats = {
+    "reranked": 0,
+    "over_budget": 0,
+    "over_budget_queued": 0,
+    "failed": 0,
+    "last_ms": None,
+    "last_queue_ms": None,
+    "last_error": None
+}
+
+
+def get_cross_encoder(model_name):
+    """Load a cross-encoder on the CPU the first time it is needed in this process."""
+    with _models_lock:
+        if model_name not in _models:
+            from sentence_transformers import CrossEncoder
+
+            _models[model_name] = CrossEncoder(model_name, device="cpu")
+        return _models[model_name]
+
+
+def start_loading(model_name=None):
+    """Load a cross-encoder in the background, once per process."""
+    model_name = model_name or RERANK_MODEL
+    with _models_lock:
+        if model_name not in _models and model_name not in _loading:
+            _loading[model_name] = _executor.submit(get_cross_encoder, model_name)
+
+
+def is_ready(model_name=None):
+    """
+    True once the cross-encoder is loaded. Until then, or if it can't be
+    loaded, queries are answered without reranking.
+    """
+    model_name = model_name or RERANK_MODEL
+    if model_name in _models:
+        return True
+    start_loading(model_name)
+    loading = _loading.get(model_name)
+    if loading is not None and loading.done() and loading.exception() is not None:
+        stats["last_error"] = f"Could not load {model_name}: {loading.exception()}"
+    return False
+
+
+def score_pairs(model_name, query, texts, submitted_at=None):
+    """Relevance score of every (query, text) pair in one batched forward pass."""
+    if submitted_at is not None:
+        stats["last_queue_ms"] = (time.perf_counter() - submitted_at) * 1000
+    model = get_cross_encoder(model_name)
+    scores = model.predict([(query, text) for text in texts], batch_size=len(texts), show_progress_bar=False)
+    return [float(score) for score in scores]
+
+
+def query_hash(query):
+    return hashlib.sha256(query.strip().encode("utf-8")).hexdigest()
+
+
+class CrossEncoderRerank(BaseNodePostprocessor):
+    """
+    Keep the top_n chunks by cross-encoder score. Chunks with the same text
+    as a better-ranked one are dropped first. Without scores within
+    budget_ms, the results of fallback_retriever are returned instead,
+    filtered by fallback_cutoff, i.e. what the query would have gotten
+    without reranking.
+    """
+
+    top_n: int = Field(default=RERANK_TOP_N)
+    model_name: str = Field(default=RERANK_MODEL)
+    budget_ms: float = Field(default=RERANK_BUDGET_MS)
+    # Scores are cached per index version, e.g. the sources hash the index was built from
+    index_version: Optional[str] = Field(default=None)
+    # Retriever and similarity cutoff of the pipeline without reranking
+    fallback_retriever: Optional[Any] = Field(default=None, exclude=True)
+    fallback_cutoff: Optional[float] = Field(default=None)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "CrossEncoderRerank"
+
+    def _postprocess_nodes(self, nodes, query_bundle=None):
+        nodes = self._drop_duplicates(nodes)
+        if not nodes or query_bundle is None:
+            return self._fallback(nodes, query_bundle)
+
+        started_at = time.perf_counter()
+        # Score against the retrieval text (the user's question), not a prompt wrapping it
+        query = " ".join(query_bundle.embedding_strs)
+        key_prefix = (query_hash(query), self.index_version)
+        scores = {}
+        missing = []
+        for result in nodes:
+            score = score_cache.get((*key_prefix, result.node.node_id))
+            if score is None:
+                missing.append(result)
+            else:
+                scores[result.node.node_id] = score
+
+        if missing:
+            future = _executor.submit(
+                score_pairs,
+                self.model_name,
+                query,
+                [result.node.get_content(metadata_mode=MetadataMode.EMBED) for result in missing],
+                submitted_at=started_at
+            )
+            # Scores arriving after the budget still serve the next identical query
+            future.add_done_callback(lambda done: self._cache_scores(done, key_prefix, missing))
+            try:
+                new_scores = future.result(timeout=self.budget_ms / 1000)
+            except TimeoutError:
+                # Still waiting for a thread: other sessions' reranks are using them all
+                if future.cancel():
+                    stats["over_budget_queued"] += 1
+                else:
+                    stats["over_budget"] += 1
+                return self._fallback(nodes, query_bundle)
+            except Exception as e:
+                stats["failed"] += 1
+                stats["last_error"] = str(e)
+                return self._fallback(nodes, query_bundle)
+            scores.update((result.node.node_id, score) for result, score in zip(missing, new_scores))
+
+        reranked = sorted(nodes, key=lambda result: scores[result.node.node_id], reverse=True)[:self.top_n]
+        stats["reranked"] += 1
+        stats["last_ms"] = (time.perf_counter() - started_at) * 1000
+        return [NodeWithScore(node=result.node, score=scores[result.node.node_id]) for result in reranked]
+
+    def _fallback(self, nodes, query_bundle):
+        """Results of the pipeline without reranking."""
+        if self.fallback_retriever is not None and query_bundle is not None:
+            nodes = self.fallback_retriever.retrieve(query_bundle)
+        if self.fallback_cutoff is not None:
+            nodes = [result for result in nodes if (result.score or 0.0) >= self.fallback_cutoff]
+        return nodes[:self.top_n]
+
+    @staticmethod
+    def _cache_scores(future, key_prefix, results):
+        if future.cancelled() or future.exception() is not None:
+            return
+        for result, score in zip(results, future.result()):
+            score_cache.put((*key_prefix, result.node.node_id), score)
+
+    @staticmethod
+    def _drop_duplicates(nodes):
+        seen = set()
+        unique = []
+        for result in nodes:
+            text_hash = hashlib.sha256(result.node.get_content().encode("utf-8")).digest()
+            if text_hash not in seen:
+                seen.add(text_hash)
+                unique.append(result)
+        return unique
@@ -0,0 +1,98 @@
+"""
+Shared Index Module
+One in-memory copy of each saved index version per process, shared by all Streamlit sessions
+"""
+
+import threading
+import weakref
+
+
+class IndexVersion:
+    """A loaded index version with what sessions need to adopt it."""
+
+    def __init__(self, key, index, index_hash, manifest, generation, node_ids, snapshot_id=None):
+        self.key = key
+        self.index = index
+        self.index_hash = index_hash
+        self.manifest = manifest
+        self.generation = generation
+        self.snapshot_id = snapshot_id
+        self.node_ids = frozenset(node_ids)
+        # Leases of the sessions using this version; entries vanish with their sessions
+        self.leases = weakref.WeakSet()
+
+    @property
+    def refcount(self):
+        return len(self.leases)
+
+
+class IndexLease:
+    """
+    Held in a session's state while it uses a version. The version stays in
+    memory as long as a lease or the holder references it.
+    """
+
+    __slots__ = ("version", "__weakref__")
+
+    def __init__(self, version):
+        self.version = version
+        version.leases.add(self)
+
+
+class SharedIndexHolder:
+    """
+    The current index version of this process. Publishing a new version swaps
+    it in atomically; older versions are freed once their last lease is gone.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Only one session downloads a given version, the others wait for it
+        self._load_lock = threading.Lock()
+        self._current = None
+        self._versions = weakref.WeakSet()
+
+    @property
+    def current(self):
+        return self._current
+
+    def publish(self, key, index, index_hash, manifest, generation, node_ids, snapshot_id=None):
+        """Make a new version current and return it."""
+        version = IndexVersion(key, index, index_hash, manifest, generation, node_ids, snapshot_id)
+        with self._lock:
+            self._current = version
+            self._versions.add(version)
+        return version
+
+    def get_or_load(self, key, loader):
+        """
+        The version with this key, loading and publishing it with `loader` if it
+        isn't current. loader returns publish() arguments after the key, or None.
+        """
+        version = self._current
+        if version is not None and version.key == key:
+            return version
+
+        with self._load_lock:
+            version = self._current
+            if version is not None and version.key == key:
+                return version
+
+            loaded = loader()
+            if loaded is None:
+                return None
+            return self.publish(key, *loaded)
+
+    def lease(self, version):
+        return IndexLease(version)
+
+    def is_shared(self, index):
+        """True if the index object belongs to a version other sessions may be reading."""
+        with self._lock:
+            return any(version.index is index for version in list(self._versions))
+
+    def stats(self):
+        """Key of the current version and (key, sessions) of every version still in memory."""
+        with self._lock:
+            versions = [(version.key, version.refcount) for version in list(self._versions)]
+            return {"current": self._current.key if self._current else None, "versions": versions}
@@ -0,0 +1,133 @@
+"""
+Source Catalog Module
+One small MongoDB document summarizing all PDFs and URLs, updated by every ingest and delete
+"""
+
+import os
+import hashlib
+from datetime import datetime, timedelta
+
+import pymongo
+from pymongo.errors import DuplicateKeyError
+
+# Seconds between full scans that repair the catalog if a write path missed an update
+CATALOG_VERIFY_INTERVAL = float(os.getenv("CATALOG_VERIFY_INTERVAL", "300"))
+
+CATALOG_ID = "sources"
+
+# Bits of each source's hash; their sum stays far from the int64 limit for millions of sources
+SOURCE_HASH_BITS = 40
+
+
+def source_hash(source_key, fingerprint):
+    """Hash of one source version, e.g. ("pdf:<filename>", "<last_modified>") or ("url:<url>", "")."""
+    digest = hashlib.sha256(f"{source_key}\0{fingerprint}".encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") >> (64 - SOURCE_HASH_BITS)
+
+
+def file_fingerprint(file_doc):
+    return str(file_doc.get("last_modified", 0))
+
+
+def record_change(collection, added=None, removed=None):
+    """
+    Atomically apply added and removed sources (dicts of source key -> fingerprint)
+    to the catalog. The digest is a sum of source hashes, so it doesn't depend
+    on the order of the changes. A catalog that was never built is left for
+    verify_catalog to build from a full scan.
+    """
+    added = added or {}
+    removed = removed or {}
+    if not added and not removed:
+        return
+    delta = (
+        sum(source_hash(key, fingerprint) for key, fingerprint in added.items())
+        - sum(source_hash(key, fingerprint) for key, fingerprint in removed.items())
+    )
+    collection.update_one(
+        {"_id": CATALOG_ID},
+        {
+            "$inc": {"version": 1, "digest": delta, "count": len(added) - len(removed)},
+            "$set": {"updated_at": datetime.now()}
+        }
+    )
+
+
+def get_catalog(collection):
+    """The catalog document, or None if it was never built."""
+    return collection.find_one({"_id": CATALOG_ID})
+
+
+def catalog_hash(catalog):
+    """Identifies the current set of sources, like the full source listing did."""
+    if not catalog or not catalog.get("count"):
+        return "no_sources"
+    return f"catalog:{catalog['count']}:{catalog['digest'] & ((1 << 64) - 1):016x}"
+
+
+def scan_sources(files_collection, urls_collection):
+    """Full scan: (digest, count) of the sources as they are stored right now."""
+    digest = count = 0
+    for file_doc in files_collection.find({}, {"filename": 1, "last_modified": 1, "_id": 0}):
+        digest += source_hash(f"pdf:{file_doc['filename']}", file_fingerprint(file_doc))
+        count += 1
+    for url in {url_doc["url"] for url_doc in urls_collection.find({}, {"url": 1, "_id": 0})}:
+        digest += source_hash(f"url:{url}", "")
+        count += 1
+    return digest, count
+
+
+def needs_verification(catalog, interval=None):
+    """True if the catalog is missing or its last full scan is older than `interval` seconds."""
+    interval = CATALOG_VERIFY_INTERVAL if interval is None else interval
+    if not catalog or "version" not in catalog or not catalog.get("verified_at"):
+        return True
+    return datetime.now() - catalog["verified_at"] >= timedelta(seconds=interval)
+
+
+def verify_catalog(collection, files_collection, urls_collection, interval=None, force=False):
+    """
+    Recompute the catalog from a full scan at most every `interval` seconds
+    across all processes, and correct it if it drifted.
+
+    Returns:
+        bool: True if the catalog was created or corrected
+    """
+    interval = CATALOG_VERIFY_INTERVAL if interval is None else interval
+    now = datetime.now()
+
+    # Only one caller per interval wins the claim and scans
+    catalog = collection.find_one_and_update(
+        {"_id": CATALOG_ID} if force else {
+            "_id": CATALOG_ID,
+            "$or": [{"verified_at": {"$lt": now - timedelta(seconds=interval)}}, {"verified_at": {"$exists": False}}]
+        },
+        {"$set": {"verified_at": now}},
+        return_document=pymongo.ReturnDocument.BEFORE
+    )
+    if catalog is None:
+        if collection.find_one({"_id": CATALOG_ID}, {"_id": 1}):
+            return False  # verified recently by someone else
+        catalog = {"version": None}
+
+    digest, count = scan_sources(files_collection, urls_collection)
+    if catalog.get("digest") == digest and catalog.get("count") == count:
+        return False
+
+    # A change recorded during the scan wins; the next verification looks again
+    if catalog["version"] is None:
+        query = {"_id": CATALOG_ID, "version": {"$exists": False}}
+    else:
+        query = {"_id": CATALOG_ID, "version": catalog["version"]}
+    try:
+        result = collection.update_one(
+            query,
+            {
+                "$set": {"digest": digest, "count": count, "updated_at": now, "verified_at": now},
+                "$inc": {"version": 1}
+            },
+            upsert=catalog["version"] is None
+        )
+    except DuplicateKeyError:
+        return False
+    return bool(result.matched_count or result.upserted_id)
@@ -3,6 +3,8 @@
 import os
 import streamlit as st
 import time
+import copy
+import threading
 import json
 import validators
 import requests
@@ -10,14 +12,12 @@ from io import BytesIO
 from bs4 import BeautifulSoup
 from dotenv import load_dotenv
 from llama_index.core import VectorStoreIndex, SimpleDirectoryReader, Document, Settings
-from llama_index.core.retrievers import VectorIndexRetriever
 from llama_index.core.query_engine import RetrieverQueryEngine
 from llama_index.core.node_parser import SentenceSplitter
 from llama_index.core.postprocessor import SimilarityPostprocessor
 import pymongo
 import gridfs
 import hashlib
-import tempfile
 
 import base64
 import numpy as np
@@ -53,6 +53,21 @@ except ModuleNotFoundError:
     from urllib.parse import urlparse
 
 import pubmed_to_embeddings
+import pdf_parsing
+import embedding_cache
+import local_embeddings
+import url_cache
+import indexing_jobs
+import index_store
+import shared_index
+import source_catalog
+import index_watcher
+import vector_search
+import ann_index
+import lexical_index
+import metadata_filters
+import reranker
+import query_embedding_cache
 
 # Add these constants to your existing constants
 GOOGLE_DRIVE_FOLDER_ID = "1w-6V_XZvNK6gOeFT61KZk1GLHg65brKR"  # Your Google Drive folder ID
@@ -109,6 +124,14 @@ SESSION_KEYS = [
     "spreadsheet_url_success",      # Success message for spreadsheet URL import
     "spreadsheet_url_error",        # Error message for spreadsheet URL import
     "pubmed_embeddings_status", 
+    "index_manifest",               # Sources (and their doc ids) the current index was built from
+    "force_full_reindex",           # Flag to rebuild the index from scratch instead of syncing it
+    "indexing_progress_callback",   # Set by indexing_worker.py to publish build progress
+    "persisted_segments",           # Generation and node ids of the saved index this session last loaded or saved
+    "index_lease",                  # Keeps the shared index version this session uses in memory
+    "catalog_version",              # Source catalog version the file and URL lists were last loaded at
+    "catalog_cache",                # Last read source catalog and the watcher event count at that time
+    "sources_changed_here",         # Set when this session added or deleted sources since its last rebuild
 ]
 
 
@@ -654,6 +677,33 @@ def initialize_session_state():
             st.session_state.index_collection = db["index"]  # Now db is defined
             st.session_state.fs = gridfs.GridFS(db)
             
+            # Parsed PDF text keyed by content hash, and hit/miss counters of the caches
+            st.session_state.parsed_text_collection = db["parsed_text_cache"]
+            st.session_state.parsed_text_collection.create_index(
+                [("content_hash", pymongo.ASCENDING), ("parser_version", pymongo.ASCENDING)],
+                unique=True
+            )
+            st.session_state.cache_stats_collection = db["cache_stats"]
+            
+            # Chunk embeddings keyed by model and chunk text hash, evicted least recently used first
+            st.session_state.embedding_cache_collection = db["embedding_cache"]
+            st.session_state.embedding_cache_collection.create_index("last_used")
+            
+            # Query embeddings keyed by model and normalized query text, behind an in-process LRU
+            st.session_state.query_embedding_collection = db["query_embedding_cache"]
+            st.session_state.query_embedding_collection.create_index("last_used")
+            
+            # Cleaned URL text with the validators needed for conditional requests, keyed by URL
+            st.session_state.url_content_collection = db["url_content_cache"]
+            
+            # Rebuild requests picked up by indexing_worker.py
+            st.session_state.indexing_jobs_collection = db["indexing_jobs"]
+            indexing_jobs.ensure_indexes(st.session_state.indexing_jobs_collection)
+            
+            # Version and digest of all sources, so reruns detect changes with one read
+            st.session_state.catalog_collection = db["source_catalog"]
+            st.session_state.catalog_version = None
+            
             # Load initial files and URLs
             st.session_state.uploaded_files = [
                 file_doc["filename"] for file_doc in st.session_state.files_collection.find({}, {"filename": 1, "_id": 0})
@@ -670,6 +720,8 @@ def initialize_session_state():
         st.session_state.index = None
         st.session_state.last_update_time = time.time()
         st.session_state.index_hash = ""
+        st.session_state.index_manifest = None
+        st.session_state.force_full_reindex = False
         st.session_state.indexing_status = "idle"
         st.session_state.confirm_delete = None
         st.session_state.confirm_delete_url = None
@@ -688,41 +740,106 @@ def initialize_session_state():
 
 # Function to get a hash representing current sources (PDFs and URLs)
 def get_sources_hash():
-    hash_components = []
+    """
+    Identify the current PDFs and URLs from the source catalog (one small
+    document) and reload this session's file and URL lists when it changed.
+    The catalog is checked against a full scan every CATALOG_VERIFY_INTERVAL.
+    """
+    # While change streams are delivering events, no source event means no change
+    watcher = st.session_state.get("index_watcher")
+    cached = st.session_state.get("catalog_cache")
+    if (
+        cached and watcher and watcher.healthy and watcher.mode == index_watcher.CHANGE_STREAMS
+        and cached["sources_version"] == watcher.sources_version
+        and not source_catalog.needs_verification(cached["catalog"])
+    ):
+        return source_catalog.catalog_hash(cached["catalog"])
+    # Read before the catalog, so an event arriving during the read isn't lost
+    sources_version = watcher.sources_version if watcher else None
+    
+    collection = st.session_state.catalog_collection
+    try:
+        catalog = source_catalog.get_catalog(collection)
+        if source_catalog.needs_verification(catalog):
+            source_catalog.verify_catalog(
+                collection,
+                st.session_state.files_collection,
+                st.session_state.urls_collection
+            )
+            catalog = source_catalog.get_catalog(collection)
+    except Exception as e:
+        st.warning(f"Could not read the source catalog: {str(e)}")
+        catalog = None
+    
+    if catalog is not None and catalog.get("version") != st.session_state.get("catalog_version"):
+        # Another session or the worker may have added or deleted sources
+        refresh_source_lists()
+        st.session_state.catalog_version = catalog.get("version")
+    
+    st.session_state.catalog_cache = {"catalog": catalog, "sources_version": sources_version} if catalog else None
+    return source_catalog.catalog_hash(catalog)
+
+# Function to reload the lists of PDFs and URLs from MongoDB
+def refresh_source_lists():
+    st.session_state.uploaded_files = [
+        file_doc["filename"] for file_doc in st.session_state.files_collection.find({}, {"filename": 1, "_id": 0})
+    ]
+    st.session_state.urls = [
+        url_doc["url"] for url_doc in st.session_state.urls_collection.find({}, {"url": 1, "_id": 0})
+    ]
+
+# Function to record added or deleted sources in the source catalog
+def record_source_change(added_files=(), removed_files=(), added_urls=(), removed_urls=()):
+    """
+    Update the source catalog after files (their metadata documents) or URLs
+    were stored or deleted. A failed update is repaired by the next full scan.
+    """
+    # This session rebuilds for its own changes instead of waiting for another one
+    st.session_state.catalog_cache = None
+    st.session_state.sources_changed_here = True
+    try:
+        source_catalog.record_change(
+            st.session_state.catalog_collection,
+            added={
+                **{f"pdf:{file_doc['filename']}": source_catalog.file_fingerprint(file_doc) for file_doc in added_files},
+                **{f"url:{url}": "" for url in added_urls}
+            },
+            removed={
+                **{f"pdf:{file_doc['filename']}": source_catalog.file_fingerprint(file_doc) for file_doc in removed_files},
+                **{f"url:{url}": "" for url in removed_urls}
+            }
+        )
+    except Exception as e:
+        st.warning(f"Could not update the source catalog: {str(e)}")
+
+# Function to get a manifest of the current sources (PDFs and URLs)
+def get_sources_manifest():
+    """
+    Map every current source to a version fingerprint.
     
-    # Add file metadata to hash
-    files = st.session_state.uploaded_files
-    for filename in sorted(files):
-        file_doc = st.session_state.files_collection.find_one({"filename": filename})
-        if file_doc:
-            hash_components.append(f"pdf:{filename}:{file_doc.get('last_modified', 0)}")
+    Keys are "pdf:<filename>" or "url:<url>". A source whose fingerprint differs
+    from the one recorded in the index manifest has to be re-indexed.
+    """
+    manifest = {}
     
-    # Add URLs to hash
-    for url in sorted(st.session_state.urls):
-        hash_components.append(f"url:{url}")
+    # Fetch all file metadata in one query instead of one query per file
+    uploaded = set(st.session_state.uploaded_files)
+    for file_doc in st.session_state.files_collection.find({}, {"filename": 1, "last_modified": 1, "_id": 0}):
+        if file_doc.get("filename") in uploaded:
+            manifest[f"pdf:{file_doc['filename']}"] = str(file_doc.get("last_modified", 0))
     
-    if not hash_components:
-        return "no_sources"
+    for url in st.session_state.urls:
+        manifest[f"url:{url}"] = ""
     
-    return ";".join(hash_components)
+    return manifest
 
 # Function to extract text from URL
 def extract_text_from_url(url):
+    """Cleaned text of a URL, served from the URL content store when the page hasn't changed."""
     try:
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()
-        
-        soup = BeautifulSoup(response.text, 'html.parser')
-        
-        for script in soup(["script", "style"]):
-            script.extract()
-        
-        text = soup.get_text(separator='\n')
-        
-        lines = (line.strip() for line in text.splitlines())
-        chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
-        text = '\n'.join(chunk for chunk in chunks if chunk)
-        
+        text, how = url_cache.fetch_url_text(url, st.session_state.url_content_collection)
+        hit = how != url_cache.FETCHED
+        record_cache_stats("url_content", int(hit), int(not hit))
         return text
     except Exception as e:
         st.error(f"Error extracting text from URL {url}: {str(e)}")
@@ -745,6 +862,7 @@ def update_save_urls(urls):
         # Remove URLs that are no longer in the list
         if urls_to_remove:
             st.session_state.urls_collection.delete_many({"url": {"$in": urls_to_remove}})
+            record_source_change(removed_urls=set(urls_to_remove))
         
         # Add new URLs (in new list but not in database)
         for url in urls:
@@ -754,6 +872,8 @@ def update_save_urls(urls):
                     "source": "manual_addition",
                     "import_date": datetime.now()
                 })
+                current_urls_dict[url] = None
+                record_source_change(added_urls=[url])
                 
     except Exception as e:
         st.error(f"Error saving URLs to MongoDB: {str(e)}")
@@ -793,22 +913,103 @@ def add_url():
     st.session_state.should_rerun = True
     return True
     
+# Function to report the progress of an index build
+def report_indexing_progress(**progress):
+    """Pass build progress to the indexing worker, if this build runs in one."""
+    progress_callback = st.session_state.get("indexing_progress_callback")
+    if progress_callback:
+        progress_callback(**progress)
+
+# Function to embed nodes, reusing cached chunk embeddings
+def embed_nodes(nodes):
+    """
+    Attach an embedding to every node, sending only chunks that are not in the
+    embedding cache to the embedding model (in concurrent, rate-limit-aware
+    batches). Records the hit rate and embedding throughput of this build.
+    """
+    report_indexing_progress(phase="embedding", chunks_embedded=0, chunks_total=len(nodes))
+    try:
+        hits, misses, embed_stats = embedding_cache.embed_nodes_with_cache(
+            nodes,
+            Settings.embed_model,
+            st.session_state.embedding_cache_collection,
+            progress_callback=lambda done, total: report_indexing_progress(
+                chunks_embedded=len(nodes) - total + done
+            )
+        )
+    except Exception as e:
+        # Nodes without an embedding are embedded by the index itself
+        st.warning(f"Embedding cache unavailable, embedding all chunks directly: {str(e)}")
+        return
+    
+    throughput = {}
+    if embed_stats:
+        throughput = {
+            "last_chunks_per_second": embed_stats["chunks_per_second"],
+            "last_embed_seconds": embed_stats["seconds"],
+            "last_embed_retries": embed_stats["retries"]
+        }
+    record_cache_stats("embeddings", hits, misses, throughput)
+
 # Function to update index with a single document
 def update_index_with_document(index, document):
-    """Update existing index with a single new document."""
+    """
+    Update existing index with a single new document (or a list of documents).
+    Returns None if the update failed.
+    """
     if index is None:
         return None
         
     try:
-        # Convert document to nodes
-        nodes = Settings.node_parser.get_nodes_from_documents([document])
+        documents = document if isinstance(document, list) else [document]
+        
+        # Convert documents to nodes
+        nodes = Settings.node_parser.get_nodes_from_documents(documents)
+        embed_nodes(nodes)
         
         # Insert nodes into existing index
         index.insert_nodes(nodes)
+        vector_search.add_nodes(index, nodes)
+        lexical_index.add_nodes(index, nodes)
+        metadata_filters.add_nodes(index, nodes)
         return index
     except Exception as e:
         st.error(f"Error updating index: {str(e)}")
-        return index
+        return None
+
+# Function to delete documents and their nodes from the index
+def delete_documents_from_index(index, doc_ids):
+    """Delete documents by ref_doc_id, with their nodes and search structures. Unknown ids are skipped."""
+    for doc_id in doc_ids:
+        ref_doc_info = index.docstore.get_ref_doc_info(doc_id)
+        if ref_doc_info is None:
+            continue
+        # Copied first: deleting the document empties this list
+        node_ids = list(ref_doc_info.node_ids)
+        index.delete_ref_doc(doc_id, delete_from_docstore=True)
+        lexical_index.remove_nodes(index, node_ids)
+    vector_search.invalidate(index)
+    metadata_filters.invalidate(index)
+
+# Function to remove a single source from the index
+def remove_source_from_index(index, source_key):
+    """
+    Delete the nodes of one source (e.g. "pdf:<filename>" or "url:<url>") from
+    the index and drop it from the index manifest.
+    """
+    manifest = st.session_state.get("index_manifest")
+    if index is None or not manifest or source_key not in manifest:
+        return False
+    
+    try:
+        delete_documents_from_index(index, manifest[source_key]["doc_ids"])
+        del manifest[source_key]
+        return True
+    except Exception as e:
+        st.warning(f"Could not remove {source_key} from the index: {str(e)}. The index will be rebuilt.")
+        # The index no longer matches the manifest, so fall back to a full rebuild
+        st.session_state.index_manifest = None
+        return False
 
 # Updated handle_file_upload function with duplicate handling
 def handle_file_upload(uploaded_file):
@@ -882,7 +1083,7 @@ def handle_file_upload(uploaded_file):
                     )
                     
                     # Save file metadata with both content hashes for deduplication
-                    files_collection.insert_one({
+                    file_doc = {
                         "filename": standardized_filename,
                         "original_filename": uploaded_file.name,
                         "gridfs_id": file_id,
@@ -893,7 +1094,9 @@ def handle_file_upload(uploaded_file):
                         "content_hash": content_hash,                    # Hash AFTER compression
                         "source": "direct_upload",
                         "last_modified": time.time()
-                    })
+                    }
+                    files_collection.insert_one(file_doc)
+                    record_source_change(added_files=[file_doc])
                     
                     success = True
                     
@@ -936,66 +1139,346 @@ def handle_file_upload(uploaded_file):
             st.error(traceback.format_exc())
     return False
 
+# Function to configure the node parser used for indexing
+def configure_node_parser():
+    # Create a sentence splitter for more natural chunks
+    node_parser = SentenceSplitter(
+        chunk_size=512,
+        chunk_overlap=50,
+        paragraph_separator="\n\n",
+        secondary_chunking_regex=r"(?<=\. )"
+    )
+    
+    # Set the node parser in settings
+    Settings.node_parser = node_parser
+    Settings.chunk_size = 512
+    Settings.chunk_overlap = 50
+
+# Function to configure the embedding model used for indexing and retrieval
+def configure_embed_model():
+    """Use the local embedding backend when EMBEDDING_BACKEND=local, otherwise OpenAI embeddings."""
+    embed_model = local_embeddings.get_embed_model()
+    if embed_model is not None:
+        Settings.embed_model = embed_model
+
+# Function to get a readable label for a source key
+def get_source_label(source_key):
+    source_type, _, name = source_key.partition(":")
+    return f"URL {name}" if source_type == "url" else name
+
+# Metadata keys SimpleDirectoryReader hides from the embedding model and the LLM
+PDF_EXCLUDED_METADATA_KEYS = [
+    "file_name",
+    "file_type",
+    "file_size",
+    "creation_date",
+    "last_modified_date",
+    "last_accessed_date",
+    # Fields of standardized filenames, kept for filtering only
+    *metadata_filters.FILTER_FIELDS
+]
+
+# Function to get the file-level metadata of a PDF stored in GridFS
+def get_pdf_file_metadata(file_doc, file_size, upload_date):
+    """
+    Build the file metadata SimpleDirectoryReader would attach to a PDF on disk,
+    from the files collection entry and the size and upload date of its GridFS file.
+    """
+    last_modified = file_doc.get("last_modified")
+    return {
+        "file_name": file_doc["filename"],
+        "file_path": file_doc["filename"],
+        "file_type": "application/pdf",
+        "file_size": file_size,
+        "creation_date": upload_date.strftime("%Y-%m-%d") if upload_date else None,
+        "last_modified_date": datetime.fromtimestamp(last_modified).strftime("%Y-%m-%d") if last_modified else None,
+        # Year, first author, title and category of standardized filenames, for filtered retrieval
+        **metadata_filters.parse_standardized_filename(file_doc["filename"])
+    }
+
+# Function to look up already parsed PDF text
+def get_cached_pdf_pages(content_hashes):
+    """
+    Fetch the cached pages for the given content hashes, as parsed by the current
+    parser version. Returns a dict of content_hash -> list of (page_label, text).
+    """
+    content_hashes = [content_hash for content_hash in content_hashes if content_hash]
+    if not content_hashes:
+        return {}
+    
+    try:
+        cached = st.session_state.parsed_text_collection.find(
+            {"content_hash": {"$in": content_hashes}, "parser_version": pdf_parsing.PDF_PARSER_VERSION},
+            {"content_hash": 1, "pages": 1, "_id": 0}
+        )
+        return {doc["content_hash"]: [tuple(page) for page in doc["pages"]] for doc in cached}
+    except Exception as e:
+        st.warning(f"Could not read the parsed-text cache: {str(e)}")
+        return {}
+
+# Function to store parsed PDF text
+def cache_pdf_pages(content_hash, pages):
+    """Store the parsed pages of a PDF, replacing text from older parser versions."""
+    if not content_hash:
+        return
+    
+    try:
+        st.session_state.parsed_text_collection.delete_many({
+            "content_hash": content_hash,
+            "parser_version": {"$ne": pdf_parsing.PDF_PARSER_VERSION}
+        })
+        st.session_state.parsed_text_collection.replace_one(
+            {"content_hash": content_hash, "parser_version": pdf_parsing.PDF_PARSER_VERSION},
+            {
+                "content_hash": content_hash,
+                "parser_version": pdf_parsing.PDF_PARSER_VERSION,
+                "pages": [list(page) for page in pages],
+                "created_at": datetime.now()
+            },
+            upsert=True
+        )
+    except Exception as e:
+        # Text too large for a single document, connection issues, ... - just don't cache
+        st.warning(f"Could not cache parsed text for {content_hash}: {str(e)}")
+
+# Function to evict parsed PDF text of deleted files
+def evict_parsed_text_cache(content_hashes=None):
+    """Remove cached text for the given content hashes, or all cached text if None."""
+    try:
+        if content_hashes is None:
+            st.session_state.parsed_text_collection.delete_many({})
+        else:
+            content_hashes = [content_hash for content_hash in content_hashes if content_hash]
+            if content_hashes:
+                st.session_state.parsed_text_collection.delete_many({"content_hash": {"$in": content_hashes}})
+    except Exception as e:
+        st.warning(f"Could not evict parsed-text cache entries: {str(e)}")
+
+# Function to record cache hits and misses
+def record_cache_stats(cache_name, hits, misses, extra=None):
+    """
+    Add the hits and misses of one run to the cache's totals and remember them as
+    the last run, along with any extra fields describing that run.
+    """
+    if not hits and not misses:
+        return
+    
+    try:
+        st.session_state.cache_stats_collection.update_one(
+            {"_id": cache_name},
+            {
+                "$inc": {"hits": hits, "misses": misses},
+                "$set": {"last_hits": hits, "last_misses": misses, "updated_at": datetime.now(), **(extra or {})}
+            },
+            upsert=True
+        )
+    except Exception as e:
+        st.warning(f"Could not record {cache_name} cache stats: {str(e)}")
+
+# Function to read cache hit and miss counters
+def get_cache_stats(cache_name):
+    try:
+        stats = st.session_state.cache_stats_collection.find_one({"_id": cache_name})
+    except Exception:
+        stats = None
+    return stats or {"hits": 0, "misses": 0, "last_hits": 0, "last_misses": 0}
+
+# Function to turn parsed PDF pages into documents
+def build_pdf_documents(source_key, file_metadata, pages):
+    """
+    Create one Document per PDF page with the same page-level metadata
+    SimpleDirectoryReader produces. Document ids are derived from the source key
+    so the nodes of a source can later be removed from the index by ref_doc_id.
+    """
+    documents = []
+    for page_num, (page_label, text) in enumerate(pages):
+        documents.append(Document(
+            text=text,
+            metadata={"page_label": page_label, **file_metadata},
+            id_=f"{source_key}#{page_num}",
+            excluded_embed_metadata_keys=list(PDF_EXCLUDED_METADATA_KEYS),
+            excluded_llm_metadata_keys=list(PDF_EXCLUDED_METADATA_KEYS)
+        ))
+    return documents
+
+# Function to report the sources that could not be loaded
+def report_source_errors(source_errors):
+    """Show one collapsible report of the sources skipped during indexing."""
+    if not source_errors:
+        return
+    
+    # The indexing worker runs without a Streamlit page, so it logs them and keeps them on the job
+    source_errors_callback = st.session_state.get("source_errors_callback")
+    if source_errors_callback:
+        source_errors_callback(source_errors)
+        return
+    
+    st.warning(f"{len(source_errors)} source(s) could not be loaded and were skipped.")
+    with st.expander("Skipped sources"):
+        for source_key, error in source_errors:
+            st.write(f"- {get_source_label(source_key)}: {error}")
+
+# Function to turn the text of a URL into documents
+def build_url_documents(source_key, text):
+    if not text:
+        return []
+    return [Document(text=text, metadata={"source": source_key.partition(":")[2], "type": "url"}, id_=source_key)]
+
+# Function to load the documents of a single source
+def load_documents_for_source(source_key):
+    """Load the documents for one source key of the sources manifest."""
+    source_type, _, name = source_key.partition(":")
+    
+    if source_type == "url":
+        return build_url_documents(source_key, extract_text_from_url(name))
+    
+    file_doc = st.session_state.files_collection.find_one({"filename": name})
+    if not file_doc or "gridfs_id" not in file_doc:
+        return []
+    
+    grid_out = st.session_state.fs.get(file_doc["gridfs_id"])
+    file_metadata = get_pdf_file_metadata(file_doc, grid_out.length, grid_out.upload_date)
+    
+    content_hash = file_doc.get("content_hash")
+    pages = get_cached_pdf_pages([content_hash]).get(content_hash)
+    if pages is not None:
+        record_cache_stats("parsed_text", 1, 0)
+    else:
+        # Parse straight from the GridFS stream, without a temporary file
+        pages = pdf_parsing.extract_pdf_pages(grid_out)
+        cache_pdf_pages(content_hash, pages)
+        record_cache_stats("parsed_text", 0, 1)
+    
+    return build_pdf_documents(source_key, file_metadata, pages)
+
+# Function to load the documents of many sources
+def load_documents_for_sources(source_keys):
+    """
+    Load the documents for several source keys. PDFs are fanned out to a pool of
+    parser processes and come back in completion order; URLs follow afterwards.
+    
+    Yields:
+        (source_key, documents, error) tuples
+    """
+    pdf_keys = [source_key for source_key in source_keys if source_key.startswith("pdf:")]
+    url_keys = [source_key for source_key in source_keys if source_key.startswith("url:")]
+    read_errors = []
+    
+    # One metadata query for all files and one for their GridFS entries
+    filenames = [source_key.partition(":")[2] for source_key in pdf_keys]
+    file_docs = {
+        file_doc["filename"]: file_doc
+        for file_doc in st.session_state.files_collection.find(
+            {"filename": {"$in": filenames}, "gridfs_id": {"$exists": True}},
+            {"filename": 1, "gridfs_id": 1, "last_modified": 1, "content_hash": 1}
+        )
+    }
+    gridfs_files = {
+        grid_file["_id"]: grid_file
+        for grid_file in st.session_state.files_collection.database["fs.files"].find(
+            {"_id": {"$in": [file_doc["gridfs_id"] for file_doc in file_docs.values()]}},
+            {"length": 1, "uploadDate": 1}
+        )
+    }
+    
+    file_metadata = {}
+    content_hashes = {}
+    for source_key, filename in zip(pdf_keys, filenames):
+        if filename in file_docs:
+            file_doc = file_docs[filename]
+            grid_file = gridfs_files.get(file_doc["gridfs_id"], {})
+            file_metadata[source_key] = get_pdf_file_metadata(file_doc, grid_file.get("length"), grid_file.get("uploadDate"))
+            content_hashes[source_key] = file_doc.get("content_hash")
+    
+    # Unchanged files skip PDF parsing entirely
+    cached_pages = get_cached_pdf_pages(list(content_hashes.values()))
+    to_parse = []
+    for source_key in file_metadata:
+        pages = cached_pages.get(content_hashes[source_key])
+        if pages is not None:
+            yield source_key, build_pdf_documents(source_key, file_metadata[source_key], pages), None
+        else:
+            to_parse.append(source_key)
+    
+    record_cache_stats("parsed_text", len(file_metadata) - len(to_parse), len(to_parse))
+    
+    def read_pdf_blobs():
+        # Blobs are read only when a worker is free
+        for source_key in to_parse:
+            try:
+                gridfs_id = file_docs[source_key.partition(":")[2]]["gridfs_id"]
+                yield source_key, st.session_state.fs.get(gridfs_id).read()
+            except Exception as e:
+                read_errors.append((source_key, str(e)))
+    
+    for source_key, pages, error in pdf_parsing.parse_pdfs_in_parallel(read_pdf_blobs()):
+        if error:
+            yield source_key, [], error
+        else:
+            cache_pdf_pages(content_hashes[source_key], pages)
+            yield source_key, build_pdf_documents(source_key, file_metadata[source_key], pages), None
+    
+    for source_key, error in read_errors:
+        yield source_key, [], error
+    
+    # Pages are downloaded concurrently and unchanged ones served from the URL content store
+    url_hits = url_misses = 0
+    for url, text, how, error in url_cache.fetch_urls_concurrently(
+        [source_key.partition(":")[2] for source_key in url_keys],
+        st.session_state.url_content_collection
+    ):
+        source_key = f"url:{url}"
+        if error:
+            yield source_key, [], error
+            continue
+        if how == url_cache.FETCHED:
+            url_misses += 1
+        else:
+            url_hits += 1
+        yield source_key, build_url_documents(source_key, text), None
+    
+    record_cache_stats("url_content", url_hits, url_misses)
+
 # Also modify the load_and_index_documents function to remove local file dependency
 def load_and_index_documents():
     try:
-        # Create a sentence splitter for more natural chunks
-        node_parser = SentenceSplitter(
-            chunk_size=512,
-            chunk_overlap=50,
-            paragraph_separator="\n\n",
-            secondary_chunking_regex=r"(?<=\. )"
-        )
-        
-        # Set the node parser in settings
-        Settings.node_parser = node_parser
-        Settings.chunk_size = 512
-        Settings.chunk_overlap = 50
+        configure_node_parser()
             
         st.session_state.indexing_status = "in_progress"
         
         documents = []
-        
-        # Directly load from MongoDB
-        for filename in st.session_state.uploaded_files:
-            try:
-                file_doc = st.session_state.files_collection.find_one({"filename": filename})
-                if file_doc and "gridfs_id" in file_doc:
-                    grid_out = st.session_state.fs.get(file_doc["gridfs_id"])
-                    
-                    # Create a temporary file for processing
-                    with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as temp_file:
-                        temp_file.write(grid_out.read())
-                        temp_file_path = temp_file.name
-                    
-                    try:
-                        # Process this file
-                        reader = SimpleDirectoryReader(input_files=[temp_file_path])
-                        pdf_documents = reader.load_data()
-                        documents.extend(pdf_documents)
-                    finally:
-                        # Clean up the temporary file
-                        if os.path.exists(temp_file_path):
-                            os.unlink(temp_file_path)
-            except Exception as e:
-                st.warning(f"Error processing {filename}: {str(e)}")
-        
-        # Load URL content
-        for url in st.session_state.urls:
-            try:
-                text = extract_text_from_url(url)
-                if text:
-                    doc = Document(text=text, metadata={"source": url, "type": "url"})
-                    documents.append(doc)
-            except Exception as e:
-                st.warning(f"Error processing URL {url}: {str(e)}")
+        manifest = {}
+        current_sources = get_sources_manifest()
+        
+        # Directly load PDFs from MongoDB and URL content from the web
+        source_errors = []
+        report_indexing_progress(phase="parsing", documents_parsed=0, documents_total=len(current_sources))
+        for sources_done, (source_key, source_documents, error) in enumerate(
+            load_documents_for_sources(list(current_sources)), start=1
+        ):
+            report_indexing_progress(documents_parsed=sources_done)
+            if error:
+                source_errors.append((source_key, error))
+                continue
+            
+            if source_documents:
+                documents.extend(source_documents)
+                manifest[source_key] = {
+                    "fingerprint": current_sources[source_key],
+                    "doc_ids": [document.id_ for document in source_documents]
+                }
+        report_source_errors(source_errors)
         
         if not documents:
+            st.session_state.index_manifest = None
             st.session_state.indexing_status = "idle"
             return None
             
-        # Create index from documents
-        index = VectorStoreIndex.from_documents(documents)
+        # Create index from documents, embedding only chunks that are not cached
+        nodes = Settings.node_parser.get_nodes_from_documents(documents)
+        embed_nodes(nodes)
+        index = index_store.build_vector_index(nodes)
+        st.session_state.index_manifest = manifest
         
         st.session_state.indexing_status = "complete"
         return index
@@ -1006,14 +1489,133 @@ def load_and_index_documents():
         st.error(traceback.format_exc())
         return None
 
+# Function to bring an existing index in line with the current sources
+def sync_index_with_sources(index):
+    """
+    Incrementally update the index: diff the current sources manifest against the
+    one the index was built from, delete the nodes of removed or changed sources
+    and insert nodes only for added or changed ones.
+    """
+    try:
+        configure_node_parser()
+        
+        st.session_state.indexing_status = "in_progress"
+        
+        manifest = st.session_state.index_manifest
+        current_sources = get_sources_manifest()
+        
+        # Removed sources and sources whose content changed
+        stale_sources = [
+            source_key for source_key, entry in manifest.items()
+            if current_sources.get(source_key) != entry["fingerprint"]
+        ]
+        for source_key in stale_sources:
+            remove_source_from_index(index, source_key)
+            
+            # A failed removal resets the manifest; only a full rebuild is safe then
+            if st.session_state.index_manifest is None:
+                return load_and_index_documents()
+        
+        # New sources and the new versions of changed ones
+        new_sources = [source_key for source_key in current_sources if source_key not in manifest]
+        new_entries = {}
+        new_documents = []
+        source_errors = []
+        report_indexing_progress(phase="parsing", documents_parsed=0, documents_total=len(new_sources))
+        for sources_done, (source_key, source_documents, error) in enumerate(
+            load_documents_for_sources(new_sources), start=1
+        ):
+            report_indexing_progress(documents_parsed=sources_done)
+            if error:
+                source_errors.append((source_key, error))
+                continue
+            
+            if source_documents:
+                new_documents.extend(source_documents)
+                new_entries[source_key] = {
+                    "fingerprint": current_sources[source_key],
+                    "doc_ids": [document.id_ for document in source_documents]
+                }
+        report_source_errors(source_errors)
+        
+        # Document ids are derived from the source key, so nodes left by a sync that was
+        # interrupted after inserting but before updating the manifest are deleted first
+        leftover_doc_ids = [
+            document.id_ for document in new_documents
+            if index.docstore.get_ref_doc_info(document.id_) is not None
+        ]
+        if leftover_doc_ids:
+            delete_documents_from_index(index, leftover_doc_ids)
+        
+        # Insert all new documents at once so their chunks are embedded together
+        if new_documents and update_index_with_document(index, new_documents) is not None:
+            manifest.update(new_entries)
+        
+        if not manifest:
+            st.session_state.index_manifest = None
+            st.session_state.indexing_status = "idle"
+            return None
+        
+        st.session_state.indexing_status = "complete"
+        return index
+    except Exception as e:
+        st.session_state.indexing_status = "idle"
+        st.error(f"Error updating index: {str(e)}")
+        import traceback
+        st.error(traceback.format_exc())
+        # The manifest is only updated per finished source, so the index is still usable
+        return index
+
 # Function to create optimized query engine
-def create_optimized_query_engine(index):
-    # Increase top_k for better coverage
-    retriever = VectorIndexRetriever(index=index, similarity_top_k=6)
+def create_optimized_query_engine(index, filters=None):
+    """
+    Query engine over the index. filters (from metadata_filters.parse_filters)
+    limit retrieval to chunks of matching PDFs before anything is scored.
+    """
+    node_ids = None
+    if filters:
+        node_ids = metadata_filters.filter_node_ids(index, filters)
+        if not node_ids:
+            st.warning("No PDFs match the source filter; answers use all sources.")
+            node_ids = None
     
-    # Add a relevance filter to improve results
-    node_postprocessors = [SimilarityPostprocessor(similarity_cutoff=0.7)]
+    if lexical_index.RETRIEVAL_MODE == "hybrid":
+        # Fuse vector and BM25 results; the relevance filter only applies to the vector side,
+        # since exact terms like "K1" or "[18F]FDG" often have low embedding similarity
+        def make_retriever(top_k, similarity_cutoff):
+            return lexical_index.HybridRetriever(
+                index,
+                vector_search.make_retriever(index, similarity_top_k=lexical_index.HYBRID_CANDIDATES, node_ids=node_ids),
+                similarity_top_k=top_k,
+                similarity_cutoff=similarity_cutoff,
+                node_ids=node_ids
+            )
+        retriever = make_retriever(6, 0.7)
+        retrieval_cutoff = None
+    else:
+        # Increase top_k for better coverage
+        def make_retriever(top_k, similarity_cutoff):
+            return vector_search.make_retriever(index, similarity_top_k=top_k, node_ids=node_ids)
+        retriever = make_retriever(6, None)
+        # Add a relevance filter to improve results
+        retrieval_cutoff = 0.7
+    
+    # With reranking, retrieve a wider pool and let the cross-encoder pick the best chunks
+    # instead of a hard similarity cutoff. Until the model has loaded, and for queries it
+    # can't score in time, the pipeline without reranking answers.
+    if reranker.RERANKING == "on" and reranker.is_ready():
+        return RetrieverQueryEngine(
+            retriever=make_retriever(reranker.RERANK_CANDIDATES, None),
+            node_postprocessors=[reranker.CrossEncoderRerank(
+                index_version=st.session_state.get("index_hash"),
+                fallback_retriever=retriever,
+                fallback_cutoff=retrieval_cutoff
+            )]
+        )
     
+    node_postprocessors = []
+    if retrieval_cutoff is not None:
+        node_postprocessors.append(SimilarityPostprocessor(similarity_cutoff=retrieval_cutoff))
     return RetrieverQueryEngine(
         retriever=retriever,
         node_postprocessors=node_postprocessors
@@ -1053,14 +1655,21 @@ def confirm_delete():
             
             # Then remove from metadata collection
             st.session_state.files_collection.delete_one({"filename": filename})
+            if file_doc:
+                record_source_change(removed_files=[file_doc])
+            
+            # Drop its parsed text unless another file has the same content
+            if file_doc and file_doc.get("content_hash"):
+                if not st.session_state.files_collection.find_one({"content_hash": file_doc["content_hash"]}):
+                    evict_parsed_text_cache([file_doc["content_hash"]])
             
             # Then remove from temp directory
             temp_file_path = os.path.join(st.session_state.data_dir, filename)
             if os.path.exists(temp_file_path):
                 os.remove(temp_file_path)
             
-            # Force complete reindex
-            st.session_state.index_hash = ""
+            # Remove only this file's nodes from the index
+            remove_source_from_index(make_index_writable(st.session_state.index), f"pdf:{filename}")
             
             # Finally remove from session state list
             if filename in st.session_state.uploaded_files:
@@ -1095,7 +1704,12 @@ def confirm_delete_url():
                 st.session_state.urls.remove(url)
                 # Save updated URLs to MongoDB
                 update_save_urls(st.session_state.urls)
-                st.session_state.index_hash = ""
+                # Remove only this URL's nodes from the index
+                remove_source_from_index(make_index_writable(st.session_state.index), f"url:{url}")
+                try:
+                    url_cache.evict_urls(st.session_state.url_content_collection, [url])
+                except Exception as e:
+                    st.warning(f"Could not evict the stored text of {url}: {str(e)}")
                 st.session_state.url_delete_success_message = f"Removed URL: {url}"
             else:
                 st.session_state.url_delete_error_message = f"URL not found: {url}"
@@ -1116,6 +1730,18 @@ def cancel_delete():
     # Force direct rerun since this is triggered by a button click
     st.rerun()
 
+def get_query_bundle(query, retrieval_query=None):
+    """
+    Query with its embedding taken from the shared query embedding cache when possible.
+    With retrieval_query, chunks are retrieved by that text while the LLM still gets query.
+    """
+    return query_embedding_cache.make_query_bundle(
+        query,
+        Settings.embed_model,
+        st.session_state.get("query_embedding_collection"),
+        retrieval_query=retrieval_query
+    )
+
 def generate_suggested_questions(query_engine, force_refresh=False):
     try:
         # Add more emphasis on diversity in the prompt
@@ -1143,7 +1769,7 @@ def generate_suggested_questions(query_engine, force_refresh=False):
         """
 
         # Get more questions than we need
-        response = query_engine.query(system_prompt)
+        response = query_engine.query(get_query_bundle(system_prompt))
         
         # Parse the response to extract the questions
         suggested_questions = []
@@ -1376,8 +2002,9 @@ def process_new_message(user_message, query_engine):
             Respond to the user's message with a thoughtful, concise, and helpful reply.
             """
 
-            # Query the engine
-            response = query_engine.query(full_query)
+            # Query the engine; retrieval uses the question alone, so its embedding stays
+            # cacheable across turns, and only the LLM sees the conversation history
+            response = query_engine.query(get_query_bundle(full_query, retrieval_query=user_message))
             assistant_response = response.response if response.response else "I couldn't find a relevant answer to your question."
 
         except Exception as e:
@@ -1620,15 +2247,18 @@ def get_binary_download_link(file_content, file_name, display_text):
 def delete_all_pdfs():
     try:
         # Remove all files from GridFS
-        for file_doc in st.session_state.files_collection.find({}, {"gridfs_id": 1}):
+        file_docs = list(st.session_state.files_collection.find({}, {"gridfs_id": 1, "filename": 1, "last_modified": 1}))
+        for file_doc in file_docs:
             try:
                 if "gridfs_id" in file_doc:
                     st.session_state.fs.delete(file_doc["gridfs_id"])
             except Exception as e:
                 st.warning(f"Error deleting file from GridFS: {str(e)}")
         
-        # Clear the files collection
+        # Clear the files collection and the text parsed from those files
         st.session_state.files_collection.delete_many({})
+        record_source_change(removed_files=file_docs)
+        evict_parsed_text_cache()
         
         # Remove files from temp directory
         for filename in os.listdir(st.session_state.data_dir):
@@ -1641,8 +2271,15 @@ def delete_all_pdfs():
         # Clear the uploaded_files list
         st.session_state.uploaded_files = []
         
-        # Force complete reindex
-        st.session_state.index_hash = ""
+        # Remove the nodes of every PDF from the index, keeping the URLs
+        pdf_sources = [
+            source_key for source_key in st.session_state.get("index_manifest") or {}
+            if source_key.startswith("pdf:")
+        ]
+        if pdf_sources:
+            index = make_index_writable(st.session_state.index)
+            for source_key in pdf_sources:
+                remove_source_from_index(index, source_key)
         
         # Set success message
         st.session_state.delete_success_message = "All PDFs have been deleted"
@@ -1663,21 +2300,6 @@ def save_index_to_mongodb(index, hash_value):
             st.warning("Skipping MongoDB save due to previous errors. Index will be used locally only.")
             return True
             
-        # Check if index is too large - estimate size before attempting to save
-        try:
-            # Serialize to a temp buffer to estimate size
-            temp_buffer = BytesIO()
-            pickle.dump(index, temp_buffer)
-            estimated_size = len(temp_buffer.getvalue())
-            
-            # If over 15MB (MongoDB document limit is 16MB), don't attempt to save
-            if estimated_size > 15 * 1024 * 1024:
-                st.warning(f"Index is too large ({estimated_size / (1024*1024):.2f} MB) to save to MongoDB. Using locally only.")
-                st.session_state.skip_mongodb_save = True
-                return True
-        except Exception as size_error:
-            st.warning(f"Could not estimate index size: {str(size_error)}. Will attempt save anyway.")
-        
         # Use increased timeouts for large uploads
         mongo_client = pymongo.MongoClient(
             os.getenv("MONGO_URI"),
@@ -1693,44 +2315,109 @@ def save_index_to_mongodb(index, hash_value):
         fs = gridfs.GridFS(db)
         index_collection = db["index"]
         
-        # Serialize the index to bytes with a progress indicator
-        with st.spinner("Serializing index for database storage..."):
-            index_bytes = BytesIO()
-            pickle.dump(index, index_bytes)
-            index_bytes.seek(0)
-            data = index_bytes.getvalue()
-        
-        # Check if existing index exists
-        existing_index = index_collection.find_one({})
-        if existing_index and "gridfs_id" in existing_index:
-            try:
-                # Delete old index
-                fs.delete(existing_index["gridfs_id"])
-            except Exception as e:
-                st.warning(f"Could not delete old index: {str(e)}. Continuing with new save...")
+        index_fields = {
+            "hash": hash_value,
+            "timestamp": time.time(),
+            "doc_count": len(st.session_state.uploaded_files),
+            "url_count": len(st.session_state.urls),
+            "embed_model": embedding_cache.get_embed_model_key(Settings.embed_model),
+            # Stored as a list because source keys contain dots
+            "manifest": [
+                {"source": source_key, **entry}
+                for source_key, entry in (st.session_state.get("index_manifest") or {}).items()
+            ]
+        }
+        node_ids = set(index.index_struct.nodes_dict.values())
+        # Build the search structures now, if needed, so they are saved with the index
+        search_structures = {
+            "ann": (vector_search.get_ann_index(index), ann_index.save_centroids),
+            "lexical": (
+                lexical_index.get_lexical_index(index) if lexical_index.RETRIEVAL_MODE == "hybrid" else None,
+                lexical_index.save_postings
+            )
+        }
         
-        # Use chunked upload for large files to prevent timeouts
         with st.spinner("Uploading index to MongoDB (this may take a while)..."):
-            chunk_size = 1048576  # 1MB
-            
-            # Store new index with larger chunk size
-            index_id = fs.put(
-                data,
-                filename="vector_index",
-                content_type="application/octet-stream",
-                chunkSize=chunk_size
+            existing_index = index_store.get_current_snapshot(
+                index_collection,
+                {"segments": 1, "generation": 1, **{field: 1 for field in index_store.SNAPSHOT_ATTACHMENTS}}
             )
+            saved_structures = {field: (existing_index or {}).get(field) for field in index_store.SNAPSHOT_ATTACHMENTS}
+            persisted = st.session_state.get("persisted_segments")
+            saved = False
             
-            # Update or insert metadata document
-            index_collection.delete_many({})
-            index_collection.insert_one({
-                "gridfs_id": index_id,
-                "hash": hash_value,
-                "timestamp": time.time(),
-                "doc_count": len(st.session_state.uploaded_files),
-                "url_count": len(st.session_state.urls),
-                "size": len(data)
-            })
+            # Append only what changed since the version this session loaded or saved last
+            if (
+                existing_index and "segments" in existing_index and persisted
+                and persisted.get("snapshot_id") == existing_index["_id"]
+                and persisted["generation"] == existing_index.get("generation")
+            ):
+                segment = index_store.write_segment(
+                    fs,
+                    index,
+                    node_ids=node_ids - persisted["node_ids"],
+                    tombstones=persisted["node_ids"] - node_ids
+                )
+                result = index_collection.update_one(
+                    {"_id": existing_index["_id"], "generation": persisted["generation"]},
+                    {
+                        "$set": index_fields,
+                        "$push": {"segments": segment},
+                        "$inc": {"generation": 1, "size": segment["size"], "compressed_size": segment["compressed_size"]}
+                    }
+                )
+                if not result.matched_count:
+                    # Another session saved in between; write everything below instead
+                    index_store.delete_index_parts(fs, segment)
+                elif (index_store.get_current_snapshot(index_collection, {"_id": 1}) or {}).get("_id") == existing_index["_id"]:
+                    snapshot_id = existing_index["_id"]
+                    generation = persisted["generation"] + 1
+                    saved = True
+                # else another session published a new snapshot meanwhile; ours is written below
+                existing_index = index_store.get_current_snapshot(index_collection, {"generation": 1})
+            
+            if not saved:
+                # Stream the embedding matrix and node store into GridFS in chunks (no size limit)
+                segment = index_store.write_segment(fs, index)
+                generation = (existing_index or {}).get("generation", 0) + 1
+                
+                # Written next to the published snapshot and swapped in with one pointer
+                # update; sessions loading meanwhile still get the previous one
+                snapshot_id = index_store.publish_snapshot(index_collection, {
+                    "segments": [segment],
+                    "generation": generation,
+                    "size": segment["size"],
+                    "compressed_size": segment["compressed_size"],
+                    **index_fields
+                })
+                saved_structures = {}
+            
+            # Search structures are only written when they changed or the snapshot is new
+            for field, (structure, save_structure) in search_structures.items():
+                saved_manifest = saved_structures.get(field)
+                if structure is None or (
+                    structure.manifest is not None and saved_manifest is not None
+                    and structure.manifest["parts"] == saved_manifest["parts"]
+                ):
+                    continue
+                try:
+                    save_structure(index_collection, fs, snapshot_id, structure)
+                except Exception as e:
+                    st.warning(f"Could not save the {field} search index; it will be rebuilt on load: {str(e)}")
+        
+        # Swap the saved version in for every session of this process
+        adopt_index_version(get_shared_index_holder().publish(
+            f"{snapshot_id}:{generation}",
+            index,
+            hash_value,
+            copy.deepcopy(st.session_state.get("index_manifest")),
+            generation,
+            node_ids,
+            snapshot_id
+        ))
+        
+        # Merge small segments and delete old snapshots in the background
+        start_index_maintenance()
         
         # Update session state to track current version in DB
         st.session_state.index_version_in_db = hash_value
@@ -1758,32 +2445,254 @@ def save_index_to_mongodb(index, hash_value):
             st.error(traceback.format_exc())
             return False
 
+# Function to bring the index up to date inside this session
+def rebuild_index(current_hash, placeholder):
+    """
+    Sync or rebuild the index for the current sources and save it as a new
+    snapshot. The last good index stays in use if the build fails; a run
+    interrupted by a rerun is picked up again by the next one.
+    """
+    # Only sync the changed sources when we know what the index was built from
+    incremental = (
+        st.session_state.index is not None
+        and st.session_state.get("index_manifest") is not None
+        and not st.session_state.get("force_full_reindex", False)
+    )
+    
+    with placeholder.container():
+        with st.spinner("Updating knowledge base index..." if incremental else "Reindexing knowledge base..."):
+            if incremental:
+                new_index = sync_index_with_sources(make_index_writable(st.session_state.index))
+            else:
+                new_index = load_and_index_documents()
+            st.session_state.force_full_reindex = False
+            st.session_state.index_hash = current_hash
+            st.session_state.sources_changed_here = False
+            
+            if new_index is None and current_hash != "no_sources" and st.session_state.index is not None:
+                st.warning("Updating the index failed; answers still come from the previous index.")
+                return
+            st.session_state.index = new_index
+            st.session_state.last_update_time = time.time()
+            
+            # Save the new index to MongoDB
+            if new_index is not None:
+                if save_index_to_mongodb(new_index, current_hash):
+                    st.success("Index saved to database")
+
+# Function to maintain the saved index in the background
+def start_index_maintenance():
+    """
+    In a background thread, merge the segments of the saved index if there are
+    too many and delete snapshots and segments past their grace period.
+    """
+    index_collection = st.session_state.index_collection
+    fs = st.session_state.fs
+    
+    def maintain():
+        try:
+            index_store.compact_segments(index_collection, fs)
+            index_store.collect_garbage(index_collection, fs)
+        except Exception as e:
+            print(f"Index maintenance failed: {e}")
+    
+    threading.Thread(target=maintain, daemon=True).start()
+
+# Process-wide holder of the loaded index, shared by all sessions
+@st.cache_resource
+def get_shared_index_holder():
+    return shared_index.SharedIndexHolder()
+
+# Function to make a shared index version the one this session uses
+def adopt_index_version(version):
+    """Use a shared index version in this session and keep it in memory while doing so."""
+    st.session_state.index = version.index
+    st.session_state.index_lease = get_shared_index_holder().lease(version)
+    st.session_state.persisted_segments = {
+        "snapshot_id": version.snapshot_id,
+        "generation": version.generation,
+        "node_ids": version.node_ids
+    }
+    # Each session updates its own manifest in place
+    st.session_state.index_manifest = copy.deepcopy(version.manifest)
+
+# Function to get an index this session may modify
+def make_index_writable(index):
+    """
+    Return a private copy of the index if other sessions share it, else the
+    index itself. Callers must use the returned index from then on.
+    """
+    if index is None or not get_shared_index_holder().is_shared(index):
+        return index
+    
+    writable_index = index_store.clone_index(index)
+    vector_search.copy_ann(index, writable_index)
+    lexical_index.copy_to(index, writable_index)
+    index = writable_index
+    st.session_state.index = index
+    st.session_state.index_lease = None
+    return index
+
+# Function to check whether a saved index snapshot can be loaded
+def get_unusable_snapshot_reason(index_doc):
+    """Why the snapshot has to be rebuilt instead of loaded, or None if it can be loaded."""
+    if "segments" not in index_doc:
+        # Older versions pickled the whole index; rebuild instead of unpickling it
+        return "uses an older storage format"
+    
+    # Vectors from another embedding model can't be searched with this one (saves
+    # from before the model was recorded were built with the OpenAI default)
+    saved_embed_model = index_doc.get("embed_model")
+    current_embed_model = embedding_cache.get_embed_model_key(Settings.embed_model)
+    if (saved_embed_model or local_embeddings.EMBEDDING_BACKEND != "openai") and saved_embed_model != current_embed_model:
+        return "was built with a different embedding model"
+    return None
+
+# Function to get the shared in-memory version of a saved index snapshot
+def get_snapshot_version(index_doc, fs, holder):
+    """
+    The shared version of a snapshot, read from GridFS only if this process
+    doesn't hold it yet. Uses no session state, so the index watcher can call it.
+    """
+    def read_index():
+        # Rebuild the index by merging its segments
+        index, node_ids = index_store.read_index_segments(fs, index_doc["segments"], Settings.embed_model)
+        # Reuse the saved ANN centroids instead of training them again
+        if index_doc.get("ann") and vector_search.VECTOR_SEARCH_BACKEND == "ann":
+            ann = ann_index.read_centroids(fs, index_doc["ann"])
+            if ann is not None:
+                vector_search.attach_ann(index, ann)
+        if index_doc.get("lexical") and lexical_index.RETRIEVAL_MODE == "hybrid":
+            lexical = lexical_index.read_postings(fs, index_doc["lexical"])
+            if lexical is not None:
+                lexical_index.attach(index, lexical)
+        # Restore the manifest used for incremental updates
+        manifest = None
+        if "manifest" in index_doc:
+            manifest = {
+                entry["source"]: {"fingerprint": entry["fingerprint"], "doc_ids": entry["doc_ids"]}
+                for entry in index_doc["manifest"]
+            }
+        return index, index_doc["hash"], manifest, index_doc.get("generation"), node_ids, index_doc["_id"]
+    
+    # Sessions share one copy per saved version; only the first one reads it from GridFS
+    return holder.get_or_load(f"{index_doc['_id']}:{index_doc.get('generation')}", read_index)
+
+# Process-wide watcher that loads index versions published by other sessions and replicas
+@st.cache_resource
+def get_index_watcher():
+    holder = get_shared_index_holder()
+    db = pymongo.MongoClient(os.getenv("MONGO_URI"))["rag_system"]
+    fs = gridfs.GridFS(db)
+    
+    def hot_load_published_index():
+        index_doc = index_store.get_current_snapshot(db["index"])
+        if index_doc and not get_unusable_snapshot_reason(index_doc):
+            get_snapshot_version(index_doc, fs, holder)
+    
+    return index_watcher.IndexWatcher(db, on_index_change=hot_load_published_index).start()
+
+# Function to switch to a newer index version held by this process
+def adopt_newer_shared_index():
+    """
+    Use the process's current shared index version if this session is on an
+    older one. A session with unsaved changes of its own keeps its copy.
+    """
+    current = get_shared_index_holder().current
+    lease = st.session_state.get("index_lease")
+    if current is None or (lease is not None and lease.version is current):
+        return False
+    if st.session_state.get("index") is not None and lease is None:
+        return False
+    
+    adopt_index_version(current)
+    st.session_state.index_hash = current.index_hash
+    st.session_state.index_version_in_db = current.index_hash
+    return True
+
 # Function to load index from MongoDB
 def load_index_from_mongodb():
     """Load the index from MongoDB if available"""
     try:
         # Check if there's an index stored
-        index_doc = st.session_state.index_collection.find_one({})
-        if not index_doc or "gridfs_id" not in index_doc:
+        index_doc = index_store.get_current_snapshot(st.session_state.index_collection)
+        if not index_doc:
+            return None, None
+        unusable_reason = get_unusable_snapshot_reason(index_doc)
+        if unusable_reason:
+            st.info(f"The saved index {unusable_reason} and will be rebuilt.")
             return None, None
         
-        # Retrieve from GridFS
-        grid_out = st.session_state.fs.get(index_doc["gridfs_id"])
-        index_bytes = grid_out.read()
-        
-        # Deserialize the index
         try:
-            index = pickle.loads(index_bytes)
+            version = get_snapshot_version(index_doc, st.session_state.fs, get_shared_index_holder())
+            adopt_index_version(version)
             st.session_state.index_loaded_from_db = True
-            return index, index_doc["hash"]
+            return version.index, version.index_hash
         except Exception as e:
-            st.warning(f"Error deserializing index: {str(e)}")
+            st.warning(f"Error reading the saved index: {str(e)}")
             return None, None
         
     except Exception as e:
         st.warning(f"Error loading index from MongoDB: {str(e)}")
         return None, None    
 
+# Function to swap in an index published by the indexing worker
+def refresh_published_index(expected_hash=None):
+    """
+    Load the saved index if the worker or another session published a newer one
+    than this session is using (only if it was built from expected_hash, if given).
+    """
+    try:
+        index_doc = index_store.get_current_snapshot(st.session_state.index_collection, {"hash": 1})
+    except Exception as e:
+        st.warning(f"Could not check for a newer index: {str(e)}")
+        return
+    
+    if not index_doc or index_doc.get("hash") == st.session_state.get("index_version_in_db"):
+        return
+    if expected_hash is not None and index_doc.get("hash") != expected_hash:
+        return
+    
+    loaded_index, loaded_hash = load_index_from_mongodb()
+    if loaded_index is not None:
+        st.session_state.index = loaded_index
+        st.session_state.index_hash = loaded_hash
+        st.session_state.index_version_in_db = loaded_hash
+
+# Function to show the progress of the indexing worker
+@st.fragment(run_every=5)
+def show_indexing_job_status():
+    """Poll the indexing job queue and reload the app once a newer index is published."""
+    try:
+        job = indexing_jobs.get_active_job(st.session_state.indexing_jobs_collection)
+    except Exception as e:
+        st.caption(f"Indexing status unavailable: {str(e)}")
+        return
+    if not job:
+        return
+    
+    progress = job.get("progress") or {}
+    if job["status"] == indexing_jobs.QUEUED:
+        st.info("Index rebuild queued, waiting for the indexing worker...")
+    elif job["status"] == indexing_jobs.RUNNING:
+        phase = progress.get("phase", "starting")
+        details = [f"Index rebuild {phase}"]
+        if progress.get("documents_total"):
+            details.append(f"{progress.get('documents_parsed', 0)}/{progress['documents_total']} documents parsed")
+        if progress.get("chunks_total"):
+            details.append(f"{progress.get('chunks_embedded', 0)}/{progress['chunks_total']} chunks embedded")
+        if progress.get("eta_seconds") is not None:
+            details.append(f"about {progress['eta_seconds']:.0f}s left")
+        st.info(", ".join(details))
+    elif job["status"] == indexing_jobs.FAILED:
+        st.warning(f"Last index rebuild failed: {job.get('error')}")
+    elif job.get("index_hash") and job["index_hash"] != st.session_state.get("index_version_in_db"):
+        # A newer index was published: rerun the whole app so it is loaded
+        st.rerun(scope="app")
+    
+    if job["status"] in (indexing_jobs.DONE, indexing_jobs.FAILED) and job.get("skipped_sources"):
+        report_source_errors([(skipped["source"], skipped["error"]) for skipped in job["skipped_sources"]])
+
 # Function to authenticate with Google Drive
 def authenticate_google_drive():
     """Authenticate with Google Drive API."""
@@ -2191,7 +3100,7 @@ def process_approval_with_feedback(upload, temp_db):
         )
         
         # Save metadata to main files collection WITH BOTH HASH VALUES
-        main_db.files.insert_one({
+        file_doc = {
             "filename": standardized_filename,
             "original_filename": upload['filename'],
             "gridfs_id": main_file_id,
@@ -2203,7 +3112,9 @@ def process_approval_with_feedback(upload, temp_db):
             "source": "collaborator_upload",
             "upload_id": upload['_id'],
             "last_modified": time.time()
-        })
+        }
+        main_db.files.insert_one(file_doc)
+        record_source_change(added_files=[file_doc])
         
         # Update the session state list of files
         if standardized_filename not in st.session_state.uploaded_files:
@@ -2403,7 +3314,7 @@ def import_pdfs_from_google_drive():
                 )
                 
                 # Save file metadata to MongoDB WITH BOTH HASH VALUES
-                st.session_state.files_collection.insert_one({
+                file_doc = {
                     "filename": processed_file['standardized_filename'],
                     "original_filename": processed_file['original_filename'],
                     "gridfs_id": gridfs_file_id,
@@ -2415,7 +3326,9 @@ def import_pdfs_from_google_drive():
                     "source": "google_drive",
                     "drive_file_id": drive_id,  # Add Drive ID for future duplicate checks
                     "last_modified": time.time()
-                })
+                }
+                st.session_state.files_collection.insert_one(file_doc)
+                record_source_change(added_files=[file_doc])
                 
                 # Add to session state uploaded files
                 if processed_file['standardized_filename'] not in st.session_state.uploaded_files:
@@ -2799,6 +3712,7 @@ def import_urls_from_spreadsheet():
                     "import_date": datetime.now(),
                     "row": row
                 })
+                record_source_change(added_urls=[url])
                 
                 results['added_urls'] += 1
                 results['urls'].append({
@@ -2814,6 +3728,7 @@ def import_urls_from_spreadsheet():
                 try:
                     # Fallback to basic save
                     st.session_state.urls_collection.insert_one({"url": url})
+                    record_source_change(added_urls=[url])
                     
                     results['added_urls'] += 1
                     results['urls'].append({
@@ -3054,7 +3969,7 @@ Field: Kinetic Modeling Research
                 )
                 
                 # Save metadata
-                st.session_state.files_collection.insert_one({
+                file_doc = {
                     "filename": filename,
                     "original_filename": filename,
                     "gridfs_id": file_id,
@@ -3069,7 +3984,9 @@ Field: Kinetic Modeling Research
                         "row_number": i
                     },
                     "last_modified": time.time()
-                })
+                }
+                st.session_state.files_collection.insert_one(file_doc)
+                record_source_change(added_files=[file_doc])
                 
                 # Update session state
                 if filename not in st.session_state.uploaded_files:
@@ -3215,6 +4132,12 @@ def main():
     # Initialize session state
     if not initialize_session_state():
         st.stop()
+    
+    configure_embed_model()
+    
+    # Hot-loads indexes published by other sessions and replicas into this process
+    if index_watcher.INDEX_WATCH_MODE != "off":
+        st.session_state.index_watcher = get_index_watcher()
 
     # Add a files_refreshed flag if it doesn't exist
     if "files_refreshed" not in st.session_state:
@@ -3506,6 +4429,31 @@ def main():
                             except Exception:
                                 st.write("Index is available for export.")
                             
+                            # Show how much work rebuilds could skip thanks to the caches
+                            for cache_name, cache_label in [
+                                ("parsed_text", "Parsed-text cache"),
+                                ("url_content", "URL content cache"),
+                                ("embeddings", "Embedding cache")
+                            ]:
+                                cache_stats = get_cache_stats(cache_name)
+                                total_lookups = cache_stats["hits"] + cache_stats["misses"]
+                                hit_rate = cache_stats["hits"] / total_lookups * 100 if total_lookups else 0
+                                last_lookups = cache_stats["last_hits"] + cache_stats["last_misses"]
+                                last_hit_rate = cache_stats["last_hits"] / last_lookups * 100 if last_lookups else 0
+                                st.write(
+                                    f"{cache_label}: {cache_stats['hits']} hits / "
+                                    f"{cache_stats['misses']} misses ({hit_rate:.0f}% hit rate). "
+                                    f"Last rebuild: {cache_stats['last_hits']} hits / {cache_stats['last_misses']} misses "
+                                    f"({last_hit_rate:.0f}% hit rate)."
+                                )
+                                if cache_stats.get("last_chunks_per_second"):
+                                    st.write(
+                                        f"Last rebuild embedded {cache_stats['last_misses']} chunks in "
+                                        f"{cache_stats['last_embed_seconds']:.1f}s "
+                                        f"({cache_stats['last_chunks_per_second']:.0f} chunks/s, "
+                                        f"{cache_stats['last_embed_retries']} rate-limited retries)."
+                                    )
+                            
                             # Add export button
                             if st.button("Export Embeddings", key="export_embeddings"):
                                 with st.spinner("Exporting embeddings..."):
@@ -3608,6 +4556,7 @@ def main():
             # Force reindex button (outside tabs)
             if st.sidebar.button("⟳ Reindex All", key="force_reindex", help="Force reindex all documents and URLs"):
                 st.session_state.index_hash = ""  # Force reindex
+                st.session_state.force_full_reindex = True  # Rebuild from scratch instead of syncing
                 st.session_state.should_rerun = True
         
         
@@ -3624,23 +4573,49 @@ def main():
         # Check if reindexing is needed
         need_reindex = False
 
+        worker_mode = indexing_jobs.INDEXING_MODE == "worker"
+        
+        # Versions saved by other sessions of this process or hot-loaded by the index watcher
+        adopt_newer_shared_index()
+        
+        # Pick up indexes published by the indexing worker
+        if worker_mode and st.session_state.index is not None:
+            refresh_published_index()
+
         # If index is None, try to load from MongoDB first
         if st.session_state.index is None:
             loaded_index, loaded_hash = load_index_from_mongodb()
-            if loaded_index is not None and loaded_hash == current_hash:
+            if worker_mode and loaded_index is not None:
+                # Serve the published index while the worker catches up with newer sources
+                st.session_state.index = loaded_index
+                st.session_state.index_hash = loaded_hash
+                st.session_state.index_version_in_db = loaded_hash
+                need_reindex = loaded_hash != current_hash
+            elif loaded_index is not None and loaded_hash == current_hash:
                 st.session_state.index = loaded_index
                 st.session_state.index_hash = loaded_hash
                 st.success("Index loaded from database successfully")
             else:
+                # A stale index keeps answering while it is brought up to date (incrementally
+                # if it has a manifest)
                 need_reindex = True
         # Otherwise check if sources have changed
         elif current_hash != st.session_state.index_hash:
-            need_reindex = True
+            # Another session may already have saved an index of the current sources
+            if not worker_mode:
+                refresh_published_index(expected_hash=current_hash)
+            need_reindex = current_hash != st.session_state.index_hash
+        
+        # Sources just changed by another session or replica, which builds and publishes the
+        # index for them: keep serving this one meanwhile instead of building the same index
+        if (
+            need_reindex and not worker_mode and st.session_state.index is not None
+            and not st.session_state.get("sources_changed_here")
+        ):
+            changed_at = ((st.session_state.get("catalog_cache") or {}).get("catalog") or {}).get("updated_at")
+            if changed_at and datetime.now() - changed_at < timedelta(seconds=index_watcher.INDEX_PUBLISH_WAIT):
+                need_reindex = False
 
-        # Only update the index hash if we're going to reindex
-        if need_reindex:
-            st.session_state.index_hash = current_hash
-        
         # Show indexing status with st.spinner
         indexing_placeholder = st.empty()
         if st.session_state.indexing_status == "in_progress":
@@ -3654,21 +4629,42 @@ def main():
         if st.session_state.is_admin:
             st.write(f"Knowledge base: {pdf_count} PDFs and {url_count} URLs")
         
-        # Load and index documents if needed
-        if need_reindex:
-            with indexing_placeholder.container():
-                with st.spinner("Reindexing knowledge base..."):
-                    st.session_state.index = load_and_index_documents()
-                    st.session_state.last_update_time = time.time()
-                    
-                    # Save the new index to MongoDB
-                    if st.session_state.index is not None:
-                        if save_index_to_mongodb(st.session_state.index, current_hash):
-                            st.success("Index saved to database")
-                        
+        # Leave the rebuild to the indexing worker; requests from all sessions coalesce into one job
+        if need_reindex and worker_mode:
+            try:
+                indexing_jobs.enqueue_rebuild(
+                    st.session_state.indexing_jobs_collection,
+                    full=st.session_state.get("force_full_reindex", False),
+                    requested_by="admin" if st.session_state.is_admin else "user"
+                )
+                st.session_state.force_full_reindex = False
+            except Exception as e:
+                st.warning(f"Could not queue the index rebuild: {str(e)}")
+            need_reindex = False
+        
+        if worker_mode and st.session_state.is_admin:
+            show_indexing_job_status()
+        
+        # Build first only when there is no index to answer from yet; otherwise the chat
+        # below keeps serving the last good version and the rebuild runs after it
+        rebuild_after_chat = need_reindex and st.session_state.index is not None
+        if need_reindex and not rebuild_after_chat:
+            rebuild_index(current_hash, indexing_placeholder)
+        
         # Create query engine if index exists
         if st.session_state.index is not None:
-            query_engine = create_optimized_query_engine(st.session_state.index)
+            filter_text = st.text_input(
+                "Filter sources",
+                key="retrieval_filter",
+                placeholder="e.g. category=Brain, year>=2020, author=Logan"
+            )
+            retrieval_filters = None
+            if filter_text.strip():
+                try:
+                    retrieval_filters = metadata_filters.parse_filters(filter_text)
+                except ValueError as e:
+                    st.warning(f"{str(e)}. Answers use all sources.")
+            query_engine = create_optimized_query_engine(st.session_state.index, retrieval_filters)
         else:
             query_engine = None
             if pdf_count > 0 or url_count > 0:
@@ -3679,12 +4675,49 @@ def main():
         # Chat interface
         display_chat_interface(query_engine)
         
+        if rebuild_after_chat:
+            rebuild_index(current_hash, indexing_placeholder)
+        
         # Add a footer with system information
         st.markdown("---")
         st.markdown(f"Last index update: {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(st.session_state.last_update_time))}")
         if st.session_state.is_admin:
             mongo_status = "Connected" if hasattr(st.session_state, "files_collection") else "Disconnected"
-            st.markdown(f"MongoDB Status: {mongo_status} | Index Status: {st.session_state.indexing_status}")    
+            st.markdown(f"MongoDB Status: {mongo_status} | Index Status: {st.session_state.indexing_status}")
+            shared_stats = get_shared_index_holder().stats()
+            current_sessions = dict(shared_stats["versions"]).get(shared_stats["current"], 0)
+            st.markdown(
+                f"Shared index: version {shared_stats['current'] or 'none'} used by {current_sessions} session(s) | "
+                f"{len(shared_stats['versions'])} version(s) in memory"
+            )
+            watcher = st.session_state.get("index_watcher")
+            if watcher:
+                watcher_stats = watcher.stats()
+                st.markdown(
+                    f"Index watcher: {watcher_stats['mode']} ({'healthy' if watcher_stats['healthy'] else 'reconnecting'}) | "
+                    f"{watcher_stats['index_events']} index and {watcher_stats['source_events']} source event(s)"
+                )
+            if reranker.RERANKING == "on":
+                rerank_cache = reranker.score_cache.stats()
+                last_ms = reranker.stats["last_ms"]
+                last_queue_ms = reranker.stats["last_queue_ms"]
+                st.markdown(
+                    f"Reranker ({'ready' if reranker.is_ready() else 'loading'}): {reranker.stats['reranked']} reranked, "
+                    f"{reranker.stats['over_budget']} over budget scoring, {reranker.stats['over_budget_queued']} waiting "
+                    f"for a thread, {reranker.stats['failed']} failed | last {f'{last_ms:.0f} ms' if last_ms is not None else '-'}"
+                    f" ({f'{last_queue_ms:.0f} ms' if last_queue_ms is not None else '-'} queued) | "
+                    f"score cache {rerank_cache['entries']} entries, {rerank_cache['hit_rate']:.0%} hits"
+                )
+                if reranker.stats["last_error"]:
+                    st.caption(f"Last reranker error: {reranker.stats['last_error']}")
+            query_cache = query_embedding_cache.memory_cache.stats()
+            st.markdown(
+                f"Query embeddings: {query_cache['entries']} cached, {query_cache['hits']} memory hit(s) "
+                f"({query_cache['hit_rate']:.0%}), {query_embedding_cache.stats['persistent_hits']} from MongoDB, "
+                f"{query_embedding_cache.stats['embedded']} embedded"
+            )
+            if query_embedding_cache.stats["last_error"]:
+                st.caption(query_embedding_cache.stats["last_error"])
 
 # Run the application
 if __name__ == "__main__":
@@ -0,0 +1,131 @@
+import random
+import threading
+import time
+
+import pytest
+
+import embedding_executor
+
+
+class RateLimited(Exception):
+    def __init__(self, retry_after=None):
+        super().__init__("rate limited")
+        self.status_code = 429
+        self.response = type("Response", (), {"headers": {"retry-after": retry_after} if retry_after else {}})()
+
+
+@pytest.fixture(autouse=True)
+def fast_backoff(monkeypatch):
+    monkeypatch.setattr(embedding_executor, "BACKOFF_BASE", 0.01)
+
+
+def fake_vector(text):
+    return [float(len(text))]
+
+
+def test_pack_batches_respects_size_and_token_limits():
+    texts = ["x" * 40] * 10  # 11 estimated tokens each
+    assert embedding_executor.pack_batches(texts, max_batch_size=4, max_batch_tokens=10**6) == [
+        [0, 1, 2, 3], [4, 5, 6, 7], [8, 9]
+    ]
+    assert [len(batch) for batch in embedding_executor.pack_batches(texts, max_batch_size=100, max_batch_tokens=25)] == [2] * 5
+
+
+def test_retries_rate_limited_batches_and_keeps_order():
+    texts = [f"text {i}" * (i % 5 + 1) for i in range(50)]
+    attempts = {}
+    lock = threading.Lock()
+
+    def embed_batch(batch_texts):
+        with lock:
+            attempts[batch_texts[0]] = attempts.get(batch_texts[0], 0) + 1
+            first_attempt = attempts[batch_texts[0]] == 1
+        if first_attempt:
+            raise RateLimited()
+        return [fake_vector(text) for text in batch_texts]
+
+    vectors, stats = embedding_executor.embed_texts_concurrently(texts, embed_batch, max_batch_size=8, max_in_flight=4)
+
+    assert vectors == [fake_vector(text) for text in texts]
+    assert stats["chunks"] == 50
+    assert stats["retries"] == 7
+    assert stats["requests"] == 14
+
+
+def test_backoff_grows_exponentially(monkeypatch):
+    monkeypatch.setattr(embedding_executor, "BACKOFF_BASE", 0.05)
+    calls = []
+
+    def embed_batch(batch_texts):
+        calls.append(time.monotonic())
+        if len(calls) <= 3:
+            raise RateLimited()
+        return [fake_vector(text) for text in batch_texts]
+
+    embedding_executor.embed_texts_concurrently(["a"], embed_batch)
+
+    # Base delay doubled per attempt, jittered by 0.5-1.5x
+    waits = [later - earlier for earlier, later in zip(calls, calls[1:])]
+    for attempt, waited in enumerate(waits):
+        assert 0.05 * 2 ** attempt * 0.5 <= waited < 0.05 * 2 ** attempt * 1.5 + 0.1
+
+
+def test_retry_after_header_is_honored():
+    calls = []
+
+    def embed_batch(batch_texts):
+        calls.append(time.monotonic())
+        if len(calls) == 1:
+            raise RateLimited(retry_after="0.2")
+        return [fake_vector(text) for text in batch_texts]
+
+    embedding_executor.embed_texts_concurrently(["a"], embed_batch)
+
+    assert calls[1] - calls[0] >= 0.2
+
+
+def test_gives_up_after_max_retries_and_on_other_errors():
+    def always_limited(batch_texts):
+        raise RateLimited()
+
+    with pytest.raises(RateLimited):
+        embedding_executor.embed_texts_concurrently(["a"], always_limited, max_retries=3)
+
+    def broken(batch_texts):
+        raise ValueError("bad input")
+
+    with pytest.raises(ValueError):
+        embedding_executor.embed_texts_concurrently(["a"], broken)
+
+
+def test_stub_server_end_to_end():
+    server, api_base = embedding_executor.run_stub_embedding_server(rate_limit_probability=0.3, latency=0.01)
+    try:
+        texts = [f"chunk {i} " * (i % 9 + 1) for i in range(200)]
+        embed_batch = embedding_executor.make_http_batch_function(api_base, "stub-model")
+        vectors, stats = embedding_executor.embed_texts_concurrently(texts, embed_batch, max_batch_size=16, max_in_flight=4)
+    finally:
+        server.shutdown()
+
+    assert vectors == [[float(len(text) % 7)] * 8 for text in texts]
+    batches = len(embedding_executor.pack_batches(texts, max_batch_size=16))
+    assert stats["requests"] == batches + stats["retries"]
+
+
+def test_openai_model_rate_limits_reach_the_executor():
+    from llama_index.embeddings.openai import OpenAIEmbedding
+
+    random.seed(1)
+    server, api_base = embedding_executor.run_stub_embedding_server(rate_limit_probability=0.3, latency=0.01)
+    try:
+        embed_model = OpenAIEmbedding(api_key="stub", api_base=api_base, embed_batch_size=16)
+        texts = [f"chunk {i}" for i in range(200)]
+        vectors, stats = embedding_executor.embed_texts_with_model(texts, embed_model)
+
+        # Without the client's own retries, each 429 is one executor retry
+        assert stats["retries"] > 0
+        assert stats["requests"] == len(embedding_executor.pack_batches(texts, max_batch_size=16)) + stats["retries"]
+        assert vectors == [[float(len(text) % 7)] * 8 for text in texts]
+        assert embed_model.max_retries == 10
+    finally:
+        server.shutdown()
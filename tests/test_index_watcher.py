@@ -0,0 +1,186 @@
+import os
+import time
+import uuid
+
+import mongomock
+import pytest
+from pymongo.errors import OperationFailure
+
+import index_store
+import index_watcher
+import source_catalog
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return condition()
+
+
+class Counter:
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+
+
+class StandaloneDb:
+    """mongomock database that rejects change streams like a standalone server."""
+
+    def __init__(self, db):
+        self.db = db
+
+    def __getitem__(self, name):
+        return self.db[name]
+
+    def watch(self, *args, **kwargs):
+        raise OperationFailure("The $changeStream stage is only supported on replica sets", code=40573)
+
+
+class FakeStream:
+    """Change stream yielding queued events, then nothing, like try_next() on a quiet stream."""
+
+    def __init__(self, events):
+        self.events = list(events)
+        self.alive = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.alive = False
+
+    def try_next(self):
+        if self.events:
+            return {"ns": {"coll": self.events.pop(0)}}
+        time.sleep(0.01)
+        return None
+
+
+@pytest.fixture
+def db():
+    return mongomock.MongoClient()["rag_system"]
+
+
+@pytest.fixture
+def watchers():
+    started = []
+    yield started
+    for watcher in started:
+        watcher.stop()
+
+
+def test_notify_counts_events_and_survives_failing_callbacks():
+    def broken():
+        raise RuntimeError("boom")
+
+    index_changes = Counter()
+    watcher = index_watcher.IndexWatcher(None, on_index_change=index_changes, on_sources_change=broken)
+
+    watcher._notify(index_changed=True, sources_changed=True)
+    watcher._notify(index_changed=False, sources_changed=True)
+    watcher._notify(index_changed=False, sources_changed=False)
+
+    assert index_changes.calls == 1
+    assert watcher.stats()["index_events"] == 1
+    assert watcher.sources_version == 2
+    assert watcher.last_event_at is not None
+
+
+def test_poll_reports_initial_state_then_only_changes(db, watchers):
+    db["source_catalog"].insert_one({"_id": source_catalog.CATALOG_ID, "version": 1, "digest": 0, "count": 0})
+    index_changes, source_changes = Counter(), Counter()
+    watcher = index_watcher.IndexWatcher(
+        db, on_index_change=index_changes, on_sources_change=source_changes, mode="poll", poll_interval=0.02
+    )
+    watchers.append(watcher.start())
+
+    assert wait_for(lambda: index_changes.calls == 1 and source_changes.calls == 1)
+    assert watcher.stats()["mode"] == index_watcher.POLLING
+    assert watcher.healthy
+
+    # Several unchanged polls notify nothing
+    time.sleep(0.1)
+    assert (index_changes.calls, source_changes.calls) == (1, 1)
+
+    index_store.publish_snapshot(db["index"], {"generation": 1})
+    assert wait_for(lambda: index_changes.calls == 2)
+    assert source_changes.calls == 1
+
+    source_catalog.record_change(db["source_catalog"], added={"pdf:a.pdf": "1"})
+    assert wait_for(lambda: source_changes.calls == 2)
+    assert index_changes.calls == 2
+
+
+def test_auto_mode_falls_back_to_polling_without_replica_set(db, watchers):
+    index_changes = Counter()
+    watcher = index_watcher.IndexWatcher(StandaloneDb(db), on_index_change=index_changes, poll_interval=0.02)
+    watchers.append(watcher.start())
+
+    assert wait_for(lambda: watcher.mode == index_watcher.POLLING and index_changes.calls == 1)
+
+    index_store.publish_snapshot(db["index"], {"generation": 1})
+    assert wait_for(lambda: index_changes.calls == 2)
+
+
+def test_change_stream_events_are_debounced(db, monkeypatch):
+    monkeypatch.setattr(index_watcher, "EVENT_DEBOUNCE", 0.1)
+    stream = FakeStream(["files", "urls", "index", "files"])
+    monkeypatch.setattr(db, "watch", lambda *args, **kwargs: stream, raising=False)
+    index_changes, source_changes = Counter(), Counter()
+    watcher = index_watcher.IndexWatcher(
+        db, on_index_change=index_changes, on_sources_change=source_changes, mode="auto"
+    )
+
+    def stop_when_quiet():
+        if not stream.events and source_changes.calls == 2:
+            watcher.stop()
+        return original_try_next()
+
+    original_try_next = stream.try_next
+    stream.try_next = stop_when_quiet
+    watcher._watch_change_streams()
+
+    # One notification when the stream opens, then one for the whole burst
+    assert (index_changes.calls, source_changes.calls) == (2, 2)
+    assert watcher.mode == index_watcher.CHANGE_STREAMS
+    assert not watcher.healthy
+
+
+def replica_set_uri():
+    uri = os.getenv("MONGO_URI")
+    if not uri:
+        return None
+    import pymongo
+    try:
+        with pymongo.MongoClient(uri, serverSelectionTimeoutMS=2000) as client:
+            return uri if client.admin.command("hello").get("setName") else None
+    except Exception:
+        return None
+
+
+@pytest.mark.skipif(replica_set_uri() is None, reason="MONGO_URI does not point at a replica set")
+def test_change_streams_against_replica_set(watchers):
+    import pymongo
+
+    client = pymongo.MongoClient(replica_set_uri())
+    db = client[f"index_watcher_test_{uuid.uuid4().hex[:8]}"]
+    try:
+        index_changes, source_changes = Counter(), Counter()
+        watcher = index_watcher.IndexWatcher(db, on_index_change=index_changes, on_sources_change=source_changes)
+        watchers.append(watcher.start())
+        assert wait_for(lambda: watcher.mode == index_watcher.CHANGE_STREAMS and index_changes.calls == 1, 10)
+
+        db["files"].insert_one({"filename": "a.pdf"})
+        assert wait_for(lambda: source_changes.calls == 2, 10)
+
+        index_store.publish_snapshot(db["index"], {"generation": 1})
+        assert wait_for(lambda: index_changes.calls == 2, 10)
+        assert source_changes.calls == 2
+    finally:
+        client.drop_database(db.name)
+        client.close()
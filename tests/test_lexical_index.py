@@ -0,0 +1,66 @@
+from llama_index.core.embeddings import MockEmbedding
+from llama_index.core.schema import QueryBundle, TextNode
+
+import index_store
+import lexical_index
+import metadata_filters
+import vector_search
+
+
+def make_node(node_id, text, file_name):
+    return TextNode(id_=node_id, text=text, embedding=[1.0, 0.0, 0.5], metadata={"file_name": file_name})
+
+
+def make_index():
+    return index_store.build_vector_index(
+        [
+            make_node("a", "Patlak plot of FDG uptake", "2021_Smith_Patlak_Brain.pdf"),
+            make_node("b", "Logan graphical analysis", "2022_Logan_Graphical_Heart.pdf"),
+        ],
+        embed_model=MockEmbedding(embed_dim=3)
+    )
+
+
+def hybrid_retriever(index):
+    return lexical_index.HybridRetriever(
+        index, vector_search.make_retriever(index, similarity_top_k=2), similarity_top_k=4
+    )
+
+
+def test_rebuilt_after_changes_that_keep_the_chunk_count():
+    index = make_index()
+    assert lexical_index.get_lexical_index(index).search("patlak", 5)[0][0] == "a"
+    assert metadata_filters.get_field_index(index).node_ids == ["a", "b"]
+
+    # Replace a chunk behind the hooks' back: the count stays at two
+    index.delete_nodes(["a"], delete_from_docstore=True)
+    index.insert_nodes([make_node("c", "Patlak analysis of dynamic PET", "2024_New_Patlak_Lung.pdf")])
+
+    assert [node_id for node_id, _ in lexical_index.get_lexical_index(index).search("patlak", 5)] == ["c"]
+    assert sorted(metadata_filters.get_field_index(index).node_ids) == ["b", "c"]
+    results = hybrid_retriever(index).retrieve(QueryBundle("patlak", embedding=[1.0, 0.0, 0.5]))
+    assert sorted(result.node.node_id for result in results) == ["b", "c"]
+
+
+def test_hooks_keep_the_index_current_without_rebuilding():
+    index = make_index()
+    lexical = lexical_index.get_lexical_index(index)
+
+    node = make_node("c", "Patlak analysis of dynamic PET", "2024_New_Patlak_Lung.pdf")
+    index.insert_nodes([node])
+    lexical_index.add_nodes(index, [node])
+
+    assert lexical_index.get_lexical_index(index) is lexical
+    assert len(lexical) == 3
+
+
+def test_retriever_skips_chunks_missing_from_the_docstore():
+    index = make_index()
+    lexical = lexical_index.get_lexical_index(index)
+
+    # A BM25 index that still lists a deleted chunk but looks current
+    index.delete_nodes(["a"], delete_from_docstore=True)
+    lexical.index_generation = index_store.get_index_generation(index)
+
+    results = hybrid_retriever(index).retrieve(QueryBundle("patlak", embedding=[1.0, 0.0, 0.5]))
+    assert [result.node.node_id for result in results] == ["b"]
@@ -0,0 +1,210 @@
+"""
+URL Cache Module
+MongoDB store of cleaned URL text, revalidated with conditional GETs on rebuilds
+"""
+
+import os
+import time
+import hashlib
+import threading
+from urllib.parse import urlsplit
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import requests
+from bs4 import BeautifulSoup
+
+# Stored text younger than this many seconds is reused without any request (0 always revalidates)
+URL_CACHE_TTL = float(os.getenv("URL_CACHE_TTL", "86400"))
+
+# Seconds to wait for a page
+URL_FETCH_TIMEOUT = 10
+
+# Concurrent page downloads in total and per host
+URL_FETCH_WORKERS = int(os.getenv("URL_FETCH_WORKERS", "16"))
+URL_FETCH_PER_HOST = int(os.getenv("URL_FETCH_PER_HOST", "4"))
+
+# Seconds all URLs of a rebuild may take together; URLs not done by then are reported as failed
+URL_FETCH_DEADLINE = float(os.getenv("URL_FETCH_DEADLINE", "120"))
+
+# How a URL's text was obtained
+FRESH = "fresh"                # within the TTL, no request sent
+NOT_MODIFIED = "not_modified"  # server answered 304
+UNCHANGED = "unchanged"        # downloaded again, but the body hash matched
+FETCHED = "fetched"            # new or changed page, parsed again
+
+
+def clean_html(html):
+    """Visible text of an HTML page, one phrase per line."""
+    soup = BeautifulSoup(html, 'html.parser')
+
+    for script in soup(["script", "style"]):
+        script.extract()
+
+    text = soup.get_text(separator='\n')
+
+    lines = (line.strip() for line in text.splitlines())
+    chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
+    return '\n'.join(chunk for chunk in chunks if chunk)
+
+
+def fetch_url_text(url, collection, session=None, ttl=None, timeout=None):
+    """
+    Get the cleaned text of a URL, reusing the stored copy whenever the page hasn't changed.
+
+    Args:
+        url (str): page to fetch
+        collection: MongoDB collection backing the store, keyed by URL
+        session: optional requests session to reuse connections
+        ttl (float): freshness in seconds (defaults to URL_CACHE_TTL)
+        timeout (float): request timeout in seconds (defaults to URL_FETCH_TIMEOUT)
+
+    Returns:
+        tuple: (text, how) where how is FRESH, NOT_MODIFIED, UNCHANGED or FETCHED
+
+    Raises:
+        requests.RequestException: if the page can't be fetched
+    """
+    ttl = URL_CACHE_TTL if ttl is None else ttl
+    timeout = timeout or URL_FETCH_TIMEOUT
+    http = session or requests
+    now = datetime.now()
+
+    stored = collection.find_one({"_id": url})
+    if stored and ttl > 0 and now - stored["checked_at"] < timedelta(seconds=ttl):
+        return stored["text"], FRESH
+
+    headers = {}
+    if stored:
+        if stored.get("etag"):
+            headers["If-None-Match"] = stored["etag"]
+        if stored.get("last_modified"):
+            headers["If-Modified-Since"] = stored["last_modified"]
+
+    response = http.get(url, headers=headers, timeout=timeout)
+
+    if stored and response.status_code == 304:
+        collection.update_one({"_id": url}, {"$set": {"checked_at": now}})
+        return stored["text"], NOT_MODIFIED
+
+    response.raise_for_status()
+
+    # Servers without validators still let us skip re-parsing an identical body
+    content_hash = hashlib.sha256(response.content).hexdigest()
+    if stored and stored.get("content_hash") == content_hash:
+        text, how = stored["text"], UNCHANGED
+    else:
+        text, how = clean_html(response.text), FETCHED
+
+    collection.replace_one(
+        {"_id": url},
+        {
+            "_id": url,
+            "text": text,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "content_hash": content_hash,
+            "checked_at": now
+        },
+        upsert=True
+    )
+    return text, how
+
+
+def make_session(pool_size=None):
+    """A requests session whose connection pool fits pool_size concurrent downloads."""
+    pool_size = pool_size or URL_FETCH_WORKERS
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def fetch_urls_concurrently(urls, collection, max_workers=None, per_host=None, deadline=None):
+    """
+    Fetch many URLs through fetch_url_text on a shared pooled session, at most
+    per_host at a time from any one host.
+
+    Args:
+        urls (list): pages to fetch
+        collection: MongoDB collection backing the store
+        max_workers (int): concurrent downloads (defaults to URL_FETCH_WORKERS)
+        per_host (int): concurrent downloads per host (defaults to URL_FETCH_PER_HOST)
+        deadline (float): seconds for all URLs together (defaults to URL_FETCH_DEADLINE)
+
+    Yields:
+        (url, text, how, error) tuples in completion order. text and how are None
+        when error is set
+    """
+    max_workers = max_workers or URL_FETCH_WORKERS
+    per_host = per_host or URL_FETCH_PER_HOST
+    deadline = deadline or URL_FETCH_DEADLINE
+    if not urls:
+        return
+
+    session = make_session(max_workers)
+    host_slots = {}
+    host_slots_lock = threading.Lock()
+    expires_at = time.monotonic() + deadline
+
+    def fetch(url):
+        host = urlsplit(url).netloc.lower()
+        with host_slots_lock:
+            slots = host_slots.setdefault(host, threading.Semaphore(per_host))
+
+        # Waiting for a busy host counts against the deadline too
+        if not slots.acquire(timeout=max(0.0, expires_at - time.monotonic())):
+            raise TimeoutError("Fetch deadline exceeded while waiting for other pages of this host")
+        try:
+            # Never let a single request outlive the deadline
+            timeout = min(URL_FETCH_TIMEOUT, max(0.1, expires_at - time.monotonic()))
+            return fetch_url_text(url, collection, session=session, timeout=timeout)
+        finally:
+            slots.release()
+
+    # Interleave hosts so workers blocked on one busy host don't starve the others
+    by_host = {}
+    for url in urls:
+        by_host.setdefault(urlsplit(url).netloc.lower(), []).append(url)
+    host_queues = list(by_host.values())
+    ordered_urls = [
+        host_urls[position]
+        for position in range(max(len(host_urls) for host_urls in host_queues))
+        for host_urls in host_queues if position < len(host_urls)
+    ]
+
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        in_flight = {executor.submit(fetch, url): url for url in ordered_urls}
+        while in_flight:
+            done, _ = wait(
+                list(in_flight),
+                timeout=max(0.0, expires_at - time.monotonic()),
+                return_when=FIRST_COMPLETED
+            )
+            if not done:
+                for url in in_flight.values():
+                    yield url, None, None, f"Not fetched within the {deadline:g} second deadline"
+                return
+
+            for future in done:
+                url = in_flight.pop(future)
+                try:
+                    text, how = future.result()
+                except Exception as e:
+                    yield url, None, None, str(e)
+                else:
+                    yield url, text, how, None
+    finally:
+        # Requests still running finish in the background; their results are dropped
+        executor.shutdown(wait=False, cancel_futures=True)
+        session.close()
+
+
+def evict_urls(collection, urls=None):
+    """Remove the stored text of the given URLs, or of all URLs if None."""
+    if urls is None:
+        collection.delete_many({})
+    elif urls:
+        collection.delete_many({"_id": {"$in": list(urls)}})
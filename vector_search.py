@@ -0,0 +1,366 @@
+"""
+Vector Search Module
+Top-k retrieval over one pre-normalized float32 matrix per index, scored with a single matrix
+product, or through an IVF index over that matrix when VECTOR_SEARCH_BACKEND is "ann"
+
+Compare it with the default retriever at several library sizes with:
+
+    python vector_search.py --benchmark
+"""
+
+import os
+import time
+import weakref
+import argparse
+import threading
+
+import numpy as np
+from llama_index.core import QueryBundle
+from llama_index.core.retrievers import BaseRetriever, VectorIndexRetriever
+from llama_index.core.schema import NodeWithScore
+from llama_index.core.vector_stores import SimpleVectorStore
+from llama_index.core.vector_stores.types import VectorStoreQuery
+
+import ann_index
+import quantized_store
+
+# "numpy" scores the whole matrix at once, "ann" only the IVF lists closest to the query
+# (see ann_index), "default" keeps LlamaIndex's VectorIndexRetriever
+VECTOR_SEARCH_BACKEND = os.getenv("VECTOR_SEARCH_BACKEND", "numpy").lower()
+
+# Queries scored together in one matrix product, bounding the score matrix to this many rows
+QUERY_BLOCK_SIZE = 32
+
+
+def normalize_rows(vectors, copy=True):
+    """
+    Vectors as float32 rows scaled to unit length (zero vectors stay zero).
+    With copy=False a float32 array is scaled in place instead of copied.
+    """
+    vectors = np.array(vectors, dtype=np.float32, ndmin=2, copy=True if copy else None)
+    # einsum avoids the full-size temporary np.linalg.norm would allocate
+    norms = np.sqrt(np.einsum("ij,ij->i", vectors, vectors))[:, None]
+    vectors /= np.where(norms > 0, norms, 1.0)
+    return vectors
+
+
+class DenseMatrix:
+    """
+    Unit-normalized embedding matrix of an index with the node id of every row.
+    A float32 array passed as vectors is normalized in place, not copied;
+    with normalized=True it is used as is (e.g. a read-only memory map).
+    """
+
+    def __init__(self, node_ids, vectors, normalized=False):
+        self.node_ids = list(node_ids)
+        if self.node_ids and normalized:
+            self._rows = vectors
+        elif self.node_ids:
+            self._rows = normalize_rows(vectors, copy=False)
+        else:
+            self._rows = np.empty((0, 0), dtype=np.float32)
+        # IVF lists over the rows, searched instead of the whole matrix when set
+        self.ann = None
+        # Set when nodes were deleted; the matrix is then rebuilt before the next search
+        self.stale = False
+        self._row_of = None
+
+    @classmethod
+    def from_index(cls, index):
+        vector_store = index.vector_store
+        if isinstance(vector_store, quantized_store.MappedVectorStore):
+            # Loaded indexes share the memory-mapped matrix of the local index cache
+            search_matrix = vector_store.search_matrix
+            if search_matrix is not None and len(search_matrix[0]) == len(index.index_struct.nodes_dict):
+                return cls(*search_matrix, normalized=True)
+            node_ids = list(index.index_struct.nodes_dict)
+            return cls(node_ids, vector_store.get_vectors(node_ids))
+        if isinstance(vector_store, SimpleVectorStore) and vector_store.data.embedding_dict:
+            embedding_dict = vector_store.data.embedding_dict
+            return cls(list(embedding_dict), list(embedding_dict.values()))
+        node_ids = list(index.index_struct.nodes_dict)
+        return cls(node_ids, [vector_store.get(node_id) for node_id in node_ids])
+
+    def __len__(self):
+        return len(self.node_ids)
+
+    @property
+    def matrix(self):
+        return self._rows[:len(self.node_ids)]
+
+    def append(self, node_ids, vectors):
+        """Add rows, growing the matrix by doubling so repeated inserts stay cheap."""
+        vectors = normalize_rows(vectors)
+        start = len(self)
+        needed = start + len(vectors)
+        if needed > len(self._rows) or self._rows.shape[1] != vectors.shape[1]:
+            rows = np.empty((max(needed, 2 * len(self._rows)), vectors.shape[1]), dtype=np.float32)
+            rows[:start] = self.matrix
+            self._rows = rows
+        self._rows[start:needed] = vectors
+        self.node_ids.extend(node_ids)
+        if self._row_of is not None:
+            self._row_of.update((node_id, row) for row, node_id in enumerate(node_ids, start=start))
+        if self.ann is not None:
+            self.ann.assign(self.matrix, start=start)
+
+    def rows_for(self, node_ids):
+        """Rows of the given node ids (ids not in the matrix are skipped)."""
+        if self._row_of is None:
+            self._row_of = {node_id: row for row, node_id in enumerate(self.node_ids)}
+        rows = [self._row_of.get(node_id) for node_id in node_ids]
+        return np.array(sorted(row for row in rows if row is not None), dtype=np.int64)
+
+    def search(self, query_vectors, top_k, rows=None):
+        """
+        Cosine top-k for one or many queries.
+
+        Args:
+            query_vectors: one query vector or a matrix of shape queries x dim
+            top_k (int): results per query
+            rows: only score these rows (e.g. the chunks passing a metadata filter),
+                so narrower filters search faster
+
+        Returns:
+            tuple: (scores, rows), both of shape queries x min(top_k, rows), best first
+        """
+        queries = normalize_rows(query_vectors)
+        candidates = self.matrix if rows is None else self.matrix[rows]
+        k = min(top_k, len(candidates))
+        if k == 0:
+            empty = np.empty((len(queries), 0))
+            return empty.astype(np.float32), empty.astype(np.int64)
+        if self.ann is not None and rows is None:
+            found = self.ann.search(self.matrix, queries, k)
+            if found is not None:
+                return found
+
+        top_scores = np.empty((len(queries), k), dtype=np.float32)
+        top_rows = np.empty((len(queries), k), dtype=np.int64)
+        for start in range(0, len(queries), QUERY_BLOCK_SIZE):
+            scores = queries[start:start + QUERY_BLOCK_SIZE] @ candidates.T
+            if k < scores.shape[1]:
+                positions = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            else:
+                positions = np.broadcast_to(np.arange(scores.shape[1]), scores.shape)
+            row_scores = np.take_along_axis(scores, positions, axis=1)
+            order = np.argsort(-row_scores, axis=1)
+            top_rows[start:start + len(scores)] = np.take_along_axis(positions, order, axis=1)
+            top_scores[start:start + len(scores)] = np.take_along_axis(row_scores, order, axis=1)
+        if rows is not None:
+            top_rows = rows[top_rows]
+        return top_scores, top_rows
+
+
+# One matrix per index object; shared index versions never change, so their matrix is built once
+_matrices = weakref.WeakKeyDictionary()
+_matrices_lock = threading.Lock()
+
+
+def _get_dense_matrix(index):
+    dense = _matrices.get(index)
+    # Also catches changes made without add_nodes() or invalidate() that changed the node count
+    if dense is None or dense.stale or len(dense) != len(index.index_struct.nodes_dict):
+        previous = dense
+        dense = DenseMatrix.from_index(index)
+        if previous is not None and previous.ann is not None:
+            # Keep the trained centroids and only regroup the rows
+            _set_ann(dense, ann_index.IVFIndex(previous.ann.centroids, previous.ann.trained_rows, previous.ann.manifest))
+        _matrices[index] = dense
+
+    if VECTOR_SEARCH_BACKEND == "ann" and len(dense) >= ann_index.ANN_MIN_ROWS:
+        if dense.ann is None or dense.ann.needs_retraining(len(dense)):
+            dense.ann = ann_index.IVFIndex.train(dense.matrix)
+    return dense
+
+
+def _set_ann(dense, ann):
+    if len(dense) and ann.centroids.shape[1] == dense.matrix.shape[1]:
+        ann.assign(dense.matrix)
+        dense.ann = ann
+
+
+def get_dense_matrix(index):
+    """
+    The DenseMatrix of an index, built on first use and after invalidate().
+    With the "ann" backend, large indexes get IVF lists, trained here if needed.
+    """
+    with _matrices_lock:
+        return _get_dense_matrix(index)
+
+
+def get_ann_index(index):
+    """The IVFIndex of an index, trained now if it needs one, or None with exact search."""
+    if VECTOR_SEARCH_BACKEND != "ann" or not uses_dense_search(index):
+        return None
+    return get_dense_matrix(index).ann
+
+
+def attach_ann(index, ann):
+    """Search an index through the given IVF centroids, e.g. ones read from MongoDB."""
+    with _matrices_lock:
+        dense = _matrices.get(index)
+        if dense is None or dense.stale:
+            dense = DenseMatrix.from_index(index)
+            _matrices[index] = dense
+        _set_ann(dense, ann)
+
+
+def copy_ann(source_index, target_index):
+    """Give a copy of an index the IVF centroids of the original instead of retraining them."""
+    with _matrices_lock:
+        dense = _matrices.get(source_index)
+        ann = dense.ann if dense is not None else None
+    if ann is not None:
+        attach_ann(target_index, ann_index.IVFIndex(ann.centroids, ann.trained_rows, ann.manifest))
+
+
+def add_nodes(index, nodes):
+    """Add nodes just inserted into an index to its matrix and IVF lists without a rebuild."""
+    with _matrices_lock:
+        dense = _matrices.get(index)
+        if dense is None or dense.stale:
+            return
+        if len(dense) + len(nodes) != len(index.index_struct.nodes_dict):
+            dense.stale = True
+            return
+        node_ids = [node.node_id for node in nodes]
+        dense.append(node_ids, [index.vector_store.get(node_id) for node_id in node_ids])
+
+
+def invalidate(index):
+    """Rebuild the matrix of an index before its next search, e.g. after nodes were deleted."""
+    with _matrices_lock:
+        dense = _matrices.get(index)
+        if dense is not None:
+            dense.stale = True
+
+
+class NumpyTopKRetriever(BaseRetriever):
+    """Retriever scoring all nodes of an index with one matrix-vector product."""
+
+    def __init__(self, index, similarity_top_k=6, node_ids=None, **kwargs):
+        self._index = index
+        self._similarity_top_k = similarity_top_k
+        # Only these nodes are searched, if given
+        self._node_ids = node_ids
+        super().__init__(**kwargs)
+
+    def _get_query_embedding(self, query_bundle):
+        if query_bundle.embedding is None:
+            query_bundle.embedding = self._index._embed_model.get_agg_embedding_from_queries(
+                query_bundle.embedding_strs
+            )
+        return query_bundle.embedding
+
+    def _to_nodes(self, dense, scores, rows):
+        nodes_dict = self._index.index_struct.nodes_dict
+        node_ids = [nodes_dict.get(dense.node_ids[row], dense.node_ids[row]) for row in rows]
+        nodes = self._index.docstore.get_nodes(node_ids)
+        return [NodeWithScore(node=node, score=float(score)) for node, score in zip(nodes, scores)]
+
+    def _search(self, dense, query_vectors):
+        rows = dense.rows_for(self._node_ids) if self._node_ids is not None else None
+        return dense.search(query_vectors, self._similarity_top_k, rows=rows)
+
+    def _retrieve(self, query_bundle):
+        dense = get_dense_matrix(self._index)
+        scores, rows = self._search(dense, self._get_query_embedding(query_bundle))
+        return self._to_nodes(dense, scores[0], rows[0])
+
+    def retrieve_many(self, queries):
+        """Retrieve for many query strings at once, scoring them in blocks of QUERY_BLOCK_SIZE."""
+        bundles = [QueryBundle(query) if isinstance(query, str) else query for query in queries]
+        query_vectors = [self._get_query_embedding(bundle) for bundle in bundles]
+        dense = get_dense_matrix(self._index)
+        scores, rows = self._search(dense, query_vectors)
+        return [self._to_nodes(dense, query_scores, query_rows) for query_scores, query_rows in zip(scores, rows)]
+
+
+def uses_dense_search(index):
+    """True if queries on this index are answered from its DenseMatrix."""
+    return (
+        VECTOR_SEARCH_BACKEND in ("numpy", "ann")
+        and type(index.vector_store) in (SimpleVectorStore, quantized_store.MappedVectorStore)
+    )
+
+
+def make_retriever(index, similarity_top_k=6, node_ids=None):
+    """
+    The retriever for an index: NumpyTopKRetriever over the full-precision
+    stores, VectorIndexRetriever for other stores (the quantized one already
+    scores in bulk) or when VECTOR_SEARCH_BACKEND is "default". With node_ids
+    only those nodes are searched.
+    """
+    if uses_dense_search(index):
+        return NumpyTopKRetriever(index, similarity_top_k=similarity_top_k, node_ids=node_ids)
+    return VectorIndexRetriever(index=index, similarity_top_k=similarity_top_k, node_ids=node_ids)
+
+
+def benchmark(sizes, dim=768, queries=20, top_k=6, baseline_max=100000, seed=0):
+    """
+    Milliseconds per query of SimpleVectorStore.query (what VectorIndexRetriever
+    runs) and of DenseMatrix.search, one query at a time and batched.
+
+    Yields:
+        dict per size; the baseline is skipped above baseline_max chunks, where
+        its Python float lists would need tens of GB
+    """
+    rng = np.random.default_rng(seed)
+    for size in sizes:
+        vectors = rng.standard_normal((size, dim), dtype=np.float32)
+        query_vectors = rng.standard_normal((queries, dim), dtype=np.float32)
+        node_ids = [str(row) for row in range(size)]
+        result = {"chunks": size, "default_ms": None}
+
+        if size <= baseline_max:
+            store = SimpleVectorStore()
+            store.data.embedding_dict = dict(zip(node_ids, vectors.tolist()))
+            started_at = time.perf_counter()
+            for query in query_vectors:
+                store.query(VectorStoreQuery(query_embedding=query.tolist(), similarity_top_k=top_k))
+            result["default_ms"] = (time.perf_counter() - started_at) / queries * 1000
+            del store
+
+        started_at = time.perf_counter()
+        dense = DenseMatrix(node_ids, vectors)
+        result["build_ms"] = (time.perf_counter() - started_at) * 1000
+        del vectors
+
+        started_at = time.perf_counter()
+        for query in query_vectors:
+            dense.search(query, top_k)
+        result["numpy_ms"] = (time.perf_counter() - started_at) / queries * 1000
+
+        started_at = time.perf_counter()
+        dense.search(query_vectors, top_k)
+        result["numpy_batched_ms"] = (time.perf_counter() - started_at) / queries * 1000
+        yield result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the NumPy top-k retriever against the default one")
+    parser.add_argument("--benchmark", action="store_true", help="run the benchmark")
+    parser.add_argument("--sizes", default="10000,100000,1000000", help="comma-separated chunk counts")
+    parser.add_argument("--dim", type=int, default=768, help="embedding dimensions (768 for PubMedBERT)")
+    parser.add_argument("--queries", type=int, default=20, help="queries per size")
+    parser.add_argument("--baseline-max", type=int, default=100000, help="largest size to run the default retriever on")
+    args = parser.parse_args()
+    if not args.benchmark:
+        parser.print_help()
+        return
+
+    sizes = [int(size) for size in args.sizes.split(",")]
+    print(f"{args.dim} dimensions, top 6, {args.queries} queries, ms per query")
+    print(f"{'chunks':>9} {'default':>9} {'numpy':>9} {'batched':>9} {'build ms':>9}")
+    for result in benchmark(sizes, dim=args.dim, queries=args.queries, baseline_max=args.baseline_max):
+        default_ms = f"{result['default_ms']:.1f}" if result["default_ms"] is not None else "-"
+        print(
+            f"{result['chunks']:>9} {default_ms:>9} {result['numpy_ms']:>9.2f} "
+            f"{result['numpy_batched_ms']:>9.2f} {result['build_ms']:>9.0f}",
+            flush=True
+        )
+
+
+if __name__ == "__main__":
+    main()